@@ -342,6 +342,57 @@ class Config():
     # control subthreading of database actions on Marc.commit() and Auth.merge() for debugging
     threading = True
 
+    # the background worker threads for the side effects of database writes, and the 
+    # number of tasks that can wait for them before writes block. see dlx.db.Executor
+    executor_workers = 8
+    executor_queue_size = 1000
+    # the exceptions of failed tasks kept until they are raised by DB.flush
+    executor_max_errors = 1000
+
+    # pending writes to the field text indexes are merged and written when the 
+    # buffer holds this many documents, or the oldest is this many seconds old. 
+    # the pending writes are lost if the process is killed before they are 
+    # written, leaving entries missing from the indexes until they are rebuilt
+    # by the build-logical-fields script with --text-indexes. see dlx.db.WriteBuffer
+    write_buffer_size = 1000
+    write_buffer_seconds = 5
+
+    # the number of new record IDs each process reserves at a time. see Marc._increment_ids
+    id_block_size = 100
+
+    # the number of versions stored in each document of the record history
+    # buckets collections. see Marc._push_history
+    history_bucket_size = 100
+
+    # store the history versions as deltas against the previous version, with
+    # a full version every `history_keyframe_interval` versions of each bucket
+    history_deltas = False
+    history_keyframe_interval = 10
+
+    # limits for the auth lookup caches, by namespace. see dlx.marc.cache
+    auth_cache = {
+        'value': {'maxsize': 1000000},          # xref -> {code: value}
+        'lang': {'maxsize': 100000},            # xref -> {code: {language: value}}
+        'xref': {'maxsize': 100000},            # heading value -> {auth tag: {code: [xrefs]}}
+        'multi': {'maxsize': 100000, 'ttl': 86400},     # (auth tag, subfields) -> [xrefs]
+        'ambiguous': {'maxsize': 100000, 'ttl': 86400}, # (tag, record type, subfields) -> xref
+        'partial': {'maxsize': 10000, 'ttl': 3600} # (tag, code, string) -> [Auth]
+    }
+
+    # namespaces stored in the shared cache (DB.cache), if there is one. the namespaces
+    # keyed by derived values must have an index in CacheNamespaces.indexes, so they can
+    # be evicted without scanning the shared cache
+    auth_cache_prefixes = {
+        'value': 'authvalues:', 
+        'lang': 'authlangcache:', 
+        'xref': 'xauthcache:', 
+        'multi': 'xauthmulticache:', 
+        'ambiguous': 'authambiguouscache:'
+    }
+
+    # shared namespaces stored as one hash per key, so entries can be updated without being read first
+    auth_cache_hashes = ['value']
+
     # utility functions
     @staticmethod
     def is_authority_controlled(record_type, tag, code):
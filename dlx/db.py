@@ -2,12 +2,16 @@
 Provides the DB class for connecting to and accessing the database.
 """
 
-import re, certifi, redis, valkey
-from pymongo import MongoClient
+import os, re, time, atexit, queue, threading, logging, certifi, redis, valkey
+from concurrent.futures import Future
+from pymongo import MongoClient, UpdateOne
+from dlx.config import Config
 
 #from pymongo.errors import OperationFailure, ServerSelectionTimeoutError
 from mongomock import MongoClient as MockClient
 
+LOGGER = logging.getLogger()
+
 class DB():
     """Provides a global database connection.
 
@@ -25,6 +29,10 @@ class DB():
     files : pymongo.collection.Collection
     config : dict
     is_atlas : bool
+    executor : dlx.db.Executor
+        Runs the background tasks of database writes
+    buffer : dlx.db.WriteBuffer
+        Merges the writes to the field text indexes
     """
 
     client = None
@@ -102,6 +110,11 @@ class DB():
             else:
                 raise Exception('No database name was provided and could not parse database name from connection string')
 
+        if DB.connected:
+            # write the pending writes to the current database
+            DB.buffer.flush()
+
+        DB.buffer.indexes.clear()
         DB.connected = True
         DB.config['connection_string'] = connection_string
         print(f'connected to database "{DB.database_name}"')
@@ -131,5 +144,243 @@ class DB():
     @classmethod
     def disconnect(cls):
         if DB.connected:
-            DB.client.close()
-            DB.connected = False
+            try:
+                DB.flush()
+            finally:
+                DB.client.close()
+                DB.connected = False
+
+    @classmethod
+    def flush(cls, timeout=None):
+        """Waits for the background tasks of database writes to finish, and
+        writes the pending buffered writes.
+
+        Parameters
+        ----------
+        timeout : int, float
+            Seconds to wait. Waits indefinitely if None
+
+        Raises
+        ------
+        dlx.db.TaskErrors
+            With the exceptions raised by the tasks that failed since the last flush.
+        TimeoutError
+            If the tasks did not finish in time.
+        """
+
+        try:
+            DB.executor.flush(timeout=timeout)
+        finally:
+            DB.buffer.flush()
+
+class TaskErrors(Exception):
+    def __init__(self, errors, *, dropped=0):
+        self.errors = errors
+        self.dropped = dropped # failures not kept in `errors`
+        super().__init__(f'{len(errors) + dropped} background task(s) failed: ' + '; '.join([repr(x) for x in errors[:10]]))
+
+class Executor():
+    """Bounded pool of worker threads for the background tasks of database 
+    writes. Tasks wait in a bounded queue, and `submit` blocks while the queue
+    is full, so producers are slowed down to the rate of the workers instead 
+    of starting more threads. The exceptions raised by the tasks are logged,
+    and collected and raised together by `flush`. Only the first 
+    `Config.executor_max_errors` exceptions since the last flush are kept.
+
+    Tasks run in the calling thread if the database is "testing", if 
+    `Config.threading` is False, or if they are submitted by a task.
+
+    Keyword arguments
+    -----------------
+    workers : int
+        Defaults to `Config.executor_workers`
+    queue_size : int
+        Defaults to `Config.executor_queue_size`
+    """
+
+    def __init__(self, *, workers=None, queue_size=None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue = None
+        self.threads = []
+        self.errors = []
+        self.dropped = 0
+        self.pid = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def submit(self, function, *args, **kwargs) -> Future:
+        future = Future()
+
+        if DB.database_name == 'testing' or Config.threading == False or getattr(self._local, 'worker', False):
+            # exceptions propagate to the caller
+            future.set_running_or_notify_cancel()
+            future.set_result(function(*args, **kwargs))
+        else:
+            self._start()
+            self.queue.put((future, function, args, kwargs)) # blocks while the queue is full
+
+        return future
+
+    def flush(self, timeout=None):
+        if self.queue and self.pid == os.getpid() and not getattr(self._local, 'worker', False):
+            with self.queue.all_tasks_done:
+                if not self.queue.all_tasks_done.wait_for(lambda: self.queue.unfinished_tasks == 0, timeout=timeout):
+                    raise TimeoutError(f'{self.queue.unfinished_tasks} background task(s) still running')
+
+        with self._lock:
+            errors, dropped, self.errors, self.dropped = self.errors, self.dropped, [], 0
+
+        if errors:
+            raise TaskErrors(errors, dropped=dropped)
+
+    def _start(self):
+        # the workers are started on first use, and again after a fork
+        with self._lock:
+            if self.pid != os.getpid():
+                self.pid = os.getpid()
+                self.queue = queue.Queue(maxsize=self.queue_size or Config.executor_queue_size)
+                self.threads = [threading.Thread(target=self._work, daemon=True) for i in range(self.workers or Config.executor_workers)]
+                [thread.start() for thread in self.threads]
+
+    def _work(self):
+        self._local.worker = True
+
+        while True:
+            future, function, args, kwargs = self.queue.get()
+
+            try:
+                if future.set_running_or_notify_cancel():
+                    future.set_result(function(*args, **kwargs))
+            except Exception as err:
+                LOGGER.exception(err)
+                future.set_exception(err)
+
+                with self._lock:
+                    if len(self.errors) < Config.executor_max_errors:
+                        self.errors.append(err)
+                    else:
+                        self.dropped += 1
+            finally:
+                self.queue.task_done()
+
+class WriteBuffer():
+    """Write-behind buffer for upserts by `_id`. The `$set` and `$addToSet`
+    updates of the pending writes are merged by collection and `_id`, and 
+    written with one bulk write per collection when the buffer holds `size`
+    documents, when the oldest pending write is `seconds` old, or on `flush`.
+    The indexes created with `create_index` are remembered, so they are only
+    created once per connection.
+
+    Writes are not buffered if the database is "testing". If 
+    `Config.threading` is False, writes are flushed by age only when more
+    are added.
+
+    Keyword arguments
+    -----------------
+    size : int
+        Defaults to `Config.write_buffer_size`
+    seconds : int, float
+        Defaults to `Config.write_buffer_seconds`
+    """
+
+    def __init__(self, *, size=None, seconds=None):
+        self.size = size
+        self.seconds = seconds
+        self.pending = {} # collection full name -> (collection, {_id: update})
+        self.count = 0
+        self.since = None
+        self.timer = None
+        self.indexes = set()
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+
+    def add(self, collection, updates):
+        """Adds updates by `_id` to the buffer, as (filter, update, upsert) 
+        tuples"""
+
+        with self._lock:
+            if self.pid != os.getpid():
+                # the pending writes belong to the parent process
+                self.pid, self.pending, self.count, self.since, self.timer = os.getpid(), {}, 0, None, None
+
+            pending = self.pending.setdefault(collection.full_name, (collection, {}))[1]
+
+            for query, update, upsert in updates:
+                if list(query.keys()) != ['_id']:
+                    raise ValueError(f'Buffered writes must be by _id: {query}')
+
+                if query['_id'] not in pending:
+                    self.count += 1
+
+                merged = pending.setdefault(query['_id'], {'update': {}, 'upsert': False})
+                merged['upsert'] = merged['upsert'] or upsert
+
+                for operator, values in update.items():
+                    target = merged['update'].setdefault(operator, {})
+
+                    if operator == '$set':
+                        target.update(values)
+                    elif operator == '$addToSet':
+                        for field, value in values.items():
+                            each = target.setdefault(field, {'$each': []})['$each']
+                            each += [x for x in (value['$each'] if isinstance(value, dict) and '$each' in value else [value]) if x not in each]
+                    else:
+                        raise ValueError(f'Operator {operator} can\'t be buffered')
+
+            self.since = self.since or time.monotonic()
+            full = self.count >= (self.size or Config.write_buffer_size)
+            old = time.monotonic() - self.since >= (self.seconds or Config.write_buffer_seconds)
+            background = DB.database_name != 'testing' and Config.threading != False
+
+            if background and not full and self.timer is None:
+                # flush when the pending writes are old enough, if no more are added
+                self.timer = threading.Timer(self.seconds or Config.write_buffer_seconds, lambda: DB.executor.submit(self.flush))
+                self.timer.daemon = True
+                self.timer.start()
+
+        if DB.database_name == 'testing' or full or old:
+            self.flush()
+
+    def create_index(self, collection, keys, **kwargs):
+        """Creates the index, if it hasn't already been created by this buffer
+        since connecting"""
+
+        key = (collection.full_name, repr(keys), repr(sorted(kwargs.items())))
+
+        if key not in self.indexes:
+            collection.create_index(keys, **kwargs)
+            self.indexes.add(key)
+
+    def flush(self):
+        """Writes the pending writes"""
+
+        from dlx.util import bulk_write
+
+        with self._flush_lock:
+            with self._lock:
+                pending, self.pending, self.count, self.since = self.pending, {}, 0, None
+
+                if self.timer:
+                    self.timer.cancel()
+                    self.timer = None
+
+            for collection, updates in pending.values():
+                ops = [UpdateOne({'_id': _id}, x['update'], upsert=x['upsert']) for _id, x in updates.items() if x['update']]
+
+                if ops:
+                    # the server refuses an empty bulk write
+                    bulk_write(collection, ops, ordered=False)
+
+DB.executor = Executor()
+DB.buffer = WriteBuffer()
+
+@atexit.register
+def _drain():
+    # the workers are daemon threads, so finish the queued tasks and write the 
+    # pending writes before exiting
+    try:
+        DB.flush()
+    except Exception as err:
+        LOGGER.exception(err)
@@ -1,18 +1,22 @@
 """dlx.marc"""
 
-import time, re, json, csv, threading, copy, typing
+import time, re, os, json, csv, threading, copy, typing, io, tempfile, mmap, itertools, hashlib
 from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, Future, wait
 from datetime import datetime, timezone
 from warnings import warn
 from xml.etree import ElementTree
-import jsonschema
+import jsonschema, bson
 from bson import SON, Regex
-from pymongo import ReturnDocument, UpdateOne, DeleteOne, CursorType
+from pymongo import ReturnDocument, UpdateOne, DeleteOne, ReplaceOne, CursorType
+from pymongo.errors import BulkWriteError
 from pymongo.collation import Collation
 from dlx.config import Config
 from dlx.db import DB
 from dlx.file import File, Identifier
 from dlx.marc.query import QueryDocument, Query, AtlasQuery, Condition, Or, Raw
+from dlx.marc.cache import CacheNamespaces, collation_key
+from dlx.marc.typeahead import TypeaheadIndex
 from dlx.util import bulk_write, Table, Tokenizer
 import logging
 
@@ -84,6 +88,13 @@ class MarcSet():
         ----------
         filter : (dict|bson.SON), dlx.marc.Query
             A valid Pymongo query filter against the database or a dlx.marc.Query object
+        auth_control : bool
+        keep_data : bool
+            If False, the records don't keep the raw document in `Marc.data`.
+            Default is True
+        lazy : bool
+            If True, the fields of each record are parsed as they are accessed.
+            Default is False
         *args, **kwargs : 
             Passes all remaining arguments to `pymongo.collection.Collection.find())
 
@@ -118,12 +129,14 @@ class MarcSet():
         self.query_params = [args, kwargs]
         Marc = self.record_class
         ac = kwargs.pop('auth_control', False)
+        keep_data = kwargs.pop('keep_data', True)
+        lazy = kwargs.pop('lazy', False)
 
         if 'collation' not in kwargs and Config.marc_index_default_collation:
             #warn('Collation not set. Using default collation set in config')
             kwargs['collation'] = Config.marc_index_default_collation
 
-        self.records = map(lambda r: Marc(r, auth_control=ac), self.handle.find(*args, **kwargs))
+        self.records = map(lambda r: Marc(r, auth_control=ac, keep_data=keep_data, lazy=lazy), self.handle.find(*args, **kwargs))
 
         return self
 
@@ -134,7 +147,9 @@ class MarcSet():
         self.query_params = [args, kwargs]
         Marc = self.record_class
         ac = kwargs.pop('auth_control', False)
-        self.records = map(lambda r: Marc(r, auth_control=ac), self.handle.aggregate(*args, **kwargs))
+        keep_data = kwargs.pop('keep_data', True)
+        lazy = kwargs.pop('lazy', False)
+        self.records = map(lambda r: Marc(r, auth_control=ac, keep_data=keep_data, lazy=lazy), self.handle.aggregate(*args, **kwargs))
 
         return self
 
@@ -165,6 +180,7 @@ class MarcSet():
         self = cls()
         self.records = []
         exceptions = []
+        records = []
 
         for temp_id in table.index.keys():
             record = cls().record_class()
@@ -219,6 +235,16 @@ class MarcSet():
                 else:
                     record.set(tag, code, value or '__null__', address=address, auth_control=False) # set a placeholder value if there is no data in that cell in the table
 
+            records.append(record)
+
+        # resolve the auth controlled values for the whole table at once
+        if auth_control:
+            found_values, found_xrefs = Auth._resolve_fields(
+                self.record_class.record_type,
+                [(f.tag, [(x.code, '' if x.value == '__null__' else x.value) for x in f.subfields]) for r in records for f in r.datafields]
+            )
+
+        for record in records:
             # go back through the record and validate auth controlled values and do checks
             for field in record.datafields:
                 if all([x.value == '__null__' for x in field.subfields]):
@@ -247,22 +273,24 @@ class MarcSet():
                                 exceptions.append(InvalidAuthXref(rtype, tag, code, xref))
                                 continue
 
-                            if Auth.lookup(xref, code):
+                            if found_values[(xref, code)] if (xref, code) in found_values else Auth.lookup(xref, code):
                                 field.subfields[i] = Linked(code, xref) # replace the subfield with a linked using the found xref
                             else:
                                 exceptions.append(InvalidAuthXref(rtype, tag, code, xref))
                                 continue
                         elif subfield.value:
                             # try to validate the string value
-                            if xrefs := Auth.xlookup(tag, code, value, record_type=rtype):
+                            xrefs = found_xrefs[(tag, code, value)] if (tag, code, value) in found_xrefs else Auth.xlookup(tag, code, value, record_type=rtype)
+
+                            if xrefs:
                                 if len(xrefs) == 1:
-                                    field.subfields[i] = Linked(code, xrefs.pop()) # replace the subfield with a linked using the found xref
+                                    field.subfields[i] = Linked(code, xrefs[0]) # replace the subfield with a linked using the found xref
                                 else:
                                     # resolve ambiguous
                                     auth_ctrled = [s for s in field.subfields if Config.is_authority_controlled(record_type=rtype, tag=tag, code=s.code)]
                                     
                                     if xref := Auth.resolve_ambiguous(tag=tag, subfields=auth_ctrled, record_type=rtype):
-                                        field.subfields[i] = Linked(code, xrefs.pop()) # replace the subfield with a linked subfield using the found xref
+                                        field.subfields[i] = Linked(code, xref) # replace the subfield with a linked subfield using the found xref
                                     else:
                                         exceptions.append(AmbiguousAuthValue(rtype, tag, code, value))
                                         continue
@@ -306,6 +334,44 @@ class MarcSet():
     def from_xml(cls, string, auth_control=False, delete_subfield_zero=True):
         return cls.from_xml_raw(ElementTree.fromstring(string), auth_control=auth_control, delete_subfield_zero=delete_subfield_zero)
 
+    @classmethod
+    def from_xml_stream(cls, source, *, auth_control=False, delete_subfield_zero=True):
+        """Instantiates a MarcSet from a MARCXML file without loading the whole
+        document. Each record is parsed as its closing tag is read, and the
+        processed elements are discarded, so memory use stays constant.
+
+        Parameters
+        ----------
+        source : str, file object
+            A path to a MARCXML file or a file object opened for reading
+        auth_control : bool
+        delete_subfield_zero : bool
+
+        Returns
+        -------
+        MarcSet
+        """
+
+        self = cls()
+
+        def read():
+            root = None
+
+            for event, element in ElementTree.iterparse(source, events=('start', 'end')):
+                if root is None:
+                    root = element
+
+                if event == 'end' and element.tag.rsplit('}', 1)[-1] == 'record':
+                    yield self.record_class.from_xml_raw(element, auth_control=auth_control, delete_subfield_zero=delete_subfield_zero)
+                    
+                    # free the processed elements
+                    element.clear()
+                    root.clear()
+
+        self.records = read()
+
+        return self
+
     @classmethod
     def from_mrk(cls, string, *, auth_control=True):
         self = cls()
@@ -318,6 +384,128 @@ class MarcSet():
                 self.records.append(record)
 
         return self
+
+    @classmethod
+    def from_mrk_stream(cls, fh: typing.TextIO, *, auth_control=True):
+        """Instantiates a MarcSet from an MRK file object, reading it line by 
+        line. A record is parsed each time a blank line or a tag that is out of
+        order is reached, so the file is never read into memory as a whole.
+
+        Parameters
+        ----------
+        fh : file object
+            An MRK file opened for reading in text mode
+        auth_control : bool
+
+        Returns
+        -------
+        MarcSet
+        """
+
+        self = cls()
+
+        def parse(lines):
+            record = self.record_class.from_mrk('\n'.join(lines), auth_control=auth_control)
+
+            if len(record.fields) > 0:
+                return record
+
+        def read():
+            lines, last_tag = [], -1
+
+            for line in fh:
+                line = line.rstrip('\r\n')
+
+                if match := re.match(r'=(\w{3})  ', line):
+                    tag = 0 if match.group(1) == 'LDR' else int(match.group(1))
+
+                    if tag < last_tag and lines:
+                        # a tag order reset means a new record is starting
+                        if record := parse(lines):
+                            yield record
+
+                        lines = []
+
+                    last_tag = tag
+                elif line.strip() == '':
+                    if lines and (record := parse(lines)):
+                        yield record
+
+                    lines, last_tag = [], -1
+                    continue
+
+                lines.append(line)
+
+            if lines and (record := parse(lines)):
+                yield record
+
+        self.records = read()
+
+        return self
+
+    @classmethod
+    def from_mrc(cls, data: bytes, *, auth_control=True):
+        self = cls()
+        self.records = [self.record_class.from_mrc(chunk, auth_control=auth_control) for chunk in MarcSet.split_mrc(data)]
+
+        return self
+
+    @classmethod
+    def from_mrc_file(cls, path, *, auth_control=True):
+        """Instantiates a MarcSet from a MARC21 (.mrc) file. The file is memory-
+        mapped and the records are read one at a time as the set is iterated, so 
+        the file is never loaded into memory as a whole.
+
+        Parameters
+        ----------
+        path : str
+        auth_control : bool
+
+        Returns
+        -------
+        MarcSet
+        """
+
+        self = cls()
+
+        def read():
+            with open(path, 'rb') as fh:
+                if os.fstat(fh.fileno()).st_size == 0:
+                    return
+
+                with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    for chunk in MarcSet.split_mrc(mm):
+                        yield self.record_class.from_mrc(chunk, auth_control=auth_control)
+
+        self.records = read()
+
+        return self
+
+    @classmethod
+    def split_mrc(cls, buffer) -> typing.Generator[bytes, None, None]:
+        # Yields the records in a buffer of concatenated MARC21 records using the
+        # record length in the first five bytes of each leader
+        offset, end = 0, len(buffer)
+
+        while offset < end:
+            if buffer[offset:offset+1] in (b'\n', b'\r'):
+                # some files have line breaks between records
+                offset += 1
+                continue
+
+            prefix = bytes(buffer[offset:offset+5])
+
+            if not prefix.isdigit():
+                raise InvalidRecordString(prefix, f'Invalid MARC21 record length at byte {offset}:')
+
+            length = int(prefix)
+
+            if length < 24:
+                # the record must at least contain its leader, otherwise the offset doesn't advance
+                raise InvalidRecordString(prefix, f'Invalid MARC21 record length at byte {offset}:')
+
+            yield buffer[offset:offset+length]
+            offset += length
     
     # instance
 
@@ -361,31 +549,190 @@ class MarcSet():
     def remove(self, id):
         pass
 
+    # database
+
+    @classmethod
+    @Decorators.check_connected
+    def commit_all(cls, records, *, user='admin', batch_size=1000, auth_check=True, update_attached=True) -> list[tuple]:
+        """Commits records in batches. The previous states and the history of
+        a batch are each read with one query, and the records, history, 
+        usage counts, and text and browse index updates of the batch are 
+        written with one bulk write per collection. The index updates are 
+        not threaded.
+
+        Parameters
+        ----------
+        records : iterable
+            Records of the set's record type
+        user : str
+        batch_size : int
+        auth_check : bool
+            If True, the records' auth-controlled fields are validated
+        update_attached : bool
+            If True, the records attached to the committed auths are updated 
+            when the auth headings change
+
+        Returns
+        -------
+        list(tuple)
+            A (record, error) pair for each record, in order. `error` is the
+            exception that prevented the record from being committed, or None
+        """
+
+        self, results, records = cls(), [], iter(records)
+
+        while batch := list(itertools.islice(records, batch_size)):
+            results += self._commit_batch(batch, user=user, auth_check=auth_check, update_attached=update_attached)
+
+        return results
+
+    def _commit_batch(self, records, *, user, auth_check, update_attached) -> list[tuple]:
+        errors = {} # index in batch -> exception
+
+        def attempt(i, function, *args):
+            try:
+                return function(*args)
+            except Exception as err:
+                errors[i] = err
+
+        def valid():
+            return [(i, record) for i, record in enumerate(records) if i not in errors]
+
+        for i, record in enumerate(records):
+            if not isinstance(record, self.record_class):
+                errors[i] = TypeError(f'Record must be of type {self.record_class.__name__}')
+
+        new_records = set([i for i, record in valid() if record.id is None])
+
+        for i in new_records:
+            records[i].id = self.record_class._increment_ids()
+
+        # validation
+        [attempt(i, record.validate) for i, record in valid()]
+
+        if auth_check:
+            # resolve all the xrefs in the batch at once
+            values = Auth.lookup_many([(x.xref, x.code) for i, record in valid() for field in record.datafields for x in field.subfields if hasattr(x, 'xref')])
+            [attempt(i, record._auth_validate, values) for i, record in valid()]
+
+        seen = set()
+
+        for i, record in valid():
+            if record.id in seen:
+                errors[i] = Exception(f'Duplicate {self.record_type} ID {record.id} in batch')
+
+            seen.add(record.id)
+
+        # previous states
+        ids = [record.id for i, record in valid()]
+        previous = {doc['_id']: doc for doc in self.handle.find({'_id': {'$in': ids}})}
+        data = {}
+
+        for i, record in valid():
+            data[i] = attempt(i, record._commit_data, user, previous.get(record.id), i in new_records)
+
+        if not valid():
+            return [(record, errors.get(i)) for i, record in enumerate(records)]
+
+        # clear the local cache, if any, for any found xrefs so the calculated fields are up to date
+        Auth.caches.memory['value'].delete(*set([x.xref for i, record in valid() for field in record.datafields for x in field.subfields if hasattr(x, 'xref')]))
+
+        # commit. the indexes, history and usage counts are only updated for the records that are written
+        committed = valid()
+
+        try:
+            bulk_write(self.handle, [ReplaceOne({'_id': int(record.id)}, data[i], upsert=True) for i, record in committed], ordered=False)
+        except BulkWriteError as err:
+            for error in err.details['writeErrors']:
+                errors[committed[error['index']][0]] = Exception(error['errmsg'])
+
+        if not valid():
+            return [(record, errors.get(i)) for i, record in enumerate(records)]
+
+        # text and browse indexes
+        text_updates, browse_updates, removed = {}, {}, {}
+
+        for i, record in valid():
+            for name, ops in record._text_index_updates().items():
+                text_updates.setdefault(name, []).extend(ops)
+
+            updates, gone = record._browse_updates(previous.get(record.id))
+
+            for name, ops in updates.items():
+                browse_updates.setdefault(name, []).extend(ops)
+
+            for field, values in gone.items():
+                removed.setdefault(field, set()).update(values)
+
+        for name, ops in text_updates.items():
+            DB.buffer.add(DB.handle[name], ops)
+            DB.buffer.create_index(DB.handle[name], [('subfields.value', 'text')], default_language='none')
+
+        for name, ops in browse_updates.items():
+            bulk_write(DB.handle[name], ops)
+
+        # values removed from one record in the batch may have been added to another
+        for field in removed:
+            removed[field] = list(removed[field] - set([x for i, record in valid() for x in record.logical_fields().get(field, [])]))
+
+        # the new states of the records are already written
+        self.record_class._browse_gc(removed)
+
+        # history
+        history_collection = DB.handle[self.record_type + '_history']
+        heads = {doc['_id']: doc for doc in history_collection.find({'_id': {'$in': [record.id for i, record in valid()]}}, projection={'history': 0})}
+
+        if unnumbered := [x for x in heads if 'versions' not in heads[x]]:
+            legacy = set([doc['_id'] for doc in history_collection.find({'_id': {'$in': unnumbered}, 'history': {'$exists': True}}, projection={'_id': 1})])
+            [heads[x].update(legacy=x in legacy) for x in unnumbered]
+
+        pushes = []
+
+        for i, record in valid():
+            head = heads.get(record.id)
+            entries = record._history_entries(head, previous.get(record.id), data[i])
+            created = SON({'user': user, 'time': datetime.now(timezone.utc)}) if i in new_records else None
+            # the version numbers are reserved one record at a time, so concurrent commits don't reuse them
+            pushes += record._reserve_history(head, entries, base=previous.get(record.id) if len(entries) == 1 else None, created=created)
+
+        bulk_write(DB.handle[self.record_type + '_history_buckets'], pushes, ordered=False)
+
+        # usage counts
+        if self.record_type == 'auth':
+            if updates := [UpdateOne({'_id': record.id}, {'$setOnInsert': {'bib': 0, 'auth': 0}}, upsert=True) for i, record in valid() if i in new_records]:
+                bulk_write(DB.handle['auth_use'], updates, ordered=False)
+
+        Auth._update_use(self.record_type, *[(previous.get(record.id) or {}, data[i]) for i, record in valid()])
+
+        if self.record_type == 'auth':
+            for i, record in valid():
+                future = record._auth_committed(previous.get(record.id), update_attached=update_attached)
+                record.futures = [future] if future else []
+
+        return [(record, errors.get(i)) for i, record in enumerate(records)]
+
     # serializations
 
     def to_mrc(self, *, write_id=True):
-        # todo: stream instead of queue in memory
-        mrc = ''
-
-        for record in self.records:
-            mrc += record.to_mrc(write_id=write_id)
+        fh = io.StringIO()
+        self.write_mrc(fh, write_id=write_id)
 
-        return mrc
+        return fh.getvalue()
 
     def to_xml(self, *, xref_prefix='', write_id=True):
-        # todo: stream instead of queue in memory
-        root = ElementTree.Element('collection')
+        fh = io.StringIO()
+        self.write_xml(fh, xref_prefix=xref_prefix, write_id=write_id)
 
-        for record in self.records:
-            root.append(record.to_xml_raw(xref_prefix=xref_prefix, write_id=write_id))
-
-        return ElementTree.tostring(root, encoding='utf-8').decode('utf-8')
+        return fh.getvalue()
 
     def to_mrk(self, *, write_id=True):
-        return '\n'.join([r.to_mrk(write_id=write_id) for r in self.records])
+        fh = io.StringIO()
+        self.write_mrk(fh, write_id=write_id)
+
+        return fh.getvalue()
         
     def to_str(self):
-        return '\n'.join([r.to_str() for r in self.records])
+        return '\n'.join([r.to_str() for r in self.prefetched()])
 
     def to_excel(self, path):
         pass
@@ -393,42 +740,165 @@ class MarcSet():
     def to_table(self, *, write_id=True) -> Table:
         table = Table()
 
-        for i, record in enumerate(self.records):
-            # field names in the table header are the in the form of f{place}.{tag}${subfield_code}
+        for i, record in enumerate(self.prefetched()):
             # each record is one table row
             i += 1
-            
-            if write_id and record.id is not None:
-                table.set(i, '1.001', str(record.id))
-            elif field := record.get_field('001'):
-                table.set(i, '1.001', field.value)
-                # ignore any other controlfields
-
-            for tag in [x for x in record.get_tags() if not re.match('00', x)]:
-                for place, field in enumerate(record.get_fields(tag)):
-                    place += 1
-                    table.set(i, f'{place}.{field.tag}__', ''.join([x if x != ' ' else '_' for x in field.indicators]))
-                    xref = None
 
-                    for subfield in field.subfields:
-                        table.set(i, f'{place}.{field.tag}${subfield.code}', subfield.value)
-                        
-                        if hasattr(subfield, 'xref'):
-                            xref = subfield.xref
-                    
-                    if xref:
-                        table.set(i, f'{place}.{field.tag}$0', str(xref))
+            for field_name, value in MarcSet.table_row(record, write_id=write_id).items():
+                table.set(i, field_name, value)
 
         # sort the table header
         table.header = MarcSet.sort_table_header(table.header)
 
         return table
 
+    @classmethod
+    def table_row(cls, record, *, write_id=True) -> dict:
+        # Returns the record as a dict of field names to values for use as a row
+        # in util.Table. Field names are in the form of {place}.{tag}${subfield_code}
+        row = {}
+
+        if write_id and record.id is not None:
+            Table.set_cell(row, '1.001', str(record.id))
+        elif field := record.get_field('001'):
+            Table.set_cell(row, '1.001', field.value)
+            # ignore any other controlfields
+
+        for tag in [x for x in record.get_tags() if not re.match('00', x)]:
+            for place, field in enumerate(record.get_fields(tag)):
+                place += 1
+                Table.set_cell(row, f'{place}.{field.tag}__', ''.join([x if x != ' ' else '_' for x in field.indicators]))
+                xref = None
+
+                for subfield in field.subfields:
+                    Table.set_cell(row, f'{place}.{field.tag}${subfield.code}', subfield.value)
+                    
+                    if hasattr(subfield, 'xref'):
+                        xref = subfield.xref
+                
+                if xref:
+                    Table.set_cell(row, f'{place}.{field.tag}$0', str(xref))
+
+        return row
+
     def to_csv(self, *, write_id=True) -> str:
-        return self.to_table(write_id=write_id).to_csv()
+        fh = io.StringIO()
+        self.write_csv(fh, write_id=write_id)
+
+        return fh.getvalue()
     
     def to_tsv(self, *, write_id=True) -> str:
-        return self.to_table(write_id=write_id).to_tsv()
+        fh = io.StringIO()
+        self.write_tsv(fh, write_id=write_id)
+
+        return fh.getvalue()
+
+    def prefetched(self, *, language=None, chunk_size=1000) -> typing.Generator:
+        """Yields the records, resolving the linked values of each chunk of 
+        records with one auth query and storing them in the auth lookup cache
+        before the records in the chunk are yielded. This is used by the 
+        serializations so that linked values don't need to be looked up one at 
+        a time.
+
+        Parameters
+        ----------
+        language : str
+            Also resolve the values in this language
+        chunk_size : int
+            The number of records to resolve the linked values for at a time
+
+        Returns
+        -------
+        Generator
+        """
+
+        chunk = []
+
+        def resolve(records):
+            pairs = [
+                (sub.xref, sub.code) for record in records for field in record.datafields 
+                    for sub in field.subfields if isinstance(sub, Linked) and sub._value is None
+            ]
+            Auth.prefetch(pairs)
+
+            if language:
+                Auth.prefetch(pairs, language=language)
+
+            return records
+
+        for record in self.records:
+            chunk.append(record)
+
+            if len(chunk) == chunk_size:
+                yield from resolve(chunk)
+                chunk = []
+
+        if chunk:
+            yield from resolve(chunk)
+
+    # streaming serializations
+    # these pull the records from `self.records` one at a time and write each 
+    # record to the file handle as it is serialized, so that memory use does not 
+    # depend on the size of the set. `fh` is any writable text stream
+
+    def write_mrc(self, fh: typing.TextIO, *, write_id=True):
+        for record in self.prefetched():
+            fh.write(record.to_mrc(write_id=write_id))
+
+        return fh
+
+    def write_xml(self, fh: typing.TextIO, *, xref_prefix='', write_id=True):
+        empty = True
+
+        for record in self.prefetched():
+            if empty:
+                fh.write('<collection>')
+                empty = False
+
+            fh.write(ElementTree.tostring(record.to_xml_raw(xref_prefix=xref_prefix, write_id=write_id), encoding='unicode'))
+
+        # an empty set is written as a self-closing element, as ElementTree does
+        fh.write('<collection />' if empty else '</collection>')
+
+        return fh
+
+    def write_mrk(self, fh: typing.TextIO, *, write_id=True):
+        for i, record in enumerate(self.prefetched()):
+            if i > 0:
+                # records are separated by a blank line
+                fh.write('\n')
+
+            fh.write(record.to_mrk(write_id=write_id))
+
+        return fh
+
+    def write_csv(self, fh: typing.TextIO, *, write_id=True):
+        return self._write_table(fh, separator=',', write_id=write_id)
+
+    def write_tsv(self, fh: typing.TextIO, *, write_id=True):
+        return self._write_table(fh, separator='\t', write_id=write_id)
+
+    def _write_table(self, fh, *, separator, write_id=True):
+        # The header is the union of the columns of all the records, so it isn't
+        # known until all the records have been seen. The rows are spooled to a
+        # temp file on the first pass and written out once the header is known.
+        header = set()
+
+        with tempfile.TemporaryFile('w+', encoding='utf-8') as spool:
+            for record in self.prefetched():
+                row = MarcSet.table_row(record, write_id=write_id)
+                header.update(row.keys())
+                spool.write(json.dumps(row) + '\n')
+
+            header = MarcSet.sort_table_header(list(header))
+            fh.write(separator.join(header))
+            spool.seek(0)
+
+            for line in spool:
+                row = json.loads(line)
+                fh.write('\n' + separator.join([Table.serialize_value(row.get(field), separator=separator) for field in header]))
+
+        return fh
 
 class BibSet(MarcSet):
     def __init__(self, *args, **kwargs):
@@ -454,22 +924,47 @@ class Marc(object):
 
     #### database query handlers
 
+    # the blocks of IDs reserved by this process, by record type: [owner, next id, last id]
+    _id_blocks = {}
+    _id_lock = threading.Lock()
+
     @classmethod
     def _increment_ids(cls):
+        # Returns the next ID in the block reserved by this process. A new 
+        # block of `Config.id_block_size` IDs is reserved when it runs out, 
+        # or when connecting to a different database or after a fork
+        with Marc._id_lock:
+            owner = (DB.client, DB.database_name, os.getpid())
+            block = Marc._id_blocks.get(cls.record_type)
+
+            if block is None or block[0][0] is not owner[0] or block[0][1:] != owner[1:] or block[1] > block[2]:
+                size = Config.id_block_size or 1
+                first = cls._reserve_ids(size)
+                block = Marc._id_blocks[cls.record_type] = [owner, first, first + size - 1]
+
+            block[1] += 1
+
+            return block[1] - 1
+
+    @classmethod
+    def _reserve_ids(cls, n):
+        # Reserves n IDs with one $inc on the counter and returns the first
         col = DB.handle[cls.record_type + '_id_counter']
-        result = col.find_one_and_update({'_id': 1}, {'$inc': {'count': 1}}, return_document=ReturnDocument.AFTER)
+        result = col.find_one_and_update({'_id': 1}, {'$inc': {'count': n}}, return_document=ReturnDocument.AFTER)
 
         if result:
-            if result['count'] <= cls.max_id():
+            first = result['count'] - n + 1
+
+            if first <= cls.max_id():
                 raise Exception('The ID incrementer is out of sync')
             
-            return result['count']
+            return first
         else:
             # this should only happen once
-            i = cls.max_id() + 1
-            col.insert_one({'_id': 1, 'count': i})
+            first = cls.max_id() + 1
+            col.insert_one({'_id': 1, 'count': first + n - 1})
 
-            return i
+            return first
 
     @classmethod
     def max_id(cls):
@@ -601,8 +1096,9 @@ class Marc(object):
 
     # Instance methods
 
-    def __init__(self, doc={}, *, auth_control=False, **kwargs):
-        self.data = doc
+    def __init__(self, doc={}, *, auth_control=False, keep_data=True, lazy=False, **kwargs):
+        # if `keep_data` is False, the raw document is not kept in `self.data` after parsing
+        self.data = doc if keep_data else {}
         self.id = int(doc['_id']) if '_id' in doc else None
         self.created = doc.get('created')
         self.created_user = doc.get('created_user')
@@ -612,46 +1108,103 @@ class Marc(object):
         self.text = doc.get('text')
         self.words = doc.get('words')
         self.fields = []
-        self.parse(doc, auth_control=auth_control)
+        self.futures = [] # the background tasks of the last commit or delete
+
+        if lazy:
+            # if `lazy` is True, the fields for each tag are parsed from the doc 
+            # when the tag is first accessed. see `Marc.materialize`
+            tags = list(filter(lambda x: re.match(r'^(\d{3}|[A-Z]{3})', x), doc.keys()))
+            self._unparsed = {tag: doc[tag] for tag in tags}
+            self._tag_order = {tag: i for i, tag in enumerate(tags)}
+            self._auth_control = auth_control
+
+            if '000' in doc:
+                self.leader = doc['000'][0]
+        else:
+            self.parse(doc, auth_control=auth_control)
 
     @property
     def basket(self):
         return self._basket
 
+    @property
+    def fields(self):
+        # direct access to the list of fields requires all the fields to be parsed
+        self.materialize()
+
+        return self._fields
+
+    @fields.setter
+    def fields(self, fields):
+        # the list keeps an index of the fields by tag. see `FieldList`
+        self._fields = fields if isinstance(fields, FieldList) else FieldList(fields)
+        self._unparsed = None
+
     @property
     def controlfields(self):
-        return list(filter(lambda x: x.tag[:2] == '00', sorted(self.fields, key=lambda x: x.tag)))
+        self.materialize(lambda tag: tag[:2] == '00')
+
+        return self._fields.by_tag(lambda tag: tag[:2] == '00')
 
     @property
     def datafields(self):
-        return list(filter(lambda x: x.tag[:2] != '00', sorted(self.fields, key=lambda x: x.tag)))
+        self.materialize(lambda tag: tag[:2] != '00')
+
+        return self._fields.by_tag(lambda tag: tag[:2] != '00')
 
     def parse(self, doc, *, auth_control=False):
         for tag in filter(lambda x: re.match(r'^(\d{3}|[A-Z]{3})', x), doc.keys()):
             if tag == '000':
                 self.leader = doc['000'][0]
 
-            if tag[:2] == '00':
-                for value in doc[tag]:
-                    self.fields.append(Controlfield(tag, value))
-            else:
-                for field in filter(lambda x: [s.get('xref') or s.get('value') for s in x.get('subfields')], doc[tag]):
-                    self.fields.append(Datafield.from_dict(record_type=self.record_type, tag=tag, data=field, auth_control=auth_control))
-                
+            self.fields.extend(self._parse_tag(tag, doc[tag], auth_control=auth_control))
+
+    def _parse_tag(self, tag, data, *, auth_control=False) -> list:
+        if tag[:2] == '00':
+            return [Controlfield(tag, value) for value in data]
+        else:
+            return [
+                Datafield.from_dict(record_type=self.record_type, tag=tag, data=field, auth_control=auth_control) 
+                    for field in filter(lambda x: [s.get('xref') or s.get('value') for s in x.get('subfields')], data)
+            ]
+
+    def materialize(self, condition=None):
+        '''For records instantiated with `lazy=True`, parses the fields for the 
+        tags that have not been parsed yet and that meet the condition, which is
+        a function that takes a tag. If no condition is given, all the remaining
+        tags are parsed.'''
+
+        if not self._unparsed:
+            return self
+
+        tags = [tag for tag in self._unparsed.keys() if condition is None or condition(tag)]
+
+        if not tags:
+            return self
+
+        for tag in tags:
+            self._fields.extend(self._parse_tag(tag, self._unparsed.pop(tag), auth_control=self._auth_control))
+
+        # keep the fields in the same order as if they were all parsed at once
+        self._fields.sort(key=lambda x: self._tag_order.get(x.tag, len(self._tag_order)))
+
+        return self
+
     #### "get"-type methods
 
     def get_fields(self, *tags):
         if len(tags) == 0:
-            return sorted(self.fields, key=lambda x: x.tag)
+            return self.fields.by_tag()
 
-        return list(filter(lambda x: True if x.tag in tags else False, sorted(self.fields, key=lambda x: x.tag)))
+        self.materialize(lambda tag: tag in tags)
+
+        return self._fields.with_tags(*tags)
 
     def get_field(self, tag, place=0):
-        if place == 0:
-            return next(filter(lambda x: True if x.tag == tag else False, self.fields), None)
-        
+        self.materialize(lambda x: x == tag)
+
         try:
-            return self.get_fields(tag)[place]
+            return self._fields.index_by_tag().get(tag, [])[place]
         except IndexError:
             return
 
@@ -697,7 +1250,7 @@ class Marc(object):
         return ''
 
     def get_tags(self):
-        return sorted(set([x.tag for x in self.get_fields()]))
+        return self.fields.tags()
 
     def get_xrefs(self, *tags):
         xrefs = []
@@ -858,12 +1411,85 @@ class Marc(object):
         new_record = True if self.id is None else False
         self.id = type(self)._increment_ids() if new_record else self.id
         self.validate()
+        previous_state = (DB.bibs if self.record_type == 'bib' else DB.auths).find_one({'_id': self.id})
+        data = self._commit_data(user, previous_state, new_record)
+
+        if auth_check: self._auth_validate()
+
+        # clear the local cache, if any, for any found xrefs so the calculated fields are up to date
+        Auth.caches.memory['value'].delete(*set([x.xref for field in self.datafields for x in field.subfields if hasattr(x, 'xref')]))
+
+        # maintenance functions
+        # update field text indexes
+        def index_field_text():
+            try:
+                # the writes are merged with those of other commits in the buffer
+                for name, updates in self._text_index_updates().items():
+                    DB.buffer.add(DB.handle[name], updates)
+
+                    # create text index if it doesn't exist
+                    DB.buffer.create_index(DB.handle[name], [('subfields.value', 'text')], default_language='none')
+            except Exception as err:
+                LOGGER.exception(err)
+                raise err
+
+        self.futures = [DB.executor.submit(index_field_text)]
+
+        # add logical fields
+        def index_logical_fields():
+            try:
+                updates, removed = self._browse_updates(previous_state)
+
+                for name, ops in updates.items():
+                    bulk_write(DB.handle[name], ops)
+
+                # delete the entries no longer in use
+                self._browse_gc(removed, exclude=[self.id])
+            except Exception as err:
+                LOGGER.exception(err)
+                # log critical error in DB?
+                raise err
+
+        self.futures.append(DB.executor.submit(index_logical_fields))
+
+        # history
+        def save_history():
+            try:
+                head = self._history_head()
+                created = SON({'user': user, 'time': datetime.now(timezone.utc)}) if new_record else None
+                entries = self._history_entries(head, previous_state, data)
+                self._push_history(head, entries, base=previous_state if len(entries) == 1 else None, created=created)
+            except Exception as err:
+                LOGGER.exception(err)
+                raise err
+
+        self.futures.append(DB.executor.submit(save_history))
+
+        # commit
+        result = type(self).handle().replace_one({'_id' : int(self.id)}, data, upsert=True)
+
+        if not result.acknowledged:
+            raise Exception('Commit failed')
+
+        # usage counts
+        if isinstance(self, Auth) and new_record:
+            DB.handle['auth_use'].update_one({'_id': self.id}, {'$setOnInsert': {'bib': 0, 'auth': 0}}, upsert=True)
+
+        Auth._update_use(self.record_type, (previous_state or {}, data))
+
+        if isinstance(self, Auth) and (future := self._auth_committed(previous_state, update_attached=update_attached)):
+            self.futures.append(future)
+
+        return self
+
+    def _commit_data(self, user, previous_state, new_record) -> dict:
+        # Sets the audit, text and logical fields for a commit and returns
+        # the document to save
         data = self.to_bson()
         self.updated = data['updated'] = datetime.now(timezone.utc)
         self.user = data['user'] = user
-        data['basket'] = self.basket 
-        previous_state = (DB.bibs if self.record_type == 'bib' else DB.auths).find_one({'_id': self.id})
-        
+        data['basket'] = self.basket
+
         if previous_state:
             # disregard any provided created data and use existing
             if previous_state.get('created'):
@@ -887,168 +1513,15 @@ class Marc(object):
         data['created'] = self.created
         data['created_user'] = self.created_user
 
-        def auth_validate():
-            for i, field in enumerate(filter(lambda x: isinstance(x, Datafield), self.fields)):
-                for subfield in field.subfields:
-                    # auth control
-                    if Config.is_authority_controlled(self.record_type, field.tag, subfield.code):
-                        if not hasattr(subfield, 'xref'):
-                           raise InvalidAuthField(self.record_type, field.tag, subfield.code) 
-
-                        if not Auth.lookup(subfield.xref, subfield.code):
-                            raise InvalidAuthXref(self.record_type, field.tag, subfield.code, subfield.xref)
-                    else:
-                        if hasattr(subfield, 'xref'):    
-                           raise InvalidNonAuthField(self.record_type, field.tag, subfield.code)  
-
-        if auth_check: auth_validate()
-
-        # clear the local cache, if any, for any found xrefs so the calculated fields are up to date
-        for field in self.datafields:
-            for subfield in [x for x in field.subfields if hasattr(x, 'xref')]:
-                Auth._cache.get(subfield.xref, {})[subfield.code] = None
-            
-        # maintenance functions
-        # update field text indexes
-        def index_field_text(*, threaded=True):
-            try:
-                all_text = []
-
-                for i, field in enumerate(filter(lambda x: isinstance(x, Datafield), self.fields)):
-                    # tag indexes
-                    tag_col = DB.handle[f'_index_{field.tag}']
-                    text = ' '.join([subfield.value or '' for subfield in field.subfields]) # subfield may no longer exist
-                    scrubbed = Tokenizer.scrub(text)
-                    all_text.append(scrubbed)
-
-                    if threaded:
-                        updates = [
-                            UpdateOne(
-                                {'_id': text},
-                                {'$addToSet': {'subfields': {'code': subfield.code, 'value': subfield.value}}},
-                                upsert=True
-                            ) for subfield in field.subfields if subfield.value
-                        ]
-
-                        words = Tokenizer.tokenize(text)
-                        count = Counter(words)
-
-                        updates.append(
-                            UpdateOne(
-                                {'_id': text}, 
-                                {'$set': {'text': f' {scrubbed} ', 'words': list(count.keys())}},
-                            )   
-                        )
-
-                        bulk_write(tag_col, updates)
-
-                        # create text index if it doesn't exist
-                        tag_col.create_index([('subfields.value', 'text')], default_language='none')
-
-                return ' '.join(all_text)
-            except Exception as err:
-                LOGGER.exception(err)
-                raise err
-
         # all-text
-        self.text = index_field_text(threaded=False)
+        self.text = ' '.join([Tokenizer.scrub(' '.join([subfield.value or '' for subfield in field.subfields])) for field in filter(lambda x: isinstance(x, Datafield), self.fields)])
         data['text'] = f' {self.text} ' # padded with spaces for matching
         data['words'] = self.words = Tokenizer.tokenize(self.text)
         #count = Counter(data['words'])
         #self.word_count = [{'stem': k, 'count': v} for k, v in count.items()]
 
-        if DB.database_name == 'testing' or Config.threading == False:
-            index_field_text()
-        else:
-            thread1 = threading.Thread(target=index_field_text, args=[])
-            thread1.start()
-        
-        # add logical fields
-        def index_logical_fields():
-            try:
-                if previous_state:
-                    # check old values to delete from browse collection
-                    for logical_field in (Config.bib_logical_fields.keys() if self.record_type == 'bib' else Config.auth_logical_fields.keys()):
-                        if logical_field == '_record_type': continue
-
-                        if logical_field in previous_state:
-                            old_values = previous_state[logical_field]
-                        else: continue
-
-                        new_values = self.logical_fields().get(logical_field)
-                        if new_values is None: continue
-                        updates = []
-
-                        for value in old_values:
-                            if value in new_values: continue
-
-                            bibcount, authcount = 0, 0 
-                            
-                            if logical_field in Config.bib_logical_fields:
-                                found_bibs = list(DB.bibs.find({logical_field: value}, limit=2, collation=Config.marc_index_default_collation))
-                                bibcount = len(found_bibs)
-                                
-                                if bibcount > 1: 
-                                    continue
-
-                            if logical_field in Config.bib_logical_fields:
-                            
-                                found_auths = list(DB.auths.find({logical_field: value}, limit=2, collation=Config.marc_index_default_collation))
-                                authcount = len(found_auths)
-                                
-                                if authcount > 1:
-                                    continue
-
-                            if bibcount + authcount == 0:
-                                # no records exist with this value
-                                updates.append(DeleteOne({'_id': value}))
-                            elif self.record_type == 'auth':
-                                if authcount == 1:
-                                    if self.id == found_auths[0]['_id']:
-                                        if bibcount == 0:
-                                            updates.append(DeleteOne({'_id': value}))
-                            elif self.record_type == 'bib':
-                                if bibcount == 1:
-                                    if self.id == found_bibs[0]['_id']:
-                                        updates.append(DeleteOne({'_id': value}))
-
-                        if updates:
-                            col = DB.handle[f'_index_{logical_field}']
-                            bulk_write(col, updates)
-
-                # insert all the new data's logical fields into the index
-                for logical_field, values in self.logical_fields().items():
-                    if logical_field == '_record_type':
-                        continue
-                    
-                    # text/browse indexes
-                    updates = []
-
-                    for val in values:
-                        scrubbed = Tokenizer.scrub(val)
-                        words = Tokenizer.tokenize(scrubbed)
-                        count = Counter(words)
-                        updates.append(
-                            UpdateOne(
-                                {'_id': val},
-                                {   
-                                    '$set': {'text': f' {scrubbed} ', 'words': list(count.keys())},
-                                    '$addToSet': {'_record_type': self.logical_fields()['_record_type'][0]} # there is  only one record type in the array
-                                },
-                                upsert=True
-                            )
-                        )
-
-                    col = DB.handle[f'_index_{logical_field}']
-                    bulk_write(col, updates)
-
-            except Exception as err:
-                LOGGER.exception(err)
-                # log critical error in DB?
-                raise err
-
         # assign logical fields here
-        for field, vals in self.logical_fields().items(): 
+        for field, vals in self.logical_fields().items():
             data[field] = vals
 
         # get rid of any logical fields in the data that no longer exist
@@ -1056,165 +1529,310 @@ class Marc(object):
             if field not in self.logical_fields():
                 self.data.pop(field, None)
 
-        if DB.database_name == 'testing' or Config.threading == False:
-            index_logical_fields()
-        else:
-            thread2 = threading.Thread(target=index_logical_fields, args=[])
-            thread2.start()
+        return data
 
-        # history
-        def save_history():
-            try:
-                history_collection = DB.handle[self.record_type + '_history']
-                record_history = history_collection.find_one({'_id': self.id})
-
-                if record_history:
-                    # capture previous state if record originated in another db
-                    if record_history.get('history') is None:
-                        if previous_state:
-                            previous_state['user'] = 'system import'
-                            record_history['history'] = [previous_state, data]
-                        else:
-                            record_history['history'] = [data]
-                    else:
-                        record_history['history'].append(data)
+    def _auth_validate(self, values=None):
+        # `values` are the results of `Auth.lookup_many` for the record's xrefs, if already resolved
+        if values is None:
+            # resolve all the xrefs at once
+            values = Auth.lookup_many([(x.xref, x.code) for field in self.datafields for x in field.subfields if hasattr(x, 'xref')])
+
+        for i, field in enumerate(filter(lambda x: isinstance(x, Datafield), self.fields)):
+            for subfield in field.subfields:
+                # auth control
+                if Config.is_authority_controlled(self.record_type, field.tag, subfield.code):
+                    if not hasattr(subfield, 'xref'):
+                        raise InvalidAuthField(self.record_type, field.tag, subfield.code)
+
+                    if not values.get((subfield.xref, subfield.code)):
+                        raise InvalidAuthXref(self.record_type, field.tag, subfield.code, subfield.xref)
                 else:
-                    record_history = SON()
-                    record_history['_id'] = self.id
+                    if hasattr(subfield, 'xref'):
+                        raise InvalidNonAuthField(self.record_type, field.tag, subfield.code)
+
+    def _text_index_updates(self) -> dict:
+        # The upserts into the field text indexes, by collection name, as
+        # (filter, update, upsert) for `DB.buffer`
+        updates = {}
+
+        for field in filter(lambda x: isinstance(x, Datafield), self.fields):
+            text = ' '.join([subfield.value or '' for subfield in field.subfields]) # subfield may no longer exist
+            scrubbed = Tokenizer.scrub(text)
+            ops = updates.setdefault(f'_index_{field.tag}', [])
+
+            ops += [
+                (
+                    {'_id': text},
+                    {'$addToSet': {'subfields': {'code': subfield.code, 'value': subfield.value}}},
+                    True
+                ) for subfield in field.subfields if subfield.value
+            ]
+
+            words = Tokenizer.tokenize(text)
+            count = Counter(words)
+
+            ops.append(
+                (
+                    {'_id': text},
+                    {'$set': {'text': f' {scrubbed} ', 'words': list(count.keys())}},
+                    False
+                )
+            )
 
-                    if new_record:
-                        record_history['created'] = SON({'user': user, 'time': datetime.now(timezone.utc)})
+        return updates
+
+    def _browse_updates(self, previous_state, *, deleted=False) -> tuple:
+        # The updates of the browse indexes for the change from the previous
+        # state, by collection name, and the values that were removed, by
+        # logical field. The entries keep a count of the records of each type
+        # that have the value. Counts are only incremented where they exist, as
+        # entries built before the counts existed are counted by a rebuild
+        updates, removed = {}, {}
+        previous_state = previous_state or {}
+        logical_fields = {} if deleted else self.logical_fields()
+        record_type = self.logical_fields()['_record_type'][0] # there is only one record type in the array
+
+        for logical_field in (Config.bib_logical_fields.keys() if self.record_type == 'bib' else Config.auth_logical_fields.keys()):
+            if logical_field == '_record_type': continue
+
+            old_values = set(previous_state.get(logical_field) or [])
+            values = list(dict.fromkeys(logical_fields.get(logical_field) or []))
+            gone = [x for x in old_values if x not in values]
+            ops = []
+
+            for val in values:
+                scrubbed = Tokenizer.scrub(val)
+                words = Tokenizer.tokenize(scrubbed)
+                count = Counter(words)
+                update = {
+                    '$set': {'text': f' {scrubbed} ', 'words': list(count.keys())},
+                    '$addToSet': {'_record_type': record_type}
+                }
+
+                if val not in old_values:
+                    # new entries are counted from the start
+                    update['$setOnInsert'] = {'count': {'bib': 0, 'auth': 0}, 'trusted': ['bib', 'auth']}
+                    update['$currentDate'] = {'counted': True}
+                    ops.append(UpdateOne({'_id': val}, update, upsert=True))
+                    ops.append(self._browse_count(val, 1))
+                else:
+                    ops.append(UpdateOne({'_id': val}, update, upsert=True))
 
-                    # capture previous state if record originated in another db
-                    if previous_state:
-                        previous_state['user'] = 'system import'
-                        record_history['history'] = [previous_state, data]
-                    else:
-                        record_history['history'] = [data]
+            ops += [self._browse_count(val, -1) for val in gone]
 
-                history_collection.replace_one({'_id': self.id}, record_history, upsert=True)
-            except Exception as err:
-                LOGGER.exception(err)
-                raise err
+            if ops:
+                updates[f'_index_{logical_field}'] = ops
 
-        if DB.database_name == 'testing' or Config.threading == False:
-            save_history()
-        else:
-            thread3 = threading.Thread(target=save_history, args=[])
-            thread3.start()
+            if gone:
+                removed[logical_field] = gone
 
-        # commit
-        result = type(self).handle().replace_one({'_id' : int(self.id)}, data, upsert=True)
-        
-        if not result.acknowledged:
-            raise Exception('Commit failed')
-        
-        # manage caches
-        if isinstance(self, Auth):
-            # clear these caches
-            for cache in ('_xcache', '_pcache', '_langcache'):
-                setattr(Auth, cache, {})
+        return updates, removed
 
-            if hf := self.heading_field:
-                # value cache
-                data = {}
-                [data.setdefault(x.code, x.value) for x in hf.subfields]
+    def _browse_count(self, value, inc) -> UpdateOne:
+        # The update of the count of this record type on a browse index entry.
+        # Entries without the count are left to be counted by a rebuild
+        field = f'count.{self.record_type}'
 
-                if cache := DB.cache:
-                    key = f'authcache:{self.id}'  
-                    cache[key] = json.dumps(data)
-                else:
-                    Auth._cache.setdefault(self.id, data)
+        return UpdateOne({'_id': value, field: {'$exists': True}}, {'$inc': {field: inc}, '$currentDate': {'counted': True}})
 
-                # redis xref cache
-                if cache := DB.cache:
-                    for subfield in hf.subfields:
-                        key = f'xauthcache:{subfield.value}'
+    @classmethod
+    def _browse_gc(cls, removed, *, exclude=[]):
+        # Deletes the browse index entries of the removed values that are no
+        # longer used by any record. The counts are only trusted on entries
+        # that were created with them or counted by `build-logical-fields` for
+        # both record types. Other entries are checked against the records
+        # instead, disregarding the records of this type in `exclude`
+        for logical_field, values in removed.items():
+            col = DB.handle[f'_index_{logical_field}']
+            col.delete_many({'_id': {'$in': values}, 'count.bib': {'$lte': 0}, 'count.auth': {'$lte': 0}, 'trusted': {'$all': ['bib', 'auth']}})
+            uncounted = col.find(
+                {
+                    '_id': {'$in': values},
+                    '$or': [
+                        {'count.bib': {'$exists': False}},
+                        {'count.auth': {'$exists': False}},
+                        {'trusted': {'$ne': 'bib'}},
+                        {'trusted': {'$ne': 'auth'}}
+                    ]
+                },
+                projection={'_id': 1}
+            )
 
-                        for rtype in ('bib', 'auth'):
-                            if xrefs := Auth.xlookup(hf.tag, subfield.code, subfield.value, record_type=rtype):
-                                xrefs.append(self.id)
-                            else:
-                                xrefs = [self.id]
-                              
-                            cache.set(key, json.dumps({hf.tag: {subfield.code: xrefs}}))
+            for doc in list(uncounted):
+                for record_type, handle in (('bib', DB.bibs), ('auth', DB.auths)):
+                    if logical_field not in (Config.bib_logical_fields if record_type == 'bib' else Config.auth_logical_fields):
+                        continue
 
-                    if previous_state:
-                        prev = Auth(previous_state)
+                    query = {logical_field: doc['_id']}
+
+                    if record_type == cls.record_type and exclude:
+                        query['_id'] = {'$nin': list(exclude)}
+
+                    if list(handle.find(query, projection={'_id': 1}, limit=1, collation=Config.marc_index_default_collation)):
+                        break
+                else:
+                    # no records exist with this value
+                    col.delete_one({'_id': doc['_id']})
 
-                        if hf := prev.heading_field:
-                            for rtype in ('bib', 'auth'):
-                                for subfield in hf.subfields:
-                                    key = f'xauthcache:{subfield.value}'
+    def _history_head(self) -> dict:
+        # The record's history document, without the versions
+        history_collection = DB.handle[self.record_type + '_history']
+        head = history_collection.find_one({'_id': self.id}, projection={'history': 0})
+
+        if head and 'versions' not in head:
+            # the versions were saved before the buckets existed, if any
+            head['legacy'] = bool(history_collection.find_one({'_id': self.id, 'history': {'$exists': True}}, projection={'_id': 1}))
+
+        return head
+
+    @staticmethod
+    def _history_entries(head, previous_state, data) -> list:
+        # The versions to add to the history for a commit
+        head = head or {}
+
+        if previous_state and not head.get('versions') and not head.get('legacy'):
+            # capture previous state if record originated in another db
+            previous_state = dict(previous_state, user='system import')
+
+            return [previous_state, data]
+
+        return [data]
+
+    def _push_history(self, head, entries, *, base=None, created=None):
+        # Appends versions to the history
+        bulk_write(DB.handle[self.record_type + '_history_buckets'], self._reserve_history(head, entries, base=base, created=created))
+
+    def _reserve_history(self, head, entries, *, base=None, created=None) -> list:
+        # Reserves the numbers of the versions to add to the history with the
+        # counter in the history document, which determines the bucket each
+        # version is pushed into. Returns the $push updates of the buckets.
+        # The hash of the last version is kept with the counter, so the first
+        # version is only stored as a delta against `base` if `base` is the 
+        # version directly before it
+        update = {'$inc': {'versions': len(entries)}, '$set': {'last': self._history_hash(entries[-1])}}
+
+        if head is None:
+            update['$setOnInsert'] = {'bucket_size': Config.history_bucket_size}
+
+            if created:
+                update['$setOnInsert']['created'] = created
+        elif 'bucket_size' not in head:
+            update['$set']['bucket_size'] = Config.history_bucket_size
+
+        before = DB.handle[self.record_type + '_history'].find_one_and_update(
+            {'_id': self.id},
+            update,
+            projection={'versions': 1, 'bucket_size': 1, 'last': 1},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE
+        ) or {}
+
+        if Config.history_deltas and base is not None and before.get('last') != self._history_hash(base):
+            # another version was reserved after `base` was read
+            base = None
+
+        return self._history_pushes(before.get('versions', 0) + 1, entries, before.get('bucket_size', Config.history_bucket_size), base=base)
+
+    @staticmethod
+    def _history_hash(data) -> str:
+        # Identifies a version of the saved data. The top-level keys are sorted,
+        # as the saved data can come back from the database in a different order
+        return hashlib.sha1(bson.encode(SON(sorted(data.items())))).hexdigest()
+
+    def _history_pushes(self, first, entries, bucket_size, *, base=None) -> list:
+        # The $push updates of the history buckets for the versions numbered
+        # from `first`. If `Config.history_deltas` is on, the versions are
+        # stored as deltas against the previous version, `base` for the first,
+        # except for the keyframes
+        buckets = {}
+
+        for number, entry in enumerate(entries, start=first):
+            position = (number - 1) % bucket_size
+
+            if Config.history_deltas and base is not None and position % Config.history_keyframe_interval != 0:
+                stored = self._history_delta(base, entry)
+            else:
+                stored = entry
+
+            buckets.setdefault((number - 1) // bucket_size, []).append(stored)
+            base = entry
+
+        return [
+            UpdateOne(
+                {'_id': f'{self.id}.{bucket}'},
+                {
+                    '$push': {'history': {'$each': versions}},
+                    '$inc': {'count': len(versions)},
+                    '$setOnInsert': {'record_id': self.id, 'bucket': bucket}
+                },
+                upsert=True
+            ) for bucket, versions in buckets.items()
+        ]
 
-                                    if xrefs := Auth.xlookup(hf.tag, subfield.code, subfield.value, record_type=rtype):
-                                        xrefs = [x for x in xrefs if x != self.id]
-                                        cache.set(key, json.dumps({hf.tag: {subfield.code: xrefs}}))                            
+    @classmethod
+    def _derived_keys(cls) -> set:
+        # The keys of the saved data that are computed from the fields on commit
+        return set(['text', 'words']) | set(Config.bib_logical_fields if cls.record_type == 'bib' else Config.auth_logical_fields)
+
+    def _history_delta(self, base, data) -> dict:
+        # The changes from the `base` version to `data`, by tag and other
+        # top-level key. The derived keys are always stored, as they are what
+        # the rebuilt version would otherwise be missing. The saved data is
+        # compared rather than using `Diff`, which looks up the values of
+        # linked subfields and skips empty ones. The keys of the version, in
+        # order, are stored in `_delta`, so removed keys are left out when the
+        # version is rebuilt
+        derived = self._derived_keys()
+        delta = SON({'_delta': SON({'order': list(data)})})
+
+        for key in delta['_delta']['order']:
+            # compared as BSON, as the indicators are tuples before they are saved
+            if key in derived or key not in base or bson.encode({key: base[key]}) != bson.encode({key: data[key]}):
+                delta[key] = data[key]
+
+        return delta
+
+    def _auth_committed(self, previous_state, *, update_attached=True) -> Future:
+        # Updates the auth caches and the records attached to this auth after
+        # it has been committed. Returns the future of the attached records 
+        # update, if there is one
+        # manage caches
+        previous_hf = Auth(previous_state).heading_field if previous_state else None
+        hf = self.heading_field
+        headings = [x for x in (previous_hf, hf) if x]
+        Auth.invalidate_cache(xrefs=[self.id], values=[x.value for field in headings for x in field.subfields if hasattr(x, 'value')])
+
+        if Auth.typeahead.built:
+            Auth.typeahead.update(self)
+
+        if hf:
+            # value cache
+            data = {}
+            [data.setdefault(x.code, x.value) for x in hf.subfields]
+            Auth.caches('value').set(self.id, data)
+
+            # rewarm the shared xref cache for other processes using it
+            if DB.cache:
+                for field in headings:
+                    for subfield in field.subfields:
+                        Auth._xlookup_auth_tag(field.tag, subfield.code, [subfield.value])
         
         # auth attached records update
         def update_attached_records(auth):
             try:
                 if auth.record_type != 'auth': raise Exception('Record type must be auth')
 
-                for record in auth.list_attached():
-                    def do_update():
-                        try:
-                            if isinstance(record, Auth) and auth.id in [x.id for x in record.list_attached(usage_type='auth')]:
-                                # prevent feedback loops
-                                record.commit(user=auth.user, auth_check=False, update_attached=False)
-                                return
-
-                            # if the heading field tag changed, change the tag in linked record
-                            if self.heading_field.tag != Auth(previous_state).heading_field.tag:
-                                for field in record.datafields:
-                                    for subfield in filter(lambda x: hasattr(x, 'xref'), field.subfields):
-                                        if subfield.xref == self.id:
-                                            new_tag = field.tag[0] + self.heading_field.tag[1:]
-                                            field.tag = new_tag
-
-                            # if any subfields have been deleted, delete them from the linked record
-                            codes_removed = []
-
-                            for subfield in Auth(previous_state).heading_field.subfields:   
-                                if subfield.code not in [x.code for x in self.heading_field.subfields]:
-                                    codes_removed.append(subfield.code)
-
-                            for linked_field in record.datafields:
-                                if self.id in [x.xref for x in [y for y in linked_field.subfields if hasattr(y, 'xref')]]:                                        
-                                    linked_field.subfields = [x for x in linked_field.subfields if x.code not in codes_removed]
-
-                            # if any subfields have been added, add them to the linked record
-                            codes_added = []
-
-                            for subfield in self.heading_field.subfields:  
-                                if subfield.code not in [x.code for x in Auth(previous_state).heading_field.subfields]:
-                                    codes_added.append(subfield.code)
-                                    
-                            if codes_added:
-                                for linked_field in record.datafields:
-                                    if self.id in [x.xref for x in [y for y in linked_field.subfields if hasattr(y, 'xref')]]: 
-                                        for code in codes_added:
-                                            linked_field.subfields.append(Linked(code, self.id))
-
-                            record.commit(user=auth.user, auth_check=False)
-                        except Exception as err:
-                            LOGGER.exception(err)
-                            raise err
+                report = auth.update_attached(previous_state)
 
-                        # for debugging
-                        DB.handle['auth_linked_update_log'].insert_one({'record_type': record.record_type, 'record_id': record.id, 'action': 'updated', 'triggered_by': auth.id, 'time': datetime.now(timezone.utc)})
+                if failed := report['failed']:
+                    raise Exception(f'{len(failed)} record(s) attached to auth {auth.id} could not be updated: ' + '; '.join([f'{x[0]} {x[1]}: {x[2]!r}' for x in failed[:10]]))
 
-                    if 1: #DB.database_name == 'testing':
-                        do_update()
-                    else:
-                        # subthreading here doesn't work ?
-                        subthread = threading.Thread(target=do_update, args=[])
-                        subthread.start()
+                return report
             except Exception as err:
-                    LOGGER.exception(err)
-                    raise err
+                LOGGER.exception(err)
+                raise err
 
-        if isinstance(self, Auth) and update_attached == True:
+        if update_attached == True:
             if previous_state:
                     # only update attached record if the heading field changed
                     # don't check indicators
@@ -1225,98 +1843,70 @@ class Marc(object):
 
                     if heading_serialized != prev_serialized or self.heading_field.tag != previous.heading_field.tag:
                         # the heading has changed
-                        if DB.database_name == 'testing' or Config.threading == False: 
-                            update_attached_records(self)
-                        else:
-                            thread4 = threading.Thread(target=update_attached_records, args=[self])
-                            thread4.start()
-        
-        return self
+                        return DB.executor.submit(update_attached_records, self)
 
     def delete(self, user='admin'):
         if isinstance(self, Auth):
-            if self.in_use(usage_type='bib') or self.in_use(usage_type='auth'):
+            if self.in_use(usage_type='bib', exact=True) or self.in_use(usage_type='auth', exact=True):
                 raise AuthInUse()
         
-            for cache in ('_cache', '_xcache', '_pcache', '_langcache'):
-                getattr(Auth, cache)[self.id] = {}
+            if hf := self.heading_field:
+                Auth.invalidate_cache(xrefs=[self.id], values=[x.value for x in hf.subfields if hasattr(x, 'value')])
+            else:
+                Auth.invalidate_cache(xrefs=[self.id])
 
-                if redis := DB.cache:
-                    redis.delete(self.id)
+            if Auth.typeahead.built:
+                Auth.typeahead.remove(self.id)
 
-                    if hf := self.heading_field:
-                        for rtype in ('bib', 'auth'):
-                            for subfield in hf.subfields:
-                                if xrefs := Auth.xlookup(hf.tag, subfield.code, subfield.value, record_type=rtype):
-                                    xrefs = [x for x in xrefs if x != self.id]
+        saved = type(self).handle().find_one({'_id': self.id})
 
         def update_browse_collections():
             try:
-                # update browse index if necessary
-                for field, values in self.logical_fields().items():
-                    if field == '_record_type': 
-                        continue
-                    
-                    updates = []
-
-                    for val in values:
-                        count = 0
-
-                        if field in Config.bib_logical_fields:
-                            count += len(list(DB.bibs.find({field: val}, limit=2, collation=Config.marc_index_default_collation)))
-                        
-                        if field in Config.auth_logical_fields:
-                            count += len(list(DB.auths.find({field: val}, limit=2, collation=Config.marc_index_default_collation)))
+                # the saved values are the ones counted in the browse indexes
+                updates, removed = self._browse_updates(saved, deleted=True)
 
-                        if count in [0, 1]:
-                            # this record is the only instance of the value
-                            updates.append(DeleteOne({'_id': val}))
+                for name, ops in updates.items():
+                    bulk_write(DB.handle[name], ops)
 
-                    if updates:
-                        col = DB.handle[f'_index_{field}']
-                        bulk_write(col, updates)
+                self._browse_gc(removed, exclude=[self.id])
             except Exception as err:
                 LOGGER.exception(err)
                 raise err
 
-        if DB.database_name == 'testing' or Config.threading == False: 
-            update_browse_collections()
-        else:
-            thread = threading.Thread(target=update_browse_collections, args=[])
-            thread.start()
+        self.futures = [DB.executor.submit(update_browse_collections)]
         
-        history_collection = DB.handle[self.record_type + '_history']
-        record_history = history_collection.find_one({'_id': self.id})
-
-        if record_history is None:
-            record_history = SON()
+        head = self._history_head()
 
-        if record_history.get('history') is None:
+        if not (head or {}).get('versions') and not (head or {}).get('legacy'):
             # record has not been saved since initial migration
             cls = Bib if isinstance(self, Bib) else Auth
             last_saved_state = cls.from_id(self.id)
-            record_history['history'] = [last_saved_state.to_bson()]
-
-        record_history['deleted'] = SON({'user': user, 'time': datetime.now(timezone.utc)})
-         # new field containing list of actions performed on the record
-        record_history.setdefault('actions', [])
-        record_history['actions'].append({
-            'type': 'delete',
-            'user': user,
-            'time': datetime.now(timezone.utc)
-        })
-        history_collection.replace_one({'_id': self.id}, record_history, upsert=True)    
-
-        return type(self).handle().delete_one({'_id': self.id})
+            self._push_history(head, [last_saved_state.to_bson()])
+
+        DB.handle[self.record_type + '_history'].update_one(
+            {'_id': self.id},
+            {
+                '$set': {'deleted': SON({'user': user, 'time': datetime.now(timezone.utc)})},
+                # new field containing list of actions performed on the record
+                '$push': {'actions': {'type': 'delete', 'user': user, 'time': datetime.now(timezone.utc)}}
+            },
+            upsert=True
+        )
+
+        result = type(self).handle().delete_one({'_id': self.id})
+
+        # usage counts
+        Auth._update_use(self.record_type, (saved or {}, {}))
+
+        if isinstance(self, Auth):
+            DB.handle['auth_use'].delete_one({'_id': self.id})
+
+        return result
     
     def history(self):
-        history_collection = DB.handle[self.record_type + '_history']
-        record_history = history_collection.find_one({'_id': self.id})
+        history_class = BibHistory if self.record_type == 'bib' else AuthHistory
 
-        if record_history:
-            return [type(self)(x) for x in record_history['history']]
-        else:
-            return []
+        return [type(self)(x) for x in history_class.iter_versions(self.id)]
 
     def logical_fields(self, *names):
         """Returns a dict of the record's logical fields"""
@@ -1354,12 +1944,13 @@ class Marc(object):
         if not version > 0:
             raise Exception('Version number must be 1 or greater')
 
-        if history := self.history():
-            if len(history) < version:
-                raise Exception(f'History version {version} does not exist')
-            
+        history_class = BibHistory if self.record_type == 'bib' else AuthHistory
+
+        if data := history_class.version(self.id, version):
             self.fields = []
-            self.parse(history[version-1].data)
+            self.parse(type(self)(data).data)
+        elif history_class.latest(self.id):
+            raise Exception(f'History version {version} does not exist')
         else:
             raise Exception('History not found')
 
@@ -1485,36 +2076,29 @@ class Marc(object):
         return json.dumps(mij)
 
     def to_mrc(self, *tags, language=None, write_id=True):
-        record = copy.deepcopy(self)
-
-        if write_id and record.id is not None:
-            record.set('001', None, str(record.id))
+        field_terminator = b'\x1e'
+        record_terminator = b'\x1d'
+        directory = bytearray()
+        data = bytearray()
 
-        directory = ''
-        data = ''
-        next_start = 0
-        field_terminator = u'\u001e'
-        record_terminator = u'\u001d'
-
-        for f in filter(lambda x: x.tag != '000', record.get_fields(*tags)):
-            text = f.to_mrc(language=language)
-            data += text
-            field_length = len(text.encode('utf-8'))
-            directory += f.tag + str(field_length).zfill(4) + str(next_start).zfill(5)
-            next_start += field_length
+        for f in filter(lambda x: x.tag != '000', self.output_fields(*tags, write_id=write_id)):
+            # encode once and use the same bytes for the directory entry
+            encoded = f.to_mrc(language=language).encode('utf-8')
+            directory += (f.tag + str(len(encoded)).zfill(4) + str(len(data)).zfill(5)).encode('utf-8')
+            data += encoded
 
         directory += field_terminator
         data += record_terminator
-        leader_dir_len = len(directory.encode('utf-8')) + 24
+        leader_dir_len = len(directory) + 24
         base_address = str(leader_dir_len).zfill(5)
-        total_len = str(leader_dir_len + len(data.encode('utf-8'))).zfill(5)
+        total_len = str(leader_dir_len + len(data)).zfill(5)
 
-        leader = record.get_value('000')
+        leader = self.get_value('000')
 
         if not leader:
             leader = '|' * 24
         elif len(leader) < 24:
-            leader = record.leader.ljust(24, '|')
+            leader = self.leader.ljust(24, '|')
 
         new_leader = total_len \
             + leader[5:9] \
@@ -1524,18 +2108,38 @@ class Marc(object):
             + leader[17:20] \
             + '4500'        
 
-        return new_leader + directory + data
+        return new_leader + (directory + data).decode('utf-8')
 
     def to_mrk(self, *tags, language=None, write_id=True):
-        record = copy.deepcopy(self) # so as not to alter the original object's data
+        fields = self.output_fields(write_id=write_id, default_leader='****')
 
-        if write_id and record.id is not None:
-            record.set('001', None, str(record.id))
+        return '\n'.join([field.to_mrk(language=language) for field in fields]) + '\n'
 
-        if not record.get_value('000'):
-            record.set('000', 'None', '****')
-        
-        return '\n'.join([field.to_mrk(language=language) for field in record.get_fields()]) + '\n'
+    def output_fields(self, *tags, write_id=True, default_leader=None) -> list:
+        '''Returns the fields as they are to be serialized, in tag order. If 
+        `write_id` is True, the record ID is given as the 001. If `default_leader` 
+        is given, it is used as the 000 if the record has no leader. The 
+        substituted fields are new objects, so the record itself is not altered.'''
+
+        fields = self.get_fields(*tags)
+        substitutions = []
+
+        if write_id and self.id is not None:
+            substitutions.append(Controlfield('001', str(self.id)))
+
+        if default_leader and not self.get_value('000'):
+            substitutions.append(Controlfield('000', default_leader))
+
+        for new in substitutions:
+            if tags and new.tag not in tags:
+                continue
+            
+            if existing := next((f for f in fields if f.tag == new.tag), None):
+                fields = [new if f is existing else f for f in fields]
+            else:
+                fields = sorted(fields + [new], key=lambda x: x.tag)
+
+        return fields
 
     def to_str(self, *tags, language=None):
         # non-standard format intended to be human readable
@@ -1558,15 +2162,10 @@ class Marc(object):
         return string
 
     def to_xml_raw(self, *tags, language=None, xref_prefix='', write_id=True):
-        record = copy.deepcopy(self) # so as not to alter the orginal object's underlying data
-
-        if write_id and record.id is not None:
-            record.set('001', None, str(record.id))
-        
         # todo: reimplement with `xml.dom` or `lxml` to enable pretty-printing
         root = ElementTree.Element('record')
 
-        for field in record.get_fields(*tags):
+        for field in self.output_fields(*tags, write_id=write_id):
             if isinstance(field, Controlfield):
                 node = ElementTree.SubElement(root, 'controlfield')
                 node.set('tag', field.tag)
@@ -1591,7 +2190,7 @@ class Marc(object):
                     subnode = ElementTree.SubElement(node, 'subfield')
                     subnode.set('code', sub.code)
 
-                    if language and Config.linked_language_source_tag(record.record_type, field.tag, sub.code, language):
+                    if language and Config.linked_language_source_tag(self.record_type, field.tag, sub.code, language):
                         subnode.text = sub.translated(language)
                         continue   
 
@@ -1631,27 +2230,108 @@ class Marc(object):
         pass
 
     @classmethod
-    def from_mrc(cls, string):
-        '''Parses a MARC21 string (.mrc) into dlx.Marc'''
+    def from_mrc(cls, data: bytes, *, auth_control=True, delete_subfield_zero=True):
+        '''Parses a MARC21 (ISO 2709) record into dlx.Marc. Lengths and offsets
+        in the leader and directory are counted in UTF-8 bytes, so the data should
+        be given as bytes. A str will be encoded as UTF-8'''
 
-        raise Exception("This method is unfinished")
-        
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+
+        data = bytes(data)
         self = cls()
-        base = string[12:17]
-        directory = string[24:int(base)-24]
-        data = string[base:]
-
-        while directory:
-            tag = directory[:3]
-            length = directory[3:7]
-            start = directory[7:12]
-            
-            directory = directory[12:]
+
+        try:
+            leader = data[:24].decode('utf-8')
+            record_length, base_address = int(leader[:5]), int(leader[12:17])
+        except (UnicodeDecodeError, ValueError):
+            raise InvalidRecordString(data[:24], 'Invalid MARC21 leader:')
+
+        if len(data) < record_length or data[record_length-1:record_length] != b'\x1d':
+            raise InvalidRecordString(data[:24], 'MARC21 record is truncated:')
+
+        # the directory ends with a field terminator just before the base address
+        directory = data[24:base_address-1]
+
+        if len(directory) % 12 != 0:
+            raise InvalidRecordString(data[:24], 'Invalid MARC21 directory:')
+
+        self.leader = leader
+        entries = [Controlfield('000', leader)]
+
+        for i in range(0, len(directory), 12):
+            entry = directory[i:i+12].decode('utf-8')
+            tag, length, start = entry[:3], int(entry[3:7]), int(entry[7:12])
+            # drop the field terminator
+            text = data[base_address+start:base_address+start+length-1].decode('utf-8')
+
+            if tag[:2] == '00':
+                entries.append(Controlfield(tag, text))
+                
+                if tag == '001':
+                    self.id = int(text)
+            else:
+                subfields = [(chunk[0], chunk[1:]) for chunk in filter(None, text[2:].split('\x1f'))]
+                entries.append((tag, text[0:1], text[1:2], subfields))
+
+        self._parse_entries(entries, auth_control=auth_control, delete_subfield_zero=delete_subfield_zero)
+
+        return self
+
+    def _parse_entries(self, entries, *, auth_control=True, delete_subfield_zero=True):
+        # Adds fields to the record from a list of Controlfields and (tag, ind1, ind2, 
+        # [(code, value), ...]) tuples. The auth controlled values for the whole record 
+        # are resolved at once before the datafields are built
+        if auth_control:
+            Auth._resolve_fields(self.record_type, [(x[0], x[3]) for x in entries if isinstance(x, tuple)])
+
+        for entry in entries:
+            if isinstance(entry, tuple):
+                entry = self._parse_datafield(*entry, auth_control=auth_control, delete_subfield_zero=delete_subfield_zero)
+
+            self.fields.append(entry)
+
+    @classmethod
+    def _parse_datafield(cls, tag, ind1, ind2, subfields: list[tuple], *, auth_control=True, delete_subfield_zero=True):
+        # Builds a Datafield from (code, value) pairs, using the xref in subfield $0 
+        # for authority-controlled subfields if it exists
+        field = Datafield(record_type=cls.record_type, tag=tag, ind1=ind1, ind2=ind2)
+        ambiguous = []
+        
+        # capture the xref from subfield $0, if exists
+        if match := re.match(r'(\d+)', next((value for code, value in subfields if code == '0'), '')):
+            xref = int(match.group(1))
+        else:
+            xref = None
+
+        # parse the subfields
+        for code, value in subfields:
+            if Config.is_authority_controlled(cls.record_type, tag, code):
+                value = xref if xref else value
+
+            try:
+                field.set(code, value, place='+', auth_control=auth_control)
+            except(AmbiguousAuthValue):
+                ambiguous.append(Literal(code, value))
+        
+        # attempt to use multiple subfields to resolve ambiguity
+        if ambiguous:
+            if xref := Auth.resolve_ambiguous(tag=tag, subfields=ambiguous, record_type=cls.record_type):
+                field.set(code, xref, place='+', auth_control=auth_control)
+            else:
+                raise AmbiguousAuthValue(cls.record_type, field.tag, '*', str([x.value for x in ambiguous]))
+    
+        # remove subfield $0
+        if delete_subfield_zero:
+            field.subfields = list(filter(lambda x: x.code != '0', field.subfields))
+
+        return field
 
     @classmethod
     def from_mrk(cls, string: str, auth_control=True, delete_subfield_zero=True):
         self = cls()
         last_tag = 0
+        entries = []
 
         for line in filter(None, string.split('\n')):
             match = re.match(r'=(\w{3})  (.*)', line)            
@@ -1669,41 +2349,14 @@ class Marc(object):
                 
                 if tag == '001':
                     self.id = int(field.value)
-            else:
-                ind1, ind2 = [x.replace('\\', ' ') for x in rest[:2]]
-                field = Datafield(record_type=cls.record_type, tag=tag, ind1=ind1, ind2=ind2)
-                ambiguous = []
-                
-                # capture the xref from subfield $0, if exists
-                if match := re.search(r'\$0(\d+)', rest[2:]):
-                    xref = int(match.group(1))
-                else:
-                    xref = None
 
-                # parse the subfields
-                for chunk in filter(None, rest[2:].split('$')):
-                    code, value = chunk[0], chunk[1:]
-
-                    if Config.is_authority_controlled(self.record_type, tag, code):
-                        value = xref if xref else value
-
-                    try:
-                        field.set(code, value, place='+', auth_control=auth_control)
-                    except(AmbiguousAuthValue):
-                        ambiguous.append(Literal(code, value))
-                
-                # attempt to use multiple subfields to resolve ambiguity
-                if ambiguous:
-                    if xref := Auth.resolve_ambiguous(tag=tag, subfields=ambiguous, record_type=self.record_type):
-                        field.set(code, xref, place='+', auth_control=auth_control)
-                    else:
-                        raise AmbiguousAuthValue(self.record_type, field.tag, '*', str([x.value for x in ambiguous]))
-            
-                # remove subfield $0
-                if delete_subfield_zero:
-                    field.subfields = list(filter(lambda x: x.code != '0', field.subfields))
+                entries.append(field)
+            else:
+                ind1, ind2 = [x.replace('\\', ' ') for x in rest[:2]]
+                subfields = [(chunk[0], chunk[1:]) for chunk in filter(None, rest[2:].split('$'))]
+                entries.append((tag, ind1, ind2, subfields))
 
-            self.fields.append(field)
+        self._parse_entries(entries, auth_control=auth_control, delete_subfield_zero=delete_subfield_zero)
 
         return self
     
@@ -1737,6 +2390,13 @@ class Marc(object):
 
             self.fields.append(field)
 
+        if auth_control:
+            # resolve the auth controlled values for the whole record at once
+            Auth._resolve_fields(cls.record_type, [
+                (node.attrib['tag'], [(x.attrib['code'], x.text) for x in node if re.search('subfield$', x.tag)]) 
+                for node in root if re.search('datafield$', node.tag)
+            ])
+
         for field_node in filter(lambda x: re.search('datafield$', x.tag), root):
             tag = field_node.attrib['tag']
             field = Datafield(record_type=cls.record_type, tag=tag, ind1=field_node.attrib['ind1'], ind2=field_node.attrib['ind2'])
@@ -1832,111 +2492,261 @@ class Bib(Marc):
 class Auth(Marc):
     record_type = 'auth'
     set_class= AuthSet
-    _cache = {}
-    _xcache = {}
-    _pcache = {}
-    _langcache = {}
-    _acache = {}
+    caches = CacheNamespaces()
+    typeahead = TypeaheadIndex()
 
     @classmethod
-    def build_cache(cls):
+    def build_cache(cls, *, batch_size=10000, threads=1):
         '''Stores all auth headings to the the lookup cache for use in long
-        batch operations'''
-
-        total, chars = DB.auths.estimated_document_count(), 0
-        
-        for i, auth in enumerate(AuthSet.from_query({})):
-            j = i + 1
-
-            for subfield in auth.heading_field.subfields:
-                if cache := DB.cache:
-                    key = f'authcache:{auth.id}'
+        batch operations
 
-                    if cache.exists(key):
-                        data = json.loads(cache.get(key))
-                        data.update({subfield.code: subfield.value})
-                        cache.set(key, json.dumps(data))
-                    else:
-                        cache.set(key, json.dumps({subfield.code: subfield.value}))
+        The auths are read in batches ordered by _id, projecting only the 
+        heading tags, and each batch is written to the cache at once. If 
+        `threads` is greater than 1, the _id range is split between that 
+        many threads'''
 
-                    continue
+        total, done, chars, start = DB.auths.estimated_document_count(), 0, 0, time.time()
+        lock = threading.Lock()
+        projection = dict.fromkeys(Config.auth_heading_tags(), 1)
 
-                if auth.id in Auth._cache:
-                    Auth._cache[auth.id][subfield.code] = subfield.value
-                else:
-                    Auth._cache[auth.id] = {subfield.code: subfield.value}
+        def report(count):
+            nonlocal done, chars
 
-            if j % 1000 == 0 or j == total:
-                status = f'Building auth cache: {j} / {total}'
+            with lock:
+                done += count
+                status = f'Building auth cache: {done} / {total} ({int(done / (time.time() - start or 1))}/s)'
                 print(('\b' * chars) + status, end='', flush=True)
                 chars = len(status)
 
-        print('\n')
+        def build(first, last):
+            # _id range is inclusive
+            query = {'_id': {'$gte': first, '$lte': last}}
+
+            while True:
+                auths = list(AuthSet.from_query(query, projection=projection, sort=[('_id', 1)], limit=batch_size, keep_data=False, lazy=True))
+
+                if not auths:
+                    break
+
+                values = {}
+
+                for auth in auths:
+                    if hf := auth.heading_field:
+                        values[auth.id] = {x.code: x.value for x in hf.subfields}
+
+                Auth.caches('value').set_many(values)
+                report(len(auths))
+                query['_id']['$gte'] = auths[-1].id + 1
+
+        first, last = [next(DB.auths.find({}, projection={'_id': 1}, sort=[('_id', x)], limit=1), {}).get('_id') for x in (1, -1)]
+
+        if first is not None:
+            if threads > 1:
+                step = (last - first) // threads + 1
+                ranges = [(x, min(x + step - 1, last)) for x in range(first, last + 1, step)]
+
+                with ThreadPoolExecutor(max_workers=threads) as executor:
+                    [f.result() for f in [executor.submit(build, *x) for x in ranges]]
+            else:
+                build(first, last)
+
+        print(f'\nBuilt auth cache: {done} auths in {time.time() - start:.1f}s\n')
+
+    @classmethod
+    def build_typeahead(cls):
+        '''Builds the in-memory typeahead index used by `Auth.partial_lookup`
+        from the auth headings. Once built, the index is kept up to date on 
+        auth commit and delete, including in other processes if there is a 
+        shared cache'''
+
+        Auth.typeahead.build(AuthSet.from_query({}, projection=dict.fromkeys(Config.auth_heading_tags(), 1), lazy=True))
+
+        if Auth._refresh_typeahead not in Auth.caches.listeners:
+            Auth.caches.listeners.append(Auth._refresh_typeahead)
+
+    @classmethod
+    def _refresh_typeahead(cls, *, xrefs, values):
+        # reindexes auths changed by another process
+        found = {x.id: x for x in AuthSet.from_query({'_id': {'$in': list(xrefs)}}, projection=dict.fromkeys(Config.auth_heading_tags(), 1), lazy=True)}
+
+        for xref in xrefs:
+            Auth.typeahead.update(found[xref]) if xref in found else Auth.typeahead.remove(xref)
 
     @classmethod
     def lookup(cls, xref, code, language=None):
         '''Returns the authotiry controlled value for an xref and subfield code'''
 
-        if language:
-            cached = Auth._langcache.get(xref, {}).get(code, {}).get(language, None)
-        elif cache := DB.cache:
-            key = f'authcache:{xref}'
-            cached = json.loads(cache[key]).get(code) if cache.exists(key) else None
-        else:
-            cached = Auth._cache.get(xref, {}).get(code, None)
-            
-        if cached:
-            return cached
-            
-        label_tags = Config.auth_heading_tags()
-        label_tags += Config.auth_language_tags() if language else []
-        auth = Auth.from_query({'_id': xref}, projection=dict.fromkeys(label_tags, 1))
-        value = auth.heading_value(code, language) if auth else None
+        return Auth.lookup_many([(xref, code)], language=language)[(xref, code)]
 
-        if language:
-            Auth._langcache[xref] = {code: {language: value}}
-        else:
-            if cache: 
-                if cache.exists(xref):
-                    data = json.loads(cache[xref])
-                    data.update({code: value})
-                    cache[xref] = json.dumps(data)
-                else:
-                    cache[xref] = json.dumps({code: value})
-            elif xref in Auth._cache:
-                Auth._cache[xref][code] = value
-            else:
-                Auth._cache[xref] = {code: value}
+    @classmethod
+    def lookup_many(cls, pairs, *, language=None) -> dict:
+        '''Returns the authority controlled values for multiple (xref, subfield
+        code) pairs, keyed by pair. The values that are not cached are resolved
+        with one query. The value is None if the xref is not found'''
 
-        return value
+        pairs = set(pairs)
+        found = Auth._cached_values(pairs, language=language)
+        missing = {}
+
+        for xref, code in pairs:
+            if (xref, code) not in found:
+                missing.setdefault(xref, set()).add(code)
+
+        if missing:
+            label_tags = Config.auth_heading_tags()
+            label_tags += Config.auth_language_tags() if language else []
+            auths = AuthSet.from_query({'_id': {'$in': list(missing.keys())}}, projection=dict.fromkeys(label_tags, 1), lazy=True)
+            values = {}
+
+            for auth in auths:
+                for code in missing[auth.id]:
+                    values[(auth.id, code)] = auth.heading_value(code, language)
+
+            Auth._cache_values(values, language=language)
+            found.update(values)
+
+        return {pair: found.get(pair) for pair in pairs}
+
+    @classmethod
+    def prefetch(cls, pairs, *, language=None):
+        '''Resolves the values for the given (xref, subfield code) pairs that are 
+        not already cached with one query, and stores them in the lookup cache so 
+        that subsequent calls to `Auth.lookup` for the same pairs don't have to
+        query the database'''
+
+        Auth.lookup_many(pairs, language=language)
+
+    @classmethod
+    def _resolve_fields(cls, record_type, fields) -> tuple[dict, dict]:
+        # Resolves the authority-controlled subfields in (tag, [(code, value), ...]) pairs 
+        # with one query per source tag, using the xref in subfield $0 if there is one. 
+        # Returns the found values keyed by (xref, code) and the found xrefs keyed by
+        # (tag, code, value)
+        pairs, values = set(), {}
+
+        for tag, subfields in fields:
+            xref = next((str(value) for code, value in subfields if code == '0'), '')
+            xref = int(match.group(1)) if (match := re.match(r'(\d+)', xref)) else None
+
+            for code, value in subfields:
+                if not Config.is_authority_controlled(record_type, tag, code):
+                    continue
+                elif xref:
+                    pairs.add((xref, code))
+                elif value:
+                    values.setdefault((tag, code), set()).add(value)
+
+        found_xrefs = {}
+
+        for (tag, code), group in values.items():
+            for value, xrefs in Auth.xlookup_many(tag, code, group, record_type=record_type).items():
+                found_xrefs[(tag, code, value)] = xrefs
+
+        return Auth.lookup_many(pairs), found_xrefs
+
+    @classmethod
+    def _cached_values(cls, pairs, *, language=None) -> dict:
+        # Returns the cached values for the (xref, subfield code) pairs that are in the cache
+        pairs, found = list(pairs), {}
+        data = Auth.caches('lang' if language else 'value').get_many(set([xref for xref, code in pairs]))
+
+        for xref, code in pairs:
+            value = data.get(xref, {}).get(code)
+            found[(xref, code)] = value.get(language) if language and value else value
+
+        return {k: v for k, v in found.items() if v is not None}
+
+    @classmethod
+    def _cache_values(cls, values: dict, *, language=None):
+        # Stores values keyed by (xref, subfield code) pairs in the lookup cache
+        by_xref = {}
+
+        for (xref, code), value in values.items():
+            by_xref.setdefault(xref, {})[code] = {language: value} if language else value
+
+        if by_xref:
+            Auth.caches('lang' if language else 'value').merge_many(by_xref)
+
+    @classmethod
+    def invalidate_cache(cls, *, xrefs=[], values=[]):
+        '''Evicts the cache entries for the given auth xrefs, and the entries 
+        that were derived from the given heading values. If there is a shared 
+        cache, the other processes using it are notified'''
+
+        Auth.caches.invalidate(xrefs=xrefs, values=values)
 
     @classmethod
     def xlookup(cls, tag, code, value, *, record_type):
         '''Returns all the xrefs that match a given value in the given tag and subfield code'''
 
+        if (found := Auth.xlookup_many(tag, code, [value], record_type=record_type)) is None:
+            return
+
+        return found[value]
+
+    @classmethod
+    def xlookup_many(cls, tag, code, values, *, record_type) -> dict:
+        '''Returns the xrefs that match each of the given values in the given 
+        tag and subfield code, keyed by value. The values that are not cached 
+        are resolved with one query. The cache is keyed by the values' 
+        collation keys, so the entries for all the variants of a heading value
+        are evicted when an auth with the heading changes'''
+
         auth_tag = Config.authority_source_tag(record_type, tag, code)
 
         if auth_tag is None:
             return
         
-        if cache := DB.cache:
-            key = f'xauthcache:{value}'
+        values = list(dict.fromkeys(values))
+        cached = Auth.caches('xref').get_many(set([collation_key(x) for x in values]))
+        found = {}
 
-            if data := json.loads(cache.get(key) or '{}').get(auth_tag, {}).get(code):
-                return data
-        elif cached := Auth._xcache.get(value, {}).get(auth_tag, {}).get(code, None):
-            return cached
+        for value in values:
+            if (xrefs := cached.get(collation_key(value), {}).get(auth_tag, {}).get(code)) is not None:
+                # an empty list caches that the value doesn't resolve
+                found[value] = xrefs
 
-        query = Query(Condition(auth_tag, {code: value}, record_type='auth'))
-        auths = AuthSet.from_query(query.compile(), projection={'_id': 1})
-        xrefs = [r.id for r in list(auths)]
+        if missing := [x for x in values if x not in found]:
+            found.update(Auth._xlookup_auth_tag(auth_tag, code, missing))
 
-        if cache := DB.cache:
-            cache.set(key, json.dumps({auth_tag: {code: xrefs}}))
-        else:
-            Auth._xcache.setdefault(value, {}).setdefault(auth_tag, {})[code] = xrefs
+        return found
 
-        return xrefs
+    @classmethod
+    def _xlookup_auth_tag(cls, auth_tag, code, values) -> dict:
+        # Queries and caches the xrefs that match the values in an auth tag
+        found = {value: [] for value in values}
+        keys = {}
+
+        for value in values:
+            keys.setdefault(collation_key(value), []).append(value)
+
+        query = {f'{auth_tag}.subfields': {'$elemMatch': {'code': code, 'value': {'$in': list(values)}}}}
+
+        unmapped = False
+
+        for auth in AuthSet.from_query(query, projection={auth_tag: 1}, lazy=True):
+            # the query matches under the default collation, so the found values
+            # are mapped back to the given values the same way
+            matched = set()
+
+            for value in auth.get_values(auth_tag, code):
+                matched.update(keys.get(collation_key(value), []))
+
+            for value in matched:
+                found[value].append(auth.id)
+
+            unmapped = unmapped or not matched
+
+        if unmapped:
+            # the collation key doesn't match the collation for a found value, so
+            # the unmatched values are resolved one at a time by the database
+            for value in [x for x in values if not found[x]]:
+                query = {f'{auth_tag}.subfields': {'$elemMatch': {'code': code, 'value': value}}}
+                found[value] = [auth.id for auth in AuthSet.from_query(query, projection={'_id': 1}, lazy=True)]
+
+        Auth.caches('xref').merge_many({collation_key(value): {auth_tag: {code: xrefs}} for value, xrefs in found.items()})
+
+        return found
 
     @classmethod
     def xlookup_multi(cls, tag, subfields, *, record_type):
@@ -1949,17 +2759,14 @@ class Auth(Marc):
         if auth_tag is None:
             return
 
-        values = ''.join([x.value for x in subfields])
-        cached = Auth._xcache.get('__multi__', {}).get(values, {}).get(auth_tag, {})
+        key = (auth_tag, tuple([(x.code, x.value) for x in subfields]))
         
-        if cached:
+        if (cached := Auth.caches('multi').get(key)) is not None:
             return cached
 
         query = Query(Condition(auth_tag, dict(zip([x.code for x in subfields], [x.value for x in subfields])), record_type='auth'))       
-        
-        auths = AuthSet.from_query(query.compile())
-        xrefs = [a.id for a in auths]
-        Auth._xcache.setdefault('__multi__', {}).setdefault(values, {})[auth_tag] = xrefs
+        xrefs = [doc['_id'] for doc in DB.auths.find(query.compile(), projection={'_id': 1})]
+        Auth.caches('multi').set(key, xrefs)
 
         return xrefs
 
@@ -1968,34 +2775,39 @@ class Auth(Marc):
         '''Determines if there is an exact authority match for specific subfields'''
         
         assert [isinstance(x, Subfield) for x in subfields]
-        subfields_str = str([(x.code, x.value) for x in subfields])
+        key = (tag, record_type, tuple([(x.code, x.value) for x in subfields]))
 
-        if xref := Auth._acache.get(subfields_str):
+        if xref := Auth.caches('ambiguous').get(key):
             return xref
         
         if matches := cls.xlookup_multi(tag, subfields, record_type=record_type):
             if len(matches) == 1:
-                Auth._acache.setdefault(subfields_str, matches[0])
+                Auth.caches('ambiguous').set(key, matches[0])
 
                 return matches[0]
             elif len(matches) > 1:
+                # exact match of the heading subfields, fetching the candidates' headings at once
+                target = [(x.code, x.value) for x in subfields]
+                projection = dict.fromkeys(Config.auth_heading_tags(), 1)
                 candidates = []
 
-                for xref in matches:
-                    auth_subfields = cls.from_id(xref).heading_field.subfields
-
-                    if [(x.code, x.value) for x in subfields] == [(x.code, x.value) for x in auth_subfields]:
-                        candidates.append(xref)
+                for auth in AuthSet.from_query({'_id': {'$in': matches}}, projection=projection, keep_data=False, lazy=True):
+                    if (hf := auth.heading_field) and [(x.code, x.value) for x in hf.subfields] == target:
+                        candidates.append(auth.id)
                     
                 if len(candidates) == 1:
-                    return candidates.pop()
+                    Auth.caches('ambiguous').set(key, candidates[0])
+
+                    return candidates[0]
                
         return None
 
     @classmethod
     def partial_lookup(cls, tag, code, string, *, record_type, limit=25):
         """Returns a list of tuples containing the authority-controlled values
-        that match the given string
+        that match the given string. If the typeahead index has been built with
+        `Auth.build_typeahead`, strings that are not regexes are matched against
+        the normalized headings in the index instead of the database
 
         Positional arguments
         --------------------
@@ -2017,9 +2829,7 @@ class Auth(Marc):
             and the second is the xref#
         """
 
-        cached = Auth._pcache.get(tag, {}).get(code, {}).get(string, None)
-
-        if cached:
+        if cached := Auth.caches('partial').get((tag, code, string)):
             return cached
 
         auth_tag = Config.authority_source_tag(record_type, tag, code)
@@ -2027,6 +2837,12 @@ class Auth(Marc):
         if auth_tag is None:
             return
 
+        if Auth.typeahead.built and (xrefs := Auth.typeahead.search(auth_tag, code, string, limit=limit)) is not None:
+            results = [Auth(Auth.typeahead.docs[xref]) for xref in xrefs]
+            Auth.caches('partial').set((tag, code, string), results)
+
+            return results
+
         query = Query(Condition(auth_tag, {code: Regex(string, 'i')}))
         auths = AuthSet.from_query(
             query.compile(),
@@ -2036,7 +2852,7 @@ class Auth(Marc):
         )
         results = list(auths)
         
-        Auth._pcache.setdefault(tag, {}).setdefault(code, {}).update({string: results})
+        Auth.caches('partial').set((tag, code, string), results)
 
         return results
 
@@ -2054,7 +2870,8 @@ class Auth(Marc):
         dlx.marc.Datafield
         """
             
-        self._heading_field = next(filter(lambda field: field.tag[0:1] == '1', self.fields), None)
+        self.materialize(lambda tag: tag[0:1] == '1')
+        self._heading_field = next(filter(lambda field: field.tag[0:1] == '1', self._fields), None)
         
         return self._heading_field
 
@@ -2088,13 +2905,16 @@ class Auth(Marc):
         for sub in filter(lambda sub: sub.code == code, source_field.subfields):
             return sub.value
 
-    def in_use(self, *, usage_type=None):
+    def in_use(self, *, usage_type=None, exact=False):
         """Returns the count of records using the authority.
         
         Parameters
         ---------
         usage_type : ("bib"|"auth"), None
             If None, counts total use in both
+        exact : bool
+            If True, the records are counted by querying them instead of 
+            reading the materialized counts, which can be stale
         
         Returns
         -------
@@ -2104,42 +2924,254 @@ class Auth(Marc):
         if not self.id:
             return
         
-        def count(lookup_class, xref):
-            tags = list(Config.bib_authority_controlled.keys()) if lookup_class == Bib else list(Config.auth_authority_controlled.keys())
-            set_class = BibSet if lookup_class == Bib else AuthSet
+        if usage_type not in (None, 'bib', 'auth'):
+            raise Exception('Invalid usage_type')
 
-            return set_class.from_query({'$or': [{f'{tag}.subfields.xref': xref} for tag in tags]}).count
+        types = ['bib', 'auth'] if usage_type is None else [usage_type]
 
-        if usage_type is None:
-            total = 0
-            
-            for cls in (Bib, Auth):
-                total += count(cls, self.id)
-                
-            return total
-        if usage_type == 'bib':
-            return count(Bib, self.id)
-        elif usage_type == 'auth':
-            return count(Auth, self.id)          
-        else:    
-            raise Exception('Invalid usage_type')
+        if not exact and (counts := DB.handle['auth_use'].find_one({'_id': self.id})) and counts['bib'] >= 0 and counts['auth'] >= 0:
+            # materialized counts
+            return sum([counts[x] for x in types])
+
+        # exact, or the counts have not been built for this auth, or have 
+        # drifted because records were written without `commit`
+        return sum([Auth._count_use(x, self.id) for x in types])
+
+    @staticmethod
+    def _count_use(record_type, xref) -> int:
+        # counts the records of the record type linked to the xref, by query
+        tags = list(getattr(Config, f'{record_type}_authority_controlled').keys())
+        set_class = BibSet if record_type == 'bib' else AuthSet
+
+        return set_class.from_query({'$or': [{f'{tag}.subfields.xref': xref} for tag in tags]}).count
+
+    @classmethod
+    def build_use_counts(cls):
+        '''(Re)builds the materialized usage counts read by `Auth.in_use`, 
+        from an aggregation of the xrefs in the authority-controlled fields 
+        of the bibs and auths. The counts are then kept up to date on commit
+        and delete.
+
+        The counts are built in a separate collection that then replaces
+        the current counts, so this can be run at any time. The counts of the
+        auths linked or unlinked by records committed during the build are 
+        recounted by querying the records before and after the swap'''
+
+        counts, col = {}, DB.handle['auth_use_build']
+        col.drop()
+        # from here on, the auths linked or unlinked by commits are marked in the new counts
+        total = Auth._write_batches(col, (UpdateOne({'_id': doc['_id']}, {'$set': {'bib': 0, 'auth': 0}}, upsert=True) for doc in DB.auths.find({}, projection={'_id': 1})))
+
+        for record_type, handle in (('bib', DB.bibs), ('auth', DB.auths)):
+            tags = list(getattr(Config, f'{record_type}_authority_controlled').keys())
+            pipeline = [
+                {'$match': {'$or': [{f'{tag}.subfields.xref': {'$exists': True}} for tag in tags]}},
+                {'$project': {'fields': {'$concatArrays': [{'$ifNull': [f'${tag}', []]} for tag in tags]}}},
+                {'$unwind': '$fields'},
+                {'$unwind': '$fields.subfields'},
+                {'$match': {'fields.subfields.xref': {'$exists': True}}},
+                # count each record once per xref
+                {'$group': {'_id': {'xref': '$fields.subfields.xref', 'record': '$_id'}}},
+                {'$group': {'_id': '$_id.xref', 'count': {'$sum': 1}}}
+            ]
+
+            for result in handle.aggregate(pipeline, allowDiskUse=True):
+                counts.setdefault(result['_id'], {'bib': 0, 'auth': 0})[record_type] = result['count']
+
+        Auth._write_batches(col, (UpdateOne({'_id': xref}, {'$set': n}) for xref, n in counts.items()))
+        Auth._recount_touched(col)
+        col.rename('auth_use', dropTarget=True)
+        # changes made between the recount and the swap were not applied to the new counts
+        Auth._recount_touched(DB.handle['auth_use'])
+
+        return total
+
+    @staticmethod
+    def _recount_touched(col):
+        # recounts the auths marked by _update_use while the counts were being built
+        Auth._write_batches(
+            col, 
+            (
+                UpdateOne({'_id': doc['_id']}, {'$set': {x: Auth._count_use(x, doc['_id']) for x in ('bib', 'auth')}, '$unset': {'touched': ''}})
+                for doc in list(col.find({'touched': True}, projection={'_id': 1}))
+            )
+        )
+
+    @staticmethod
+    def _write_batches(col, updates, *, batch_size=10000) -> int:
+        # writes the updates from an iterable in batches. returns the number of updates
+        batch, total = [], 0
+
+        for update in updates:
+            batch.append(update)
+
+            if len(batch) == batch_size:
+                bulk_write(col, batch, ordered=False)
+                total += len(batch)
+                batch = []
+
+        if batch:
+            bulk_write(col, batch, ordered=False)
+            total += len(batch)
+
+        return total
+
+    @staticmethod
+    def _linked_xrefs(record_type, doc) -> set:
+        # the xrefs in the authority-controlled fields of a record's BSON
+        tags = getattr(Config, f'{record_type}_authority_controlled').keys()
+
+        return set([x['xref'] for tag in tags for field in doc.get(tag, []) for x in field.get('subfields', []) if 'xref' in x])
+
+    @staticmethod
+    def _update_use(record_type, *changes):
+        # updates the usage counts of the auths linked or unlinked by record 
+        # changes, given as (before, after) pairs of record BSON. only auths 
+        # that have counts are updated
+        deltas = Counter()
+
+        for before, after in changes:
+            before, after = Auth._linked_xrefs(record_type, before), Auth._linked_xrefs(record_type, after)
+            deltas.update(after - before)
+            deltas.subtract(before - after)
+
+        # one update per distinct change in count
+        by_delta = {}
+        [by_delta.setdefault(n, []).append(xref) for xref, n in deltas.items() if n]
+
+        for n, xrefs in by_delta.items():
+            DB.handle['auth_use'].update_many({'_id': {'$in': xrefs}}, {'$inc': {record_type: n}})
+
+        if deltas := [xref for xref, n in deltas.items() if n]:
+            # the counts are being rebuilt. see `build_use_counts`
+            DB.handle['auth_use_build'].update_many({'_id': {'$in': deltas}}, {'$set': {'touched': True}})
 
     def list_attached(self, usage_type=None):
         """List the records attached to this auth record"""
 
-        def list_records(lookup_class, xref: int) -> list[Marc]:
-            tags = list(Config.bib_authority_controlled.keys()) if lookup_class == BibSet else list(Config.auth_authority_controlled.keys())
-            return [record for tag in tags for record in lookup_class.from_query({f'{tag}.subfields.xref': xref})]
+        return list(self.iter_attached(usage_type))
 
-        if usage_type == 'bib':
-            return list_records(BibSet, self.id)
-        elif usage_type == 'auth':
-            return list_records(AuthSet, self.id)
-        elif usage_type is None:
-            return [record for cls in (BibSet, AuthSet) for record in list_records(cls, self.id)]
-        else:
+    def iter_attached(self, usage_type=None, *, projection=None, batch_size=1000) -> typing.Generator[Marc, None, None]:
+        """Yields the records attached to this auth record, once each.
+
+        Runs one query per collection, reading the records in batches 
+        ordered by _id, so the records can be committed while iterating.
+
+        Parameters
+        ----------
+        usage_type : ("bib"|"auth"), None
+            If None, yields the attached bibs then auths
+        projection : dict
+            Passed to `pymongo.collection.Collection.find`
+        batch_size : int
+
+        Returns
+        -------
+        Generator[Marc]
+        """
+
+        if usage_type not in (None, 'bib', 'auth'):
             raise Exception('Invalid "usage_type"')
 
+        def iterate(record_type):
+            tags = list(getattr(Config, f'{record_type}_authority_controlled').keys())
+            set_class = BibSet if record_type == 'bib' else AuthSet
+            query = {'$or': [{f'{tag}.subfields.xref': self.id} for tag in tags]}
+            last = None
+
+            while tags:
+                batch = query if last is None else {'$and': [query, {'_id': {'$gt': last}}]}
+                records = list(set_class.from_query(batch, projection=projection, sort=[('_id', 1)], limit=batch_size))
+                yield from records
+
+                if len(records) < batch_size:
+                    break
+
+                last = records[-1].id
+
+        for record_type in ('bib', 'auth'):
+            if usage_type in (None, record_type):
+                yield from iterate(record_type)
+
+    def update_attached(self, previous_state, *, user=None, batch_size=1000, progress=None) -> dict:
+        """Updates the records attached to this auth after its heading has
+        changed from the heading in `previous_state`. The changes to the 
+        linked fields (tag, and subfields removed or added) are worked out
+        once, applied to the records in batches, and the batches are 
+        committed with `MarcSet.commit_all`.
+
+        Parameters
+        ----------
+        previous_state : dict
+            The saved auth before the heading changed
+        user : str
+            Defaults to the user of this auth
+        batch_size : int
+        progress : callable
+            Called after each batch with the number of records done and the
+            number of records attached
+
+        Returns
+        -------
+        dict
+            "updated": the number of records updated, by record type
+            "failed": the record type, ID and error of the records that could not be updated
+        """
+
+        previous, heading = Auth(previous_state).heading_field, self.heading_field
+        new_tag = heading.tag if heading.tag != previous.tag else None
+        removed = [x.code for x in previous.subfields if x.code not in [y.code for y in heading.subfields]]
+        added = [x.code for x in heading.subfields if x.code not in [y.code for y in previous.subfields]]
+        user = user or self.user
+        loops = set(Auth._linked_xrefs('auth', self.to_bson()))
+        total, done = self.in_use(), 0
+        report = {'updated': {'bib': 0, 'auth': 0}, 'failed': []}
+
+        def transform(record):
+            for field in record.datafields:
+                if self.id in [x.xref for x in field.subfields if hasattr(x, 'xref')]:
+                    if new_tag:
+                        field.tag = field.tag[0] + new_tag[1:]
+
+                    field.subfields = [x for x in field.subfields if x.code not in removed] + [Linked(code, self.id) for code in added]
+
+            return record
+
+        attached = self.iter_attached(batch_size=batch_size)
+
+        while batch := list(itertools.islice(attached, batch_size)):
+            results = []
+
+            for set_class in (BibSet, AuthSet):
+                records = [x for x in batch if x.record_type == set_class().record_type]
+                # prevent feedback loops
+                looped = [x for x in records if x.record_type == 'auth' and x.id in loops]
+                records = [transform(x) for x in records if not (x.record_type == 'auth' and x.id in loops)]
+
+                if records:
+                    results += set_class.commit_all(records, user=user, auth_check=False)
+
+                if looped:
+                    results += set_class.commit_all(looped, user=user, auth_check=False, update_attached=False)
+
+            for record, error in results:
+                if error:
+                    report['failed'].append((record.record_type, record.id, error))
+                else:
+                    report['updated'][record.record_type] += 1
+
+            if logs := [{'record_type': record.record_type, 'record_id': record.id, 'action': 'updated', 'triggered_by': self.id, 'time': datetime.now(timezone.utc)} for record, error in results if not error]:
+                # for debugging
+                DB.handle['auth_linked_update_log'].insert_many(logs)
+
+            done += len(batch)
+            LOGGER.info(f'auth {self.id}: updated {done} / {total} attached records')
+
+            if progress:
+                progress(done, total)
+
+        return report
+
     def merge(self, *, user, losing_record):
         if not isinstance(losing_record, Auth):
             raise Exception("Losing record must be of type Auth")
@@ -2149,27 +3181,10 @@ class Auth(Marc):
         DB.handle['merge_log'].insert_one({'record_type': 'auth', 'record_id': self.id, 'action': 'gaining', 'time': datetime.now(timezone.utc), 'user': user})
 
         def update_records(record_type, gaining, losing):
-            authmap = getattr(Config, f'{record_type}_authority_controlled')
-            
-            # build query for all records that are linked to the losing auth
-            conditions = []
-                 
-            for ref_tag, d in authmap.items():
-                #for subfield_code, auth_tag in d.items():
-                #    if auth_tag == losing.heading_field.tag:
-                
-                conditions.append(Raw({f'{ref_tag}.subfields.xref': losing.id}, record_type=record_type))
-
-            if len(conditions) == 0:
-                return 0
-            
-            cls = BibSet if record_type == 'bib' else AuthSet
-            query = Query(Or(*conditions))
-            
             #  update the records linked to the losing auth with the gaining auth id
             changed = 0
 
-            for record in cls.from_query(query):
+            for record in losing.iter_attached(record_type):
                 state = record.to_bson()
                 
                 for i, field in enumerate(record.fields):
@@ -2184,10 +3199,10 @@ class Auth(Marc):
                 if record.to_bson() != state:
                     # the record has actually changed
 
-                    def do_commit():
+                    def do_commit(record):
                         # we can skip the auth validation because these records should already be validated
                         # Wrapping this in a try/except block and sending the exception to a configured log
-                        # surfaces exceptions that occur in a thread. This is the only threaded function.
+                        # surfaces exceptions that occur in a thread.
                         try:
                             record.commit(user=user, auth_check=False)
                         except Exception as err:
@@ -2197,31 +3212,26 @@ class Auth(Marc):
                         # for debugging
                         DB.handle['merge_log'].insert_one({'record_type': record_type, 'record_id': record.id, 'action': 'updated', 'time': datetime.now(timezone.utc), 'user': user})
                     
-                    if DB.database_name == 'testing' or Config.threading == False:
-                        do_commit()
-                    else:
-                        t = threading.Thread(target=do_commit, args=[])
-                        t.start()
+                    futures.append(DB.executor.submit(do_commit, record))
                 
                 changed += 1
 
             return changed
         
-        changed = 0
+        changed, futures = 0, []
         
         for record_type in ('bib', 'auth'):
             changed += update_records(record_type, self, losing_record)
         
-        i = 0
-
-        while changed > 0 and losing_record.in_use(usage_type='bib') or losing_record.in_use(usage_type='auth'):
-            # wait for all the links to be updated, otherwise the delete fails
-            i += 1
+        # wait for all the links to be updated, otherwise the delete fails
+        done, not_done = wait(futures, timeout=1200)
 
-            if i > 1200:
-                raise Exception("The merge is taking too long (> 1200 seconds)")
+        if not_done:
+            raise Exception("The merge is taking too long (> 1200 seconds)")
 
-            time.sleep(1)
+        for future in done:
+            if future.exception():
+                raise future.exception()
 
         losing_record.delete(user)
 
@@ -2283,9 +3293,106 @@ class Diff():
 
 
 class History():
+    """Record histories are stored in two collections. The history documents
+    in the `{record_type}_history` collection hold the audit data and a count
+    of the versions. The versions are appended to fixed-size buckets in the
+    `{record_type}_history_buckets` collection. Histories saved before the
+    buckets existed keep their versions in the history document, until they
+    are moved into buckets by the migrate-history script."""
+
     def __init__(self):
         pass
 
+    @classmethod
+    def iter_versions(cls, record_id: int) -> typing.Generator[None, None, dict]:
+        """Yields the saved versions of the record, oldest first, one bucket
+        at a time."""
+
+        head = DB.handle[cls.record_type + '_history'].find_one({'_id': record_id}, projection={'history': 1})
+        buckets = DB.handle[cls.record_type + '_history_buckets']
+        version = None
+
+        for entry in (head or {}).get('history') or []:
+            yield (version := cls._rebuild(entry, version))
+
+        for bucket in buckets.find({'record_id': record_id}, sort=[('bucket', 1)], batch_size=1):
+            for entry in bucket['history']:
+                yield (version := cls._rebuild(entry, version))
+
+    @classmethod
+    def version(cls, record_id: int, number: int) -> dict:
+        """Returns the saved version of the record by version number, starting
+        at 1 (oldest), or None if it doesn't exist. Only the bucket containing
+        the version is read, from the last keyframe before the version if the
+        versions are stored as deltas."""
+
+        if number < 1:
+            return
+
+        head = DB.handle[cls.record_type + '_history'].find_one({'_id': record_id}, projection={'history': 1})
+        legacy = (head or {}).get('history') or []
+
+        if number <= len(legacy):
+            return legacy[number - 1]
+
+        number -= len(legacy)
+        buckets = DB.handle[cls.record_type + '_history_buckets']
+
+        for bucket in buckets.find({'record_id': record_id}, projection={'count': 1}, sort=[('bucket', 1)]):
+            if number <= bucket['count']:
+                position = number - 1
+                keyframe = position - position % Config.history_keyframe_interval
+                entries = buckets.find_one({'_id': bucket['_id']}, projection={'history': {'$slice': [keyframe, position - keyframe + 1]}})['history']
+
+                if entries[0].get('_delta'):
+                    # the keyframe interval has changed
+                    entries = buckets.find_one({'_id': bucket['_id']}, projection={'history': {'$slice': [0, position + 1]}})['history']
+
+                return cls._rebuild_all(entries)
+
+            number -= bucket['count']
+
+    @classmethod
+    def latest(cls, record_id: int) -> dict:
+        """Returns the last saved version of the record, or None if there is no
+        history"""
+
+        buckets = DB.handle[cls.record_type + '_history_buckets']
+
+        if bucket := buckets.find_one({'record_id': record_id}, projection={'history': {'$slice': -Config.history_keyframe_interval}}, sort=[('bucket', -1)]):
+            if all([x.get('_delta') for x in bucket['history']]):
+                # the keyframe interval has changed
+                bucket = buckets.find_one({'_id': bucket['_id']})
+
+            return cls._rebuild_all(bucket['history'])
+
+        head = DB.handle[cls.record_type + '_history'].find_one({'_id': record_id}, projection={'history': {'$slice': -1}})
+
+        if history := (head or {}).get('history'):
+            return history[-1]
+
+    @classmethod
+    def _rebuild(cls, entry, previous) -> dict:
+        # The full version from a stored version and the full version before it
+        if delta := entry.get('_delta'):
+            if previous is None:
+                raise Exception('History delta found without a previous version')
+
+            return SON([(key, entry[key] if key in entry else previous[key]) for key in delta['order']])
+
+        return entry
+
+    @classmethod
+    def _rebuild_all(cls, entries) -> dict:
+        # The full version of the last entry, from the last keyframe in the entries
+        start = max([i for i, entry in enumerate(entries) if not entry.get('_delta')])
+        version = None
+
+        for entry in entries[start:]:
+            version = cls._rebuild(entry, version)
+
+        return version
+
     @classmethod
     def restore(cls, record_id: int, *, user: str = 'admin') -> Marc:
         """
@@ -2293,7 +3400,7 @@ class History():
         and restores that record by re-creating it in the actual collection.
         """
         history_collection = DB.handle[cls.record_type + '_history']
-        record_history = history_collection.find_one({'_id': record_id, 'deleted': {'$exists': True}})
+        record_history = history_collection.find_one({'_id': record_id, 'deleted': {'$exists': True}}, projection={'history': 0})
 
         # if the record is not found in history, it means it was never deleted using the existin delete method
         if record_history is None:
@@ -2303,7 +3410,7 @@ class History():
         if cls.record_class.from_id(record_id):
             raise Exception(f'{cls.record_type} {record_id} already exists in the main collection. Cannot restore from history.')
 
-        latest_version = record_history['history'][-1]  # get the last version before deletion
+        latest_version = cls.latest(record_id)  # get the last version before deletion
 
         # This shouldn't happen
         if not latest_version:
@@ -2323,34 +3430,115 @@ class History():
             #    {'$unset': {'deleted': ''}}
             #)
 
-            # indicate restored status
-            record_history['restored'] = SON({'user': user, 'time': datetime.now(timezone.utc)})
-            
-            # new field containing list of actions performed on the record. this may ultimately
-            # replace the current format of the history data
-            record_history.setdefault('actions', [])
-            record_history['actions'].append({
-                'type': 'restore',
-                'user': user,
-                'time': datetime.now(timezone.utc)
-            })
-
-            # update the data in the db
-            history_collection.replace_one({'_id': record_id}, record_history)
+            # indicate restored status, and add to the list of actions performed on the record.
+            # the actions may ultimately replace the current format of the history data
+            history_collection.update_one(
+                {'_id': record_id},
+                {
+                    '$set': {'restored': SON({'user': user, 'time': datetime.now(timezone.utc)})},
+                    '$push': {'actions': {'type': 'restore', 'user': user, 'time': datetime.now(timezone.utc)}}
+                }
+            )
         else:
             raise Exception(f'Failed to restore {cls.record_type} {record_id} from history.')
 
         return restored_record
 
+    @classmethod
+    def migrate(cls) -> int:
+        """Moves the versions of the histories saved before the buckets
+        existed into buckets. The history of a record should not be written to
+        while it is being moved. Returns the number of histories moved."""
+
+        history_collection = DB.handle[cls.record_type + '_history']
+        buckets = DB.handle[cls.record_type + '_history_buckets']
+        size, total = Config.history_bucket_size, 0
+
+        for head in history_collection.find({'history': {'$exists': True}}, projection={'_id': 1}):
+            record_id = head['_id']
+            versions = list(cls.iter_versions(record_id))
+            chunks = [versions[i:i+size] for i in range(0, len(versions), size)]
+
+            if chunks:
+                bulk_write(
+                    buckets,
+                    [
+                        ReplaceOne(
+                            {'_id': f'{record_id}.{bucket}'},
+                            {'_id': f'{record_id}.{bucket}', 'record_id': record_id, 'bucket': bucket, 'count': len(chunk), 'history': chunk},
+                            upsert=True
+                        ) for bucket, chunk in enumerate(chunks)
+                    ]
+                )
+
+            # buckets of versions that have been renumbered
+            buckets.delete_many({'record_id': record_id, 'bucket': {'$gte': len(chunks)}})
+            history_collection.update_one({'_id': record_id}, {'$set': {'versions': len(versions), 'bucket_size': size}, '$unset': {'history': ''}})
+            total += 1
+
+        return total
+
+    @classmethod
+    def _matching_ids(cls, query: Query, *, sort=None, skip=0, limit=0, **kwargs) -> list:
+        # The ids of the records with any saved version that matches the query.
+        # The matches of both collections are merged by record before `sort`,
+        # `skip` and `limit` are applied. Only sorting by record id applies
+        ids = {}
+
+        for name in ('_history', '_history_buckets'):
+            handle = DB.handle[cls.record_type + name]
+
+            # the versions stored as deltas are matched once they are rebuilt
+            for doc in handle.find({'history': {'$elemMatch': query.compile()}, 'history._delta': {'$exists': False}}, projection={'record_id': 1}, **kwargs):
+                ids[doc.get('record_id', doc['_id'])] = None
+
+        for record_id in cls._matching_delta_ids(query):
+            ids[record_id] = None
+
+        ids = list(ids)
+
+        if sort:
+            direction = sort[0][1] if isinstance(sort, (list, tuple)) else 1
+            ids.sort(reverse=direction == -1)
+
+        return ids[skip:skip + limit] if limit else ids[skip:]
+
+    @classmethod
+    def _matching_delta_ids(cls, query: Query) -> list:
+        # The ids of the records with versions stored as deltas that have any
+        # version that matches the query. The deltas lack the unchanged fields,
+        # so the versions are rebuilt into a temporary collection to be matched
+        buckets = DB.handle[cls.record_type + '_history_buckets']
+        record_ids = buckets.distinct('record_id', {'history._delta': {'$exists': True}})
+
+        if not record_ids:
+            return []
+
+        scratch = DB.handle[f'{cls.record_type}_history_match_{os.getpid()}_{threading.get_ident()}']
+        scratch.drop()
+
+        try:
+            for record_id in record_ids:
+                versions = [SON([(key, val) for key, val in version.items() if key != '_id']) for version in cls.iter_versions(record_id)]
+
+                for version in versions:
+                    version['record_id'] = record_id
+
+                if versions:
+                    scratch.insert_many(versions)
+
+            return sorted(scratch.distinct('record_id', query.compile()))
+        finally:
+            scratch.drop()
+
     @classmethod
     def from_query(cls, query: Query, **kwargs) -> typing.Generator[None, CursorType, Marc]:
         '''Yields history reords that mtch the query as Marc objects'''
 
         self = cls()
-        handle = DB.handle[self.record_type + '_history']
 
-        for doc in handle.find({'history': {'$elemMatch': query.compile()}}, **kwargs):
-            for version in doc['history']:
+        for record_id in self._matching_ids(query, **kwargs):
+            for version in self.iter_versions(record_id):
                 yield self.record_class(version)
 
     @classmethod
@@ -2359,14 +3547,16 @@ class History():
 
         self = cls()
         handle = DB.handle[self.record_type + '_history']
+        ids = self._matching_ids(query, **kwargs)
+        heads = {doc['_id']: doc for doc in handle.find({'_id': {'$in': ids}, 'deleted': {'$exists': True}}, projection={'deleted': 1, 'restored': 1})}
 
-        for doc in handle.find({'history': {'$elemMatch': query.compile()}}, **kwargs):
-            if deleted := doc.get('deleted'):
-                if restored := doc.get('restored'):
+        for record_id in ids:
+            if deleted := heads.get(record_id, {}).get('deleted'):
+                if restored := heads[record_id].get('restored'):
                     if restored['time'] > deleted['time']:
                         continue
 
-                yield doc['_id']
+                yield record_id
 
     @classmethod
     def deleted_by_date(cls, date_from: datetime, date_to: datetime = datetime.now(timezone.utc)) -> typing.Generator[None, CursorType, Marc]:
@@ -2375,7 +3565,7 @@ class History():
         self = cls()
         handle = DB.handle[self.record_type + '_history']
 
-        for doc in handle.find({'deleted.time': {'$gte': date_from, '$lt': date_to}}):
+        for doc in handle.find({'deleted.time': {'$gte': date_from, '$lt': date_to}}, projection={'deleted': 1, 'restored': 1}):
             if deleted := doc.get('deleted'):
                 if restored := doc.get('restored'):
                     if restored['time'] > deleted['time']:
@@ -2399,14 +3589,93 @@ class AuthHistory(History):
 
 ### Field classes
 
+class FieldList(list):
+    """A list of fields that keeps an index of the fields by tag, so that tag
+    lookups in `Marc` don't need to sort the fields on every access. The index
+    is rebuilt on the first access after the list is changed or after the tag 
+    of any field is changed."""
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self._index = None
+        self._sorted = None
+        self._generation = None
+
+    def index_by_tag(self) -> dict:
+        # {tag: [fields in the order they are in the list]}, in tag order
+        if self._index is None or self._generation != Field._generation:
+            index = {}
+
+            for field in self:
+                index.setdefault(field.tag, []).append(field)
+
+            self._index = {tag: index[tag] for tag in sorted(index.keys())}
+            self._sorted = [field for fields in self._index.values() for field in fields]
+            self._generation = Field._generation
+
+        return self._index
+
+    def by_tag(self, condition=None) -> list:
+        # the fields sorted by tag, optionally only for the tags that meet the condition
+        index = self.index_by_tag()
+
+        if condition is None:
+            return list(self._sorted)
+
+        return [field for tag, fields in index.items() if condition(tag) for field in fields]
+
+    def with_tags(self, *tags) -> list:
+        # the fields with the given tags, sorted by tag
+        index = self.index_by_tag()
+
+        return [field for tag in sorted(set(tags)) for field in index.get(tag, [])]
+
+    def tags(self) -> list:
+        return list(self.index_by_tag().keys())
+
+    def _changed(self):
+        self._index = None
+
+    def append(self, *args): self._changed(); return super().append(*args)
+    def extend(self, *args): self._changed(); return super().extend(*args)
+    def insert(self, *args): self._changed(); return super().insert(*args)
+    def remove(self, *args): self._changed(); return super().remove(*args)
+    def pop(self, *args): self._changed(); return super().pop(*args)
+    def clear(self): self._changed(); return super().clear()
+    def sort(self, **kwargs): self._changed(); return super().sort(**kwargs)
+    def reverse(self): self._changed(); return super().reverse()
+    def __setitem__(self, *args): self._changed(); return super().__setitem__(*args)
+    def __delitem__(self, *args): self._changed(); return super().__delitem__(*args)
+    def __iadd__(self, other): self._changed(); return super().__iadd__(other)
+    def __imul__(self, other): self._changed(); return super().__imul__(other)
+
 class Field():
+    # fields and subfields are slotted to reduce the memory footprint of large sets of records
+    __slots__ = ('_tag',)
+
+    # incremented when the tag of a field is changed, to invalidate the `FieldList` indexes
+    _generation = 0
+
     def __init__(self):
         raise Exception('Cannot instantiate fom base class')
 
+    @property
+    def tag(self):
+        return self._tag
+
+    @tag.setter
+    def tag(self, tag):
+        if getattr(self, '_tag', None) not in (None, tag):
+            Field._generation += 1
+
+        self._tag = tag
+
     def to_bson(self):
         raise Exception('This is a stub')
 
 class Controlfield(Field):
+    __slots__ = ('record_type', 'value')
+
     def __eq__(self, other):
         if not isinstance(other, Controlfield):
             return False
@@ -2434,6 +3703,8 @@ class Controlfield(Field):
         return '={}  {}'.format(self.tag, self.value)
 
 class Datafield(Field):
+    __slots__ = ('record_type', 'ind1', 'ind2', 'subfields')
+
     def __eq__(self, other):
         if not isinstance(other, Datafield):
             return False
@@ -2511,11 +3782,14 @@ class Datafield(Field):
         values = []
 
         for code in codes:
-            i = 0
+            for sub in self.get_subfields(code):
+                value = sub.value
+
+                # stop at the first empty value
+                if not value:
+                    break
 
-            while self.get_value(code, place=i):
-                values.append(self.get_value(code, place=i))
-                i += 1
+                values.append(value)
 
         return values
 
@@ -2643,31 +3917,31 @@ class Datafield(Field):
         return string + term
 
     def to_mrk(self, language=None):
-        field = copy.deepcopy(self) # so as not to alter the original object's data
-        inds = field.ind1 + field.ind2
+        inds = self.ind1 + self.ind2
         inds = inds.replace(' ', '\\')
         inds = inds.replace('_', '\\')
+        string = f'={self.tag}  {inds}'
 
-        # add first xref found to $0 if $0 doesn't already exist
-        if subfield := next(filter(lambda x: hasattr(x, 'xref'), field.subfields), None):
-            if field.get_subfield('0') is None:
-                field.subfields.append(Literal('0', str(subfield.xref)))
-
-        string = f'={field.tag}  {inds}'
-
-        for sub in field.subfields:
-            if language and Config.linked_language_source_tag(self.record_type, field.tag, sub.code, language):
+        for sub in self.subfields:
+            if language and Config.linked_language_source_tag(self.record_type, self.tag, sub.code, language):
                 value = sub.translated(language)
             else: 
                 value = sub.value
 
             string += f'${sub.code}{value}'
 
+        # add first xref found to $0 if $0 doesn't already exist
+        if subfield := next(filter(lambda x: hasattr(x, 'xref'), self.subfields), None):
+            if self.get_subfield('0') is None:
+                string += f'$0{subfield.xref}'
+
         return string
 
 ### Subfield classes
 
 class Subfield():
+    __slots__ = ()
+
     def __init__(self):
         raise Exception('Cannot instantiate fom base class')
 
@@ -2682,6 +3956,8 @@ class Subfield():
             return False
 
 class Literal(Subfield):
+    __slots__ = ('code', 'value')
+
     def __init__(self, code, value):
         self.code = code
         self.value = value
@@ -2696,6 +3972,8 @@ class Literal(Subfield):
         return {'code': self.code, 'value': self.value}
 
 class Linked(Subfield):
+    __slots__ = ('code', 'xref', '_value')
+
     def __init__(self, code, xref, value=None):
         self.code = code
         self.xref = int(xref)
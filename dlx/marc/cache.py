@@ -0,0 +1,451 @@
+import sys, os, re, ast, json, time, threading, unicodedata
+from collections import OrderedDict
+from uuid import uuid4
+from dlx.db import DB
+from dlx.config import Config
+
+class Cache():
+    '''Base class for the lookup caches. Keys and values are whatever the
+    caller needs to store, as long as the values can be serialized to JSON
+    when a shared backend is in use. `index` is an optional function that
+    returns the values an entry's key is derived from, so the entries can be
+    evicted by value'''
+
+    def __init__(self, *, index=None):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.index = index
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def get_many(self, keys) -> dict:
+        # Returns the found entries for the keys. Missing keys are not included
+        keys = list(keys)
+        found = self._get_many(keys)
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+
+        return found
+
+    def set(self, key, value):
+        self.set_many({key: value})
+
+    def set_many(self, values: dict):
+        raise Exception('This is a stub')
+
+    def merge_many(self, values: dict):
+        # Deep merges dict values into the existing entries. Does not count
+        # towards hits and misses
+        existing = self._get_many(list(values.keys()))
+        self.set_many({key: _merge(existing.get(key, {}), value) for key, value in values.items()})
+
+    def delete(self, *keys):
+        raise Exception('This is a stub')
+
+    def evict(self, predicate):
+        # Deletes the entries whose key satisfy the predicate
+        raise Exception('This is a stub')
+
+    def evict_indexed(self, values):
+        # Deletes the entries whose key is derived from any of the values
+        values = set(values)
+
+        if values:
+            self.evict(lambda key: any(x in values for x in self.index(key)))
+
+    def clear(self):
+        raise Exception('This is a stub')
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+    def _get_many(self, keys) -> dict:
+        raise Exception('This is a stub')
+
+class MemoryCache(Cache):
+    '''In-process LRU cache
+
+    Keyword arguments
+    -----------------
+    maxsize : int
+        The maximum number of entries
+    max_bytes : int
+        The approximate maximum size of the stored values
+    ttl : int
+        Seconds after which an entry expires
+    '''
+
+    def __init__(self, *, maxsize=None, max_bytes=None, ttl=None, index=None):
+        super().__init__(index=index)
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        self._data = OrderedDict() # key -> (expires, size, value)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._get_many([key])
+
+    def _get_many(self, keys) -> dict:
+        found, now = {}, time.time() if self.ttl else None
+
+        with self._lock:
+            for key in keys:
+                if (entry := self._data.get(key)) is None:
+                    continue
+                elif now and entry[0] < now:
+                    self._remove(key)
+                    self.evictions += 1
+                else:
+                    self._data.move_to_end(key)
+                    found[key] = entry[2]
+
+        return found
+
+    def set_many(self, values: dict):
+        expires = time.time() + self.ttl if self.ttl else None
+
+        with self._lock:
+            for key, value in values.items():
+                self._remove(key)
+                size = _sizeof(value) if self.max_bytes else 0
+                self._data[key] = (expires, size, value)
+                self.bytes += size
+
+            while self._data and ((self.maxsize and len(self._data) > self.maxsize) or (self.max_bytes and self.bytes > self.max_bytes)):
+                self._remove(next(iter(self._data)))
+                self.evictions += 1
+
+    def delete(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._remove(key)
+
+    def evict(self, predicate):
+        with self._lock:
+            for key in [k for k in self._data if predicate(k)]:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self) -> dict:
+        return {**super().stats(), 'size': len(self._data), 'bytes': self.bytes}
+
+    def _remove(self, key):
+        # caller holds the lock
+        if (entry := self._data.pop(key, None)) is not None:
+            self.bytes -= entry[1]
+
+class RedisCache(Cache):
+    '''Shared cache stored in Redis/Valkey. Values are stored as JSON
+    strings under `{prefix}{key}`. If there is an `index` function, the keys 
+    derived from each value are kept in a set under `{index prefix}{value}`, 
+    so they can be evicted without scanning the namespace'''
+
+    def __init__(self, client, *, prefix, ttl=None, index=None):
+        super().__init__(index=index)
+        self.client = client
+        self.prefix = prefix
+        self.index_prefix = prefix.rstrip(':') + 'index:'
+        self.ttl = ttl
+
+    def _get_many(self, keys) -> dict:
+        if not keys:
+            return {}
+
+        # one round trip for all the keys
+        data = self.client.mget([self.prefix + str(key) for key in keys])
+
+        return {key: json.loads(value) for key, value in zip(keys, data) if value is not None}
+
+    def set_many(self, values: dict):
+        if not values:
+            return
+
+        pipeline = self.client.pipeline()
+
+        for key, value in values.items():
+            pipeline.set(self.prefix + str(key), json.dumps(value), ex=self.ttl)
+
+            for indexed in set(self.index(key) if self.index else []):
+                pipeline.sadd(self.index_prefix + str(indexed), self.prefix + str(key))
+
+                if self.ttl:
+                    # the set outlives the entries added to it
+                    pipeline.expire(self.index_prefix + str(indexed), self.ttl)
+
+        pipeline.execute()
+
+    def delete(self, *keys):
+        if keys:
+            self.client.delete(*[self.prefix + str(key) for key in keys])
+
+    def evict(self, predicate):
+        # scans the namespace. the keys are read back from their string form
+        keys = [key for key in self.client.scan_iter(match=self.prefix + '*', count=1000) if predicate(_key(_str(key)[len(self.prefix):]))]
+
+        if keys:
+            self.client.delete(*keys)
+
+    def evict_indexed(self, values):
+        sets = [self.index_prefix + str(value) for value in set(values)]
+
+        if not sets:
+            return
+
+        pipeline = self.client.pipeline()
+
+        for name in sets:
+            pipeline.smembers(name)
+
+        if keys := set().union(*pipeline.execute()):
+            self.client.delete(*keys, *sets)
+        else:
+            self.client.delete(*sets)
+
+    def clear(self):
+        for prefix in (self.prefix, self.index_prefix):
+            for key in self.client.scan_iter(match=prefix + '*'):
+                self.client.delete(key)
+
+    def stats(self) -> dict:
+        return {**super().stats(), 'size': None, 'bytes': None}
+
+class RedisHashCache(RedisCache):
+    '''Shared cache of dict values, stored as one Redis hash per key with the
+    dict items as JSON strings. Merges are written without reading the 
+    existing entries first'''
+
+    def _get_many(self, keys) -> dict:
+        if not keys:
+            return {}
+
+        pipeline = self.client.pipeline(transaction=False)
+
+        for key in keys:
+            pipeline.hgetall(self.prefix + str(key))
+
+        return {key: {_str(k): json.loads(v) for k, v in data.items()} for key, data in zip(keys, pipeline.execute()) if data}
+
+    def set_many(self, values: dict):
+        self._write(values, replace=True)
+
+    def merge_many(self, values: dict):
+        self._write(values, replace=False)
+
+    def _write(self, values, *, replace):
+        if not values:
+            return
+
+        pipeline = self.client.pipeline(transaction=False)
+
+        for key, value in values.items():
+            key = self.prefix + str(key)
+
+            if replace:
+                pipeline.delete(key)
+
+            if value:
+                pipeline.hset(key, mapping={k: json.dumps(v) for k, v in value.items()})
+
+                if self.ttl:
+                    pipeline.expire(key, self.ttl)
+
+        pipeline.execute()
+
+class InvalidationBus():
+    '''Sends cache invalidations between processes over Redis/Valkey pub/sub.
+    Messages are JSON objects. A process ignores its own messages'''
+
+    channel = 'dlx:authcache:invalidate'
+
+    def __init__(self, client, handler, *, channel=None):
+        self.client = client
+        self.handler = handler
+        self.channel = channel or InvalidationBus.channel
+        self.id = uuid4().hex
+        self.pubsub = None
+        self.thread = None
+
+    def publish(self, **message):
+        self.client.publish(self.channel, json.dumps({'sender': self.id, **message}))
+
+    def listen(self, *, threaded=True):
+        '''Subscribes to the channel. If `threaded` is True, the messages are
+        handled in a background thread, otherwise by calling `poll`'''
+
+        self.pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        self.pubsub.subscribe(**{self.channel: self._receive})
+
+        if threaded:
+            self.thread = self.pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def poll(self):
+        # handles the pending messages
+        while self.pubsub.connection and self.pubsub.connection.can_read(timeout=0):
+            self.pubsub.get_message(timeout=0)
+
+    def stop(self):
+        if self.thread:
+            self.thread.stop()
+
+        if self.pubsub:
+            self.pubsub.close()
+
+    def _receive(self, message):
+        data = json.loads(message['data'])
+
+        if data.pop('sender') != self.id:
+            self.handler(**data)
+
+class CacheNamespaces():
+    '''The caches used by `Auth`, by namespace. Namespaces that have a Redis
+    key prefix in `Config.auth_cache_prefixes` use the shared cache at
+    `DB.cache` when there is one, the others are always in-process. The
+    namespaces in `Config.auth_cache_hashes` are stored as Redis hashes.
+
+    When there is a shared cache, invalidations are published to the other 
+    processes using it, which evict the same entries from their in-process
+    caches'''
+
+    # the collation keys of the heading values the keys of a namespace are 
+    # derived from, for eviction by value. see `collation_key`
+    indexes = {
+        'multi': lambda key: [collation_key(x[1]) for x in key[1]],
+        'ambiguous': lambda key: [collation_key(x[1]) for x in key[2]]
+    }
+
+    def __init__(self, settings=None, prefixes=None, hashes=None):
+        self.settings = settings or Config.auth_cache
+        self.prefixes = prefixes or Config.auth_cache_prefixes
+        self.hashes = hashes or Config.auth_cache_hashes
+        self.memory = {name: MemoryCache(**options, index=self.indexes.get(name)) for name, options in self.settings.items()}
+        self.shared = {}
+        self.client = None
+        self.bus = None
+        self.listeners = [] # called with the invalidations received from other processes
+        os.register_at_fork(after_in_child=self._forked)
+
+    def __call__(self, name) -> Cache:
+        if DB.cache is not self.client:
+            self._connect(DB.cache)
+
+        return self.shared.get(name) or self.memory[name]
+
+    def invalidate(self, *, xrefs=[], values=[]):
+        '''Evicts the entries for the given auth xrefs, and the entries that 
+        were derived from the given heading values'''
+
+        self._evict(self, xrefs, values)
+
+        if self.bus:
+            self.bus.publish(xrefs=list(xrefs), values=list(values))
+
+    def stats(self) -> dict:
+        '''Returns the hit/miss/eviction counters and sizes of the caches
+        currently in use, by namespace'''
+
+        return {name: self(name).stats() for name in self.settings}
+
+    def clear(self):
+        '''Clears the in-process caches'''
+
+        for cache in self.memory.values():
+            cache.clear()
+
+    def _connect(self, client):
+        # the shared cache has changed
+        if self.bus:
+            self.bus.stop()
+
+        self.client, self.shared, self.bus = client, {}, None
+
+        if client:
+            for name, prefix in self.prefixes.items():
+                Cls = RedisHashCache if name in self.hashes else RedisCache
+                self.shared[name] = Cls(client, prefix=prefix, ttl=self.settings[name].get('ttl'), index=self.indexes.get(name))
+
+            # invalidations from other processes only apply to the in-process caches
+            self.bus = InvalidationBus(client, self._receive)
+            self.bus.listen(threaded=not (DB.database_name == 'testing' or Config.threading == False))
+
+    def _forked(self):
+        # the bus listener thread doesn't survive a fork, so the shared caches
+        # are connected again on next use
+        self.client, self.shared, self.bus = None, {}, None
+
+    def _receive(self, xrefs, values):
+        self._evict(self.memory.get, xrefs, values)
+
+        for listener in self.listeners:
+            listener(xrefs=xrefs, values=values)
+
+    @staticmethod
+    def _evict(cache, xrefs, values):
+        cache('value').delete(*xrefs)
+        cache('lang').delete(*xrefs)
+        keys = set([collation_key(x) for x in values])
+        cache('xref').delete(*keys)
+        cache('multi').evict_indexed(keys)
+        cache('ambiguous').evict_indexed(keys)
+        values = set(values)
+
+        def partial_match(key):
+            # the cached string is a regex
+            try:
+                return any(re.search(key[2], value, re.IGNORECASE) for value in values)
+            except re.error:
+                return True
+
+        cache('partial').evict(partial_match)
+
+###
+
+def _merge(current, new):
+    if isinstance(current, dict) and isinstance(new, dict):
+        merged = dict(current)
+
+        for key, value in new.items():
+            merged[key] = _merge(current.get(key), value)
+
+        return merged
+
+    return new
+
+def collation_key(value) -> str:
+    # Approximates comparison under the default collation (strength 1 with
+    # numeric ordering), which ignores case, diacritics and the leading zeros
+    # of numbers. The entries derived from heading values are keyed by it, as
+    # the values are matched under that collation
+    value = unicodedata.normalize('NFKD', str(value))
+    value = ''.join([x for x in value if not unicodedata.combining(x)]).casefold()
+
+    return re.sub(r'\d+', lambda match: match.group().lstrip('0') or '0', value)
+
+def _key(string):
+    # tuple and int keys are stored as their repr
+    try:
+        return ast.literal_eval(string)
+    except (ValueError, TypeError, SyntaxError):
+        return string
+
+def _str(value):
+    return value.decode('utf-8') if isinstance(value, bytes) else value
+
+def _sizeof(value):
+    # approximate
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(_sizeof(k) + _sizeof(v) for k, v in value.items())
+    elif isinstance(value, (list, tuple, set)):
+        return sys.getsizeof(value) + sum(_sizeof(x) for x in value)
+
+    return sys.getsizeof(value)
@@ -0,0 +1,128 @@
+import re, heapq, threading
+from bisect import bisect_left, insort
+from dlx.util import Tokenizer
+
+class TypeaheadIndex():
+    '''In-memory index of auth headings for `Auth.partial_lookup`, by heading
+    tag and subfield code. Values are normalized with `Tokenizer.scrub`.
+    Prefix matches are found in a sorted array, and other substring matches
+    with an n-gram index'''
+
+    # strings with these characters are treated as regexes and not looked up in the index
+    regex_chars = re.compile(r'[.^$*+?{}\[\]\\|()]')
+
+    def __init__(self, *, n=3):
+        self.n = n
+        self.built = False
+        self.docs = {}      # xref -> heading-only auth doc
+        self.entries = {}   # (tag, code) -> {xref: [scrubbed values]}
+        self.prefixes = {}  # (tag, code) -> sorted [(scrubbed value, xref)]
+        self.grams = {}     # (tag, code) -> {n-gram: set(xrefs)}
+        self._lock = threading.Lock()
+
+    def build(self, auths):
+        '''Indexes the headings of the given auths, replacing the current
+        index'''
+
+        with self._lock:
+            self.docs, self.entries, self.prefixes, self.grams = {}, {}, {}, {}
+
+            for auth in auths:
+                self._add(auth)
+
+            for key in self.prefixes:
+                self.prefixes[key].sort()
+
+            self.built = True
+
+    def update(self, auth):
+        '''Reindexes the heading of an auth'''
+
+        with self._lock:
+            self._remove(auth.id)
+            self._add(auth, sort=True)
+
+    def remove(self, xref):
+        with self._lock:
+            self._remove(xref)
+
+    def search(self, tag, code, string, *, limit=25) -> list:
+        '''Returns the xrefs of the auths with headings that contain the
+        string in the given heading tag and subfield code, prefix matches
+        first. Returns None if the string looks like a regex'''
+
+        if TypeaheadIndex.regex_chars.search(string):
+            return
+
+        query, key, found = Tokenizer.scrub(string), (tag, code), {}
+
+        if not query:
+            return []
+
+        with self._lock:
+            prefixes = self.prefixes.get(key, [])
+            entries = self.entries.get(key, {})
+            i = bisect_left(prefixes, (query,))
+
+            # prefix matches
+            while i < len(prefixes) and len(found) < limit and prefixes[i][0].startswith(query):
+                found.setdefault(prefixes[i][1], None)
+                i += 1
+
+            if len(found) < limit:
+                # substring matches
+                if len(query) >= self.n:
+                    grams = sorted([self.grams[key].get(x, set()) for x in self._grams(query)], key=len)
+                    candidates = set.intersection(*grams) if grams else set()
+                    matches = heapq.nsmallest(limit * 2, ((value, xref) for xref in candidates for value in entries[xref] if query in value))
+                else:
+                    matches = (x for x in prefixes if query in x[0])
+
+                for value, xref in matches:
+                    found.setdefault(xref, None)
+
+                    if len(found) == limit:
+                        break
+
+        return list(found.keys())
+
+    def _add(self, auth, *, sort=False):
+        # caller holds the lock
+        if (hf := auth.heading_field) is None:
+            return
+
+        self.docs[auth.id] = {'_id': auth.id, hf.tag: [hf.to_dict()]}
+
+        for subfield in hf.subfields:
+            if not (value := Tokenizer.scrub(subfield.value or '')):
+                continue
+
+            key = (hf.tag, subfield.code)
+            self.entries.setdefault(key, {}).setdefault(auth.id, []).append(value)
+
+            if sort:
+                insort(self.prefixes.setdefault(key, []), (value, auth.id))
+            else:
+                self.prefixes.setdefault(key, []).append((value, auth.id))
+
+            for gram in self._grams(value):
+                self.grams.setdefault(key, {}).setdefault(gram, set()).add(auth.id)
+
+    def _remove(self, xref):
+        # caller holds the lock
+        if self.docs.pop(xref, None) is None:
+            return
+
+        for key, entries in self.entries.items():
+            for value in entries.pop(xref, []):
+                prefixes = self.prefixes[key]
+                i = bisect_left(prefixes, (value, xref))
+
+                if i < len(prefixes) and prefixes[i] == (value, xref):
+                    del prefixes[i]
+
+                for gram in self._grams(value):
+                    self.grams[key].get(gram, set()).discard(xref)
+
+    def _grams(self, value):
+        return set([value[i:i+self.n] for i in range(0, len(value) - self.n + 1)])
@@ -0,0 +1,31 @@
+# This script (re)builds the materialized auth usage counts used by `Auth.in_use`.
+# The counts are kept up to date on commit and delete once built. This can be 
+# run at any time, and should be run after copying data between databases.
+
+from argparse import ArgumentParser
+from dlx import DB
+from dlx.marc import Auth
+
+parser = ArgumentParser()
+parser.add_argument('--connect', required=True, help='MongoDB connection string')
+parser.add_argument('--database', help='The database to use, if it differs from the one in the connection string')
+
+def run():
+    args = parser.parse_args()
+
+    if DB.database_name == 'testing':
+        # DB is already connected to by the test suite
+        pass
+    else:
+        DB.connect(args.connect, database=args.database)
+
+    print('building auth usage counts...')
+    total = Auth.build_use_counts()
+    print(f'built usage counts for {total} auths')
+
+    return True
+
+###
+
+if __name__ == '__main__':
+    run()
@@ -5,7 +5,7 @@
 import sys
 from collections import Counter
 from bson import Regex
-from pymongo import UpdateOne, ASCENDING as ASC, DESCENDING as DESC
+from pymongo import UpdateOne, ReturnDocument, ASCENDING as ASC, DESCENDING as DESC
 from argparse import ArgumentParser
 from dlx import DB, Config
 from dlx.marc import BibSet, Bib, AuthSet, Auth, Query
@@ -17,6 +17,7 @@ parser.add_argument('--database', help='The database to use, if it differs from
 parser.add_argument('--type', required=True, choices=['bib', 'auth'])
 parser.add_argument('--start', default=0)
 parser.add_argument('--fields', help='Only build these fields', nargs='+')
+parser.add_argument('--text-indexes', action='store_true', help='Also rebuild the field text indexes, which miss the buffered writes of processes that were killed')
   
 def run():
     args = parser.parse_args()
@@ -28,10 +29,15 @@ def run():
         DB.connect(args.connect, database=args.database)
     
     build_logical_fields(args)
+    build_browse_counts(args)
+
+    if args.text_indexes:
+        build_text_indexes(args)
+
     #build_auth_controlled_logical_fields(args) # disabled
     
     if args.type == 'auth':
-        #calculate_auth_use() # disabled
+        # auth usage counts are built by the build-auth-use script
         pass
 
     return True
@@ -76,7 +82,7 @@ def build_logical_fields(args):
     for i in range(start, end, inc):
         updates, browse_updates = [], {}
         
-        for record in cls.from_query(query, sort=[('_id', DESC)], skip=i, limit=inc, projection=dict.fromkeys(tags, 1), collation=None):
+        for record in cls.from_query(query, sort=[('_id', DESC)], skip=i, limit=inc, projection=dict.fromkeys(tags, 1), collation=None, lazy=True):
             for field, values in record.logical_fields(*list(names)).items():
                 updates.append(UpdateOne({'_id': record.id}, {'$set': {field: values}}))
                 browse_updates.setdefault(field, [])
@@ -119,6 +125,122 @@ def build_logical_fields(args):
 
     print(f'\nupdated {c} logical fields')
 
+def build_browse_counts(args):
+    # the browse index entries keep a count of the records of each type that have the value.
+    # the counts are computed first and set as absolute values on the entries that were not
+    # counted by a commit since the build started. those are then recounted from the records
+    cls = BibSet if args.type == 'bib' else AuthSet
+    logical_fields = Config.bib_logical_fields if cls == BibSet else Config.auth_logical_fields
+    other_fields = Config.auth_logical_fields if cls == BibSet else Config.bib_logical_fields
+    other = 'auth' if args.type == 'bib' else 'bib'
+
+    for field in logical_fields:
+        if field == '_record_type' or (args.fields and field not in args.fields):
+            continue
+
+        print(f'counting {field}')
+        col = DB.handle[f'_index_{field}']
+        started = server_time()
+        # the counts of fields that only exist in this record type are complete for both types
+        trusted = [args.type] if field in other_fields else ['bib', 'auth']
+        counts = cls().handle.aggregate(
+            [
+                {'$match': {field: {'$exists': True}}},
+                {'$project': {field: 1}},
+                {'$unwind': f'${field}'},
+                # count each record once per value
+                {'$group': {'_id': {'value': f'${field}', 'record': '$_id'}}},
+                {'$group': {'_id': '$_id.value', 'count': {'$sum': 1}}}
+            ],
+            allowDiskUse=True
+        )
+        counts = {doc['_id']: doc['count'] for doc in counts}
+        updates = []
+
+        for doc in col.find(not_counted_since(started), projection={'_id': 1}):
+            updates.append(set_count(doc['_id'], counts.get(doc['_id'], 0), args.type, None if field in other_fields else other, trusted, started))
+
+            if len(updates) == 1000:
+                bulk_write(col, updates, ordered=False)
+                updates = []
+
+        if updates:
+            bulk_write(col, updates, ordered=False)
+
+        # entries counted by a commit since the build started, or while they were being set
+        since = started
+
+        for i in range(10):
+            recounted = server_time()
+            changed = list(col.find({'counted': {'$gte': since}}, projection={'_id': 1}))
+
+            if not changed:
+                break
+
+            for doc in changed:
+                count = cls().handle.count_documents({field: doc['_id']})
+                bulk_write(col, [set_count(doc['_id'], count, args.type, None if field in other_fields else other, trusted, recounted)])
+
+            since = recounted
+        else:
+            print(f'{field} entries are still being changed; they will be counted by the next build')
+
+        # entries no longer used by any record
+        result = col.delete_many(
+            {
+                'count.bib': {'$lte': 0},
+                'count.auth': {'$lte': 0},
+                'trusted': {'$all': ['bib', 'auth']},
+                **not_counted_since(started)
+            }
+        )
+        print(f'deleted {result.deleted_count} unused {field} entries')
+
+def set_count(value, count, record_type, other, trusted, since):
+    # sets the count unless a commit has counted the entry since the count was taken
+    update = {f'count.{record_type}': count}
+
+    if other:
+        update[f'count.{other}'] = 0
+
+    return UpdateOne({'_id': value, **not_counted_since(since)}, {'$set': update, '$addToSet': {'trusted': {'$each': trusted}}})
+
+def not_counted_since(time):
+    return {'$or': [{'counted': {'$lt': time}}, {'counted': {'$exists': False}}]}
+
+def server_time():
+    # the database server's current time, which the commits record on the entries they count
+    doc = DB.handle['_build_clock'].find_one_and_update({'_id': 'browse_counts'}, {'$currentDate': {'time': True}}, upsert=True, return_document=ReturnDocument.AFTER)
+
+    return doc['time']
+
+def build_text_indexes(args):
+    # the field text indexes are written through DB.buffer on commit
+    cls = BibSet if args.type == 'bib' else AuthSet
+    end = cls().handle.estimated_document_count()
+    inc, tags = 1000, set()
+
+    for i in range(int(args.start), end, inc):
+        updates = {}
+
+        for record in cls.from_query({}, sort=[('_id', DESC)], skip=i, limit=inc, collation=None, lazy=True):
+            for name, ops in record._text_index_updates().items():
+                updates.setdefault(name, [])
+                updates[name] += [UpdateOne(query, update, upsert=upsert) for query, update, upsert in ops]
+
+        for name, ops in updates.items():
+            if ops:
+                # ordered, as the text is set on the entries after they are upserted
+                bulk_write(DB.handle[name], ops)
+
+            if name not in tags:
+                DB.handle[name].create_index([('subfields.value', 'text')], default_language='none')
+                tags.add(name)
+
+        print('\b' * (len(str(i)) + len(str(end)) + 3) + f'{min(i + inc, end)} / {end}', end='', flush=True)
+
+    print(f'\nrebuilt {len(tags)} field text indexes')
+
 def build_auth_controlled_logical_fields(args):
     if args.type == 'auth':
         # there are no auth ctrld auth logical fields
@@ -215,42 +337,6 @@ def build_auth_controlled_logical_fields(args):
         if end:
             print('\n')
     
-def calculate_auth_use():
-    print('calculating auth usage')
-    
-    count = {}
-    
-    for tag in Config.bib_authority_controlled.keys():
-        results = DB.bibs.aggregate(
-            [
-                {'$unwind': f'${tag}'},
-                {'$unwind': f'${tag}.subfields'},
-                {'$group': {'_id' : f'${tag}.subfields.xref', 'count': {'$sum': 1}}},
-            ]
-        )
-        
-        i = 0
-        
-        for r in results:
-            xref = r['_id']
-            count.setdefault(xref, 0)
-            count[xref] += r['count']
-            i += 1
-        
-        print(f'counted {i} xrefs for tag {tag}')
-        
-    print('updating the database...')
-    
-    updates, inc = [], 50000
-        
-    for auth_id, count in count.items():
-        updates.append(UpdateOne({'_id': auth_id}, {'$set': {'bib_use_count': count}}))
-    
-    for start in range(0, len(updates), inc):
-        #DB.auths.bulk_write(updates[start:start+inc])
-        bulk_write(DB.auths, updates[start:start+inc])
-        print('\b' *  (len(str(start-inc)) + len(str(len(updates))) + 3) + str(start) + f' / {len(updates)}', end='', flush=True)
-
 ###
 
 if __name__ == '__main__':
@@ -1,16 +1,29 @@
 # Run this as a precaution after copying data between databases.
 # This can be run at any time if the inceremnter gets corrupted.
 
+# Running processes reserve blocks of IDs from the incrementers (see
+# Config.id_block_size), so by default the incrementers are only moved forward
+# to the max ID in the database, never back. Use --reset to rebuild them from
+# the max ID only when no other processes are creating records.
+
 from argparse import ArgumentParser
 from dlx import DB
+from dlx.marc import Bib, Auth
 
 parser = ArgumentParser()
 parser.add_argument('--connect', required=True, help='MongoDB connection string')
 parser.add_argument('--database', help='The database to use, if it differs from the one in the connection string')
+parser.add_argument('--reset', action='store_true', help='Drop the incrementers, including the IDs reserved by running processes')
 
 def run():
     args = parser.parse_args()
     DB.connect(args.connect, database=args.database)
-    
-    DB.handle['bib_id_counter'].drop()
-    DB.handle['auth_id_counter'].drop()
\ No newline at end of file
+
+    for cls in (Bib, Auth):
+        col = DB.handle[cls.record_type + '_id_counter']
+
+        if args.reset:
+            col.drop()
+        else:
+            current = (col.find_one({'_id': 1}) or {}).get('count') or 0
+            col.replace_one({'_id': 1}, {'_id': 1, 'count': max(current, cls.max_id())}, upsert=True)
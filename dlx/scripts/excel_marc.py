@@ -43,10 +43,10 @@ def run():
             
             record.set_008()
     
-    convert_method = 'to_' + args.format
+    write_method = 'write_' + args.format
     fh = open(args.out, 'w', encoding='utf-8') if args.out else sys.stdout
     
-    fh.write(getattr(data, convert_method)())
+    getattr(data, write_method)(fh)
 
 ###
 
@@ -110,6 +110,9 @@ def run():
         #    col.create_index([(x, 'text') for x in logical_fields.keys()], default_language='none', weights=text_weights)
         #)
 
+        print('creating history bucket indexes...')
+        DB.handle[_[:-1] + '_history_buckets'].create_index([('record_id', 1), ('bucket', 1)])
+
         print('creating logical field text collection indexes...')
         for field in logical_fields.keys():
             index_col = DB.handle[f'_index_{field}']
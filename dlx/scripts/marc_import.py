@@ -23,22 +23,40 @@ def get_args(**kwargs):
 
     return parser.parse_args()
 
+def read_records(args):
+    # the file is read as a stream so that records can be imported before the whole file is read
+    cls = BibSet if args.type == 'bib' else AuthSet
+    method = getattr(cls, f'from_{args.format}_stream')
+
+    with open(args.file, 'r', encoding='utf8') as fh:
+        yield from method(fh, auth_control=False if args.skip_auth_check else True)
+
 def run(**kwargs):
     args = get_args(**kwargs)
     DB.connect(args.connect, database=args.database)
+
+    if not args.skip_prompt:
+        # preview the records before importing
+        for record in read_records(args):
+            print(record.to_mrk())
+
+        if input('Import to database? y/n: ').lower().strip() != 'y':
+            return
+
+    def records():
+        for record in read_records(args):
+            if args.skip_prompt:
+                print(record.to_mrk())
+
+            yield record
+
+    # the records are committed in batches
     cls = BibSet if args.type == 'bib' else AuthSet
-    string = open(args.file, 'r', encoding='utf8').read()
-    method = getattr(cls, 'from_' + args.format)  
-    marcset = method(string, auth_control=False if args.skip_auth_check else True)
-    
-    for record in marcset.records:
-        print(record.to_mrk())
-
-    proceed = input('Import to database? y/n: ') if not args.skip_prompt else 'y'
-
-    if proceed.lower().strip() == 'y':
-        for record in marcset.records:
-            record.commit(auth_check=False if args.skip_auth_check else True)
+
+    for record, error in cls.commit_all(records(), auth_check=False if args.skip_auth_check else True):
+        if error:
+            print(f'failed to import record: {error}')
+        else:
             print(f'imported record with new ID {record.id}')
 
 if __name__ == '__main__':
@@ -0,0 +1,39 @@
+# This script moves the record histories saved before the history buckets
+# existed into the `bib_history_buckets` and `auth_history_buckets` collections.
+# Histories that have not been moved are still readable. This can be run at any
+# time, but the histories of records being edited while it runs may be out of
+# order.
+
+from argparse import ArgumentParser
+from dlx import DB
+from dlx.marc import BibHistory, AuthHistory
+
+parser = ArgumentParser()
+parser.add_argument('--connect', required=True, help='MongoDB connection string')
+parser.add_argument('--database', help='The database to use, if it differs from the one in the connection string')
+parser.add_argument('--type', choices=['bib', 'auth'], help='Only migrate this record type')
+
+def run():
+    args = parser.parse_args()
+
+    if DB.database_name == 'testing':
+        # DB is already connected to by the test suite
+        pass
+    else:
+        DB.connect(args.connect, database=args.database)
+
+    for cls in (BibHistory, AuthHistory):
+        if args.type and args.type != cls.record_type:
+            continue
+
+        DB.handle[cls.record_type + '_history_buckets'].create_index([('record_id', 1), ('bucket', 1)])
+        print(f'migrating {cls.record_type} history...')
+        total = cls.migrate()
+        print(f'migrated {total} {cls.record_type} histories')
+
+    return True
+
+###
+
+if __name__ == '__main__':
+    run()
@@ -3,7 +3,7 @@ from datetime import datetime
 from xlrd import open_workbook
 from xlrd.xldate import xldate_as_tuple
 from pymongo.collection import Collection
-from pymongo.operations import _UpdateOp, UpdateOne, DeleteOne, InsertOne
+from pymongo.operations import _UpdateOp, UpdateOne, DeleteOne, InsertOne, ReplaceOne
 from mongomock import MongoClient as MockClient
 from dlx import DB
 
@@ -22,6 +22,7 @@ def bulk_write(collection: Collection, updates: list[_UpdateOp], ordered: bool =
         for update in updates:
             method = \
                 'update_one' if isinstance(update, UpdateOne) \
+                else 'replace_one' if isinstance(update, ReplaceOne) \
                 else 'delete_one' if isinstance(update, DeleteOne) \
                 else 'insert_one' if isinstance(update, InsertOne) \
                 else None
@@ -29,7 +30,7 @@ def bulk_write(collection: Collection, updates: list[_UpdateOp], ordered: bool =
             kwargs = {'filter': update._filter}
 
             if method != 'delete_one':
-                kwargs.update({'update': update._doc})
+                kwargs.update({'replacement' if method == 'replace_one' else 'update': update._doc})
                 
                 if method != 'insert_one':
                     kwargs['upsert'] = update._upsert
@@ -101,15 +102,20 @@ class Table():
                 field_name = self.header[j]
                 self.index[i][field_name] = cell
                 
-    def set(self, rowx, field_name, value):
-        self.index.setdefault(rowx, {})
-        self.index[rowx].setdefault(field_name, {})
+    @staticmethod
+    def set_cell(row: dict, field_name, value) -> dict:
+        # sets the value of a cell in a row dict
 
-        if existing := self.index[rowx].get(field_name):
+        if row.get(field_name):
             # if this is a repeated field, append the next value into this cell
-            self.index[rowx][field_name] += f'||{value}'
+            row[field_name] += f'||{value}'
         else:
-            self.index[rowx][field_name] = value
+            row[field_name] = value
+
+        return row
+
+    def set(self, rowx, field_name, value):
+        Table.set_cell(self.index.setdefault(rowx, {}), field_name, value)
 
         if field_name not in self.header:
             self.header.append(field_name)
@@ -161,20 +167,24 @@ class Table():
             row = []
         
             for field in self.header:
-                if value := record.get(field):
-                    if separator in value or '"' in value: # value[0] == '"' or value[-1] == '"':
-                        # handle the separator or if the value starts or ends with double quote per CSV specification
-                        # https://www.ietf.org/rfc/rfc4180.txt
-                        value = value.replace('"', '""')
-                        value = f'"{value}"'
-                    
-                    row.append(value)
-                else:
-                    row.append('')
+                row.append(Table.serialize_value(record.get(field), separator=separator))
             
             rows.append(row)
 
         return '\n'.join([separator.join(row) for row in rows])
+
+    @staticmethod
+    def serialize_value(value, *, separator):
+        if not value:
+            return ''
+
+        if separator in value or '"' in value: # value[0] == '"' or value[-1] == '"':
+            # handle the separator or if the value starts or ends with double quote per CSV specification
+            # https://www.ietf.org/rfc/rfc4180.txt
+            value = value.replace('"', '""')
+            value = f'"{value}"'
+
+        return value
     
     def to_csv(self):
         return self.serialize(separator=',')
@@ -32,7 +32,9 @@ setup(
             'build-logical-fields=dlx.scripts.build_logical_fields:run',
             'build-text-collections=dlx.scripts.build_text_collections:run',
             'auth-merge=dlx.scripts.auth_merge:run',
-            'marc-import=dlx.scripts.marc_import:run'
+            'marc-import=dlx.scripts.marc_import:run',
+            'build-auth-use=dlx.scripts.build_auth_use:run',
+            'migrate-history=dlx.scripts.migrate_history:run'
         ]
     }
 )
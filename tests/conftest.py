@@ -97,18 +97,22 @@ def db(bibs, auths) -> MockClient:
     DB.connect('mongomock://localhost')
 
     # reset the caches
-    Auth._cache = {}
-    Auth._xcache = {}
+    Auth.caches.clear()
+    Auth.typeahead.built = False
     DB.cache = None
     
     DB.bibs.drop()
     DB.handle['bib_history'].drop()
+    DB.handle['bib_history_buckets'].drop()
     DB.handle['bib_id_counter'].drop()
     DB.bibs.insert_many(bibs)
     
     DB.auths.drop()
     DB.handle['auth_history'].drop()
+    DB.handle['auth_history_buckets'].drop()
     DB.handle['auth_id_counter'].drop()
+    DB.handle['auth_use'].drop()
+    DB.handle['auth_use_build'].drop()
     DB.auths.insert_many(auths)
     
     DB.files.drop()
@@ -26,3 +26,110 @@ class Test(TestCase):
         self.assertIsInstance(DB.auths, mongomock.Collection)
         self.assertIsInstance(DB.files, mongomock.Collection)
         self.assertIsInstance(DB.config, dict)
+
+    def test_executor(self):
+        import threading, time
+        from dlx.db import Executor, TaskErrors
+        from dlx.marc import Bib
+
+        # tasks run in the background unless the database is "testing"
+        DB.connect('mongomock://localhost', database='threaded')
+        executor = Executor(workers=2, queue_size=2)
+        started, release = [], threading.Event()
+
+        def task(i):
+            started.append(threading.current_thread())
+            release.wait(5)
+            return i
+
+        futures = [executor.submit(task, i) for i in range(4)]
+        assert len(executor.threads) == 2
+        assert not any(x.done() for x in futures)
+
+        # the queue is full
+        blocked = threading.Thread(target=lambda: futures.append(executor.submit(task, 4)))
+        blocked.start()
+        time.sleep(.1)
+        assert len(futures) == 4
+
+        release.set()
+        blocked.join()
+        executor.flush()
+        assert [x.result() for x in futures] == [0, 1, 2, 3, 4]
+        assert set(started) == set(executor.threads)
+
+        # errors are raised together by flush
+        def fail(): raise ValueError('failed')
+        def nested(): return executor.submit(lambda: threading.current_thread()).result()
+
+        futures = [executor.submit(fail), executor.submit(fail), executor.submit(nested)]
+
+        with self.assertRaises(TaskErrors) as cm:
+            executor.flush(timeout=5)
+
+        assert len(cm.exception.errors) == 2
+        assert futures[2].result() in executor.threads # ran in the worker
+        executor.flush()
+
+        # the kept errors are capped
+        from dlx.config import Config
+        max_errors, Config.executor_max_errors = Config.executor_max_errors, 1
+        [executor.submit(fail) for i in range(3)]
+
+        with self.assertRaises(TaskErrors) as cm:
+            executor.flush(timeout=5)
+
+        assert (len(cm.exception.errors), cm.exception.dropped) == (1, 2)
+        assert str(cm.exception).startswith('3 background task(s) failed')
+        Config.executor_max_errors = max_errors
+
+        # commit side effects
+        bib = Bib().set('245', 'a', 'Threaded').commit()
+        DB.flush(timeout=5)
+        assert all(x.done() for x in bib.futures)
+        assert DB.handle['bib_history'].find_one({'_id': bib.id})
+        assert DB.handle['_index_245'].find_one({'_id': 'Threaded'})
+
+    def test_write_buffer(self):
+        from unittest.mock import patch
+        from dlx.db import WriteBuffer
+
+        # writes are buffered unless the database is "testing"
+        DB.connect('mongomock://localhost', database='buffered')
+        buffer, col = WriteBuffer(size=3, seconds=60), DB.handle['_index_test']
+
+        for i in range(5):
+            buffer.add(col, [({'_id': 'x'}, {'$addToSet': {'subfields': {'code': 'a', 'value': i % 2}}}, True), ({'_id': 'x'}, {'$set': {'text': f' {i} '}}, False)])
+
+        buffer.add(col, [({'_id': 'y'}, {'$set': {'text': ' y '}}, True)])
+        assert buffer.count == 2
+        assert col.count_documents({}) == 0
+        assert buffer.pending[col.full_name][1]['x']['update']['$addToSet']['subfields']['$each'] == [{'code': 'a', 'value': 0}, {'code': 'a', 'value': 1}]
+
+        # flushed by size
+        buffer.add(col, [({'_id': 'z'}, {'$set': {'text': ' z '}}, True)])
+        assert buffer.count == 0
+        assert col.find_one({'_id': 'x'}) == {'_id': 'x', 'subfields': [{'code': 'a', 'value': 0}, {'code': 'a', 'value': 1}], 'text': ' 4 '}
+        assert col.count_documents({}) == 3
+
+        with self.assertRaises(ValueError):
+            buffer.add(col, [({'text': ' x '}, {'$set': {'text': ' y '}}, False)])
+
+        # empty bulk writes are skipped
+        buffer.add(col, [])
+
+        with patch('dlx.util.bulk_write') as bulk_write:
+            buffer.flush()
+            assert bulk_write.call_count == 0
+
+        # indexes are only created once
+        with patch.object(type(col), 'create_index') as create_index:
+            [buffer.create_index(col, [('subfields.value', 'text')], default_language='none') for i in range(3)]
+            assert create_index.call_count == 1
+
+        # commits are merged until flushed
+        from dlx.marc import Bib
+        DB.flush()
+        [Bib().set('245', 'a', 'Buffered').commit() for i in range(3)]
+        DB.flush()
+        assert DB.handle['_index_245'].find_one({'_id': 'Buffered'})['subfields'] == [{'code': 'a', 'value': 'Buffered'}]
@@ -140,8 +140,17 @@ def test_commit(db, bibs, auths):
     DB.bibs.drop()
     DB.handle['bib_history'].drop()
     DB.handle['bib_id_counter'].drop()
+    Bib._id_blocks.clear() # the ids reserved by this process
     Bib().commit()
     assert Bib.max_id() == 1
+
+    # ids are reserved in blocks
+    from dlx.config import Config
+    assert DB.handle['bib_id_counter'].find_one({'_id': 1})['count'] == Config.id_block_size
+    assert [Bib().commit().id for i in range(3)] == [2, 3, 4]
+    Bib._id_blocks['bib'][1] = Config.id_block_size + 1 # block used up
+    assert Bib().commit().id == Config.id_block_size + 1
+    assert DB.handle['bib_id_counter'].find_one({'_id': 1})['count'] == Config.id_block_size * 2
     
     # json schema validation
     with pytest.raises(ValidationError):
@@ -193,6 +202,57 @@ def test_commit(db, bibs, auths):
     assert len([x for x in bib.get_fields('600')[0].subfields]) == 2
     assert len([x for x in bib.get_fields('600')[1].subfields]) == 2
 
+    # in batches, with a report
+    auth = Auth().set('100', 'a', 'batched').commit()
+    [Bib().set('600', 'a', auth.id).commit() for i in range(5)]
+    Auth().set('100', 'a', 'batched related').set('500', 'a', auth.id).commit()
+    previous_state = DB.auths.find_one({'_id': auth.id})
+    auth.set('100', 'a', 'batched update').set('100', 'g', 'added').commit(update_attached=False)
+    progress = []
+    report = auth.update_attached(previous_state, user='batch', batch_size=2, progress=lambda done, total: progress.append((done, total)))
+    assert report == {'updated': {'bib': 5, 'auth': 1}, 'failed': []}
+    assert progress == [(2, 6), (4, 6), (6, 6)]
+    assert all([x.get_value('600', 'g') == 'added' and x.user == 'batch' for x in auth.list_attached(usage_type='bib')])
+    assert auth.list_attached(usage_type='auth')[0].get_value('500', 'a') == 'batched update'
+
+def test_commit_all(db, bibs, auths):
+    from dlx import DB
+    from dlx.marc import BibSet, AuthSet, Bib, Auth, InvalidAuthXref
+    from jsonschema.exceptions import ValidationError
+
+    new = [Bib().set('245', 'a', f'Batch {i}').set('650', 'a', 1) for i in range(5)]
+    updated = Bib.from_id(2).set('245', 'a', 'Updated in batch')
+    invalid = [Bib({'650': [{'indicators': [' ', ' '], 'subfields': [{'code': 'a', 'xref': 999}]}]}), Bib({'245': [{'indicators': [' ', ' '], 'subfields': [{'code': ' ', 'value': 'x'}]}]})]
+    results = BibSet.commit_all(new + [updated] + invalid, user='batch', batch_size=2)
+
+    assert [x[0] for x in results] == new + [updated] + invalid
+    assert [x[1] for x in results[:6]] == [None] * 6
+    assert isinstance(results[6][1], InvalidAuthXref)
+    assert isinstance(results[7][1], ValidationError)
+
+    assert [x.id for x in new] == [3, 4, 5, 6, 7]
+    assert Bib.from_id(3).get_value('245', 'a') == 'Batch 0'
+    assert Bib.from_id(3).user == 'batch'
+    assert Bib.from_id(2).get_value('245', 'a') == 'Updated in batch'
+    assert DB.bibs.count_documents({}) == 7
+
+    # same side effects as commit
+    assert DB.handle['bib_history'].find_one({'_id': 3})['created']['user'] == 'batch'
+    assert len(Bib.from_id(2).history()) == 2
+    assert DB.handle['_index_245'].find_one({'_id': 'Batch 4'})['subfields'] == [{'code': 'a', 'value': 'Batch 4'}]
+    assert DB.handle['_index_subject'].find_one({'_id': 'Header'})
+    assert DB.bibs.find_one({'_id': 3})['text'] == ' batch 0 header '
+
+    # auths
+    Auth.build_use_counts()
+    auth = Auth.from_id(1).set('150', 'a', 'Header changed in batch')
+    results = AuthSet.commit_all([auth, Auth().set('150', 'a', 'New in batch')])
+    assert [x[1] for x in results] == [None, None]
+    assert Bib.from_id(3).get_value('650', 'a') == 'Header changed in batch'
+    assert Auth.lookup(1, 'a') == 'Header changed in batch'
+    assert Auth.from_id(1).in_use(usage_type='bib') == 7
+    assert results[1][0].in_use() == 0
+
 def test_delete(db):
     from copy import deepcopy
     from dlx import DB
@@ -212,10 +272,11 @@ def test_delete(db):
     bib = Bib().set('245', 'a', 'This record will also self-destruct')
     bib.commit()
     bib.set('245', 'a', 'Updated') # in memory changes, not saved
-    DB.handle['bib_history'].update_one({'_id': bib.id}, {'$unset': {'history': None}})
+    DB.handle['bib_history'].delete_one({'_id': bib.id})
+    DB.handle['bib_history_buckets'].delete_many({'record_id': bib.id})
     bib.delete()
-    history = DB.handle['bib_history'].find_one({'_id': bib.id})
-    assert history['history'][0]['245'][0]['subfields'][0]['value'] == 'This record will also self-destruct'
+    assert len(bib.history()) == 1
+    assert bib.history()[0].get_value('245', 'a') == 'This record will also self-destruct'
 
 def test_restore(db):
     from dlx.marc import Bib
@@ -748,17 +809,14 @@ def test_delete_field(bibs):
 def test_auth_lookup(db):
     from dlx.marc import Bib, Auth
     
-    Auth._cache = {}
-    Auth._xcache = {}
-    
-    with pytest.raises(KeyError):
-        Auth._cache[1]
+    Auth.caches.clear()
+    assert Auth.caches('value').get(1) is None
     
     bib = Bib.from_query({'_id': 1})
     assert bib.get_xref('650', 'a') == 1
     assert bib.get_value('650', 'a') == 'Header'
     
-    assert Auth._cache[1]['a'] == 'Header'
+    assert Auth.caches('value').get(1)['a'] == 'Header'
    
     auth = Auth.from_query({'_id': 1})
     auth.set('150', 'a', 'Changed').commit()
@@ -766,7 +824,7 @@ def test_auth_lookup(db):
     
     Auth().set('150', 'a', 'New').commit()
     bib.set('650', 'a', 'New')
-    assert Auth._xcache['New']['150']['a'] == [3]
+    assert Auth.caches('xref').get('new')['150']['a'] == [3]
     
     bib.set('650', 'a', 'New')
 
@@ -781,6 +839,68 @@ def test_xlookup(db):
     auth.commit()
     assert Auth.xlookup_multi('191', [Literal('b', 'Body'), Literal('c', 'Session')], record_type='bib') == [auth.id]
 
+def test_xlookup_collation(db, monkeypatch):
+    from dlx import DB
+    from dlx.marc import Auth, AuthSet
+    from dlx.marc.cache import collation_key
+
+    france = Auth().set('151', 'a', 'France').commit()
+    ivory_coast = Auth().set('151', 'a', 'Côte d\'Ivoire').commit()
+    heart = Auth().set('151', 'a', 'Cœur 007').commit()
+
+    # the database matches the values under the default collation, which mongomock ignores.
+    # unlike the collation key, the collation expands ligatures
+    def collated(value):
+        return collation_key(value.replace('œ', 'oe'))
+
+    original = AuthSet.from_query
+
+    def from_query(query, **kwargs):
+        condition = query['151.subfields']['$elemMatch']
+        values = [collated(x) for x in (condition['value']['$in'] if isinstance(condition['value'], dict) else [condition['value']])]
+        ids = [doc['_id'] for doc in DB.auths.find({}) for field in doc.get('151', []) for x in field['subfields'] if x['code'] == condition['code'] and collated(x['value']) in values]
+
+        return original({'_id': {'$in': ids}}, **kwargs)
+
+    monkeypatch.setattr(AuthSet, 'from_query', from_query)
+    Auth.caches.clear()
+
+    found = Auth.xlookup_many('651', 'a', ['france', 'Cote d\'Ivoire', 'FRANCE', 'Germany'], record_type='bib')
+    assert found == {'france': [france.id], 'Cote d\'Ivoire': [ivory_coast.id], 'FRANCE': [france.id], 'Germany': []}
+
+    # values the collation key doesn't map back are resolved one at a time
+    found = Auth.xlookup_many('651', 'a', ['Coeur 7', 'Spain'], record_type='bib')
+    assert found == {'Coeur 7': [heart.id], 'Spain': []}
+
+def test_lookup_many(db, valkey_client):
+    from dlx import DB
+    from dlx.marc import Bib, Auth
+
+    Auth().set('150', 'a', 'Header').commit()
+
+    for cache in (None, valkey_client):
+        DB.cache = cache
+        Auth.caches.clear()
+        assert Auth.lookup_many([(1, 'a'), (2, 'a'), (9, 'a')]) == {(1, 'a'): 'Header', (2, 'a'): 'Another header', (9, 'a'): None}
+        assert Auth.xlookup_many('650', 'a', ['Header', 'Invalid'], record_type='bib') == {'Header': [1, 3], 'Invalid': []}
+        assert Auth.xlookup_many('710', 'a', ['Another header'], record_type='bib') == {'Another header': [2]}
+        assert Auth.xlookup_many('245', 'a', ['Title'], record_type='bib') is None
+
+        # values that don't resolve are cached
+        DB.auths.insert_one({'_id': 99, '150': [{'indicators': [' ', ' '], 'subfields': [{'code': 'a', 'value': 'Invalid'}]}]})
+        assert Auth.xlookup_many('650', 'a', ['Invalid'], record_type='bib') == {'Invalid': []}
+        DB.auths.delete_one({'_id': 99})
+
+        # from cache
+        hits = Auth.caches('value').stats()['hits'], Auth.caches('xref').stats()['hits']
+        assert Auth.lookup_many([(2, 'a')]) == {(2, 'a'): 'Another header'}
+        assert Auth.xlookup('650', 'a', 'Header', record_type='bib') == [1, 3]
+        assert (Auth.caches('value').stats()['hits'], Auth.caches('xref').stats()['hits']) == (hits[0] + 1, hits[1] + 1)
+
+    DB.cache = None
+    bib = Bib.from_mrk('=245  \\\\$aTitle\n=710  \\\\$aAnother header', auth_control=True)
+    assert bib.get_xref('710', 'a') == 2
+
 def test_auth_control(db):
     from dlx.marc import Bib, InvalidAuthValue
     
@@ -933,10 +1053,28 @@ def test_partial_lookup(db):
         Auth().set('150', 'a', f'Header{i}').commit()
     
     assert len(Auth.partial_lookup('650', 'a', 'eader', record_type='bib')) == 25
-    assert len(Auth._pcache['650']['a']['eader']) == 25
+    assert len(Auth.caches('partial').get(('650', 'a', 'eader'))) == 25
     
-    Auth._pcache['650']['a']['eader'] = ['dummy']
+    Auth.caches('partial').set(('650', 'a', 'eader'), ['dummy'])
     assert len(Auth.partial_lookup('650', 'a', 'eader', record_type='bib')) == 1
+
+    # typeahead index
+    Auth.caches.clear()
+    Auth.build_typeahead()
+    results = Auth.partial_lookup('650', 'a', 'HEAD', record_type='bib')
+    assert [x.heading_value('a') for x in results[:3]] == ['Header', 'Header0', 'Header1']
+    assert len(Auth.partial_lookup('650', 'a', 'eader', record_type='bib')) == 25
+    assert Auth.partial_lookup('650', 'a', 'der9', record_type='bib')[0].heading_value('a') == 'Header9'
+    assert len(Auth.partial_lookup('650', 'a', 'r', record_type='bib', limit=5)) == 5
+    assert Auth.typeahead.search('150', 'a', 'der.') is None
+
+    # kept up to date
+    auth = Auth().set('150', 'a', 'Typeahead test').commit()
+    assert Auth.partial_lookup('650', 'a', 'ahead', record_type='bib')[0].heading_value('a') == 'Typeahead test'
+    auth.delete()
+    assert Auth.partial_lookup('650', 'a', 'ahead', record_type='bib') == []
+    Auth.from_id(1).set('150', 'a', 'Changed').commit()
+    assert Auth.partial_lookup('650', 'a', 'Header', record_type='bib')[0].id != 1
     
 def test_diff(db):
     from dlx.marc import Bib, Field, Diff
@@ -1024,6 +1162,72 @@ def test_auth_use_count(db, bibs, auths):
     
     assert auth.in_use() == 1
 
+def test_auth_use_counters(db, bibs, auths):
+    from dlx import DB
+    from dlx.marc import Bib, Auth, AuthInUse
+
+    # not materialized, falls back to querying
+    assert DB.handle['auth_use'].find_one({'_id': 1}) is None
+    assert Auth.from_id(1).in_use(usage_type='bib') == 2
+
+    assert Auth.build_use_counts() == 2
+    assert DB.handle['auth_use'].find_one({'_id': 1}) == {'_id': 1, 'bib': 2, 'auth': 0}
+    assert DB.handle['auth_use'].find_one({'_id': 2}) == {'_id': 2, 'bib': 1, 'auth': 0}
+
+    # incremental updates
+    bib = Bib().set('650', 'a', 2)
+    bib.set('650', 'a', 2, address=['+'])
+    bib.commit()
+    assert Auth.from_id(2).in_use(usage_type='bib') == 2
+
+    bib.set('650', 'a', 1, address=[0]).commit()
+    assert DB.handle['auth_use'].find_one({'_id': 1})['bib'] == 3
+    assert DB.handle['auth_use'].find_one({'_id': 2})['bib'] == 2
+
+    bib.delete()
+    assert Auth.from_id(1).in_use() == 2
+    assert Auth.from_id(2).in_use() == 1
+
+    auth = Auth().set('100', 'a', 'New').commit()
+    assert DB.handle['auth_use'].find_one({'_id': auth.id}) == {'_id': auth.id, 'bib': 0, 'auth': 0}
+    other = Auth().set('500', 'a', auth.id).commit()
+    assert auth.in_use(usage_type='auth') == 1
+
+    other.delete()
+    auth.delete()
+    assert DB.handle['auth_use'].find_one({'_id': auth.id}) is None
+
+    # drift from records written without commit
+    DB.handle['auth_use'].update_one({'_id': 1}, {'$set': {'bib': -1}})
+    assert Auth.from_id(1).in_use(usage_type='bib') == 2
+
+    # a count of 0 is confirmed by querying before deleting
+    DB.handle['auth_use'].update_one({'_id': 1}, {'$set': {'bib': 0}})
+    assert Auth.from_id(1).in_use(usage_type='bib') == 0
+    assert Auth.from_id(1).in_use(usage_type='bib', exact=True) == 2
+
+    with pytest.raises(AuthInUse):
+        Auth.from_id(1).delete()
+
+    # a stale positive count doesn't prevent deleting an auth that is not in use
+    auth = Auth().set('100', 'a', 'Unused').commit()
+    DB.handle['auth_use'].update_one({'_id': auth.id}, {'$set': {'bib': 1}})
+    assert auth.in_use() == 1 and auth.in_use(exact=True) == 0
+    auth.delete()
+    assert Auth.from_id(auth.id) is None
+
+    # commits during a build mark the auths in the new counts, which are recounted
+    DB.handle['auth_use_build'].insert_many([{'_id': 1, 'bib': 0, 'auth': 0}, {'_id': 2, 'bib': 0, 'auth': 0}])
+    Bib().set('650', 'a', 1).commit()
+    assert DB.handle['auth_use_build'].find_one({'_id': 1})['touched'] == True
+    assert 'touched' not in DB.handle['auth_use_build'].find_one({'_id': 2})
+    Auth._recount_touched(DB.handle['auth_use_build'])
+    assert DB.handle['auth_use_build'].find_one({'_id': 1}) == {'_id': 1, 'bib': 3, 'auth': 0}
+
+    assert Auth.build_use_counts() == 2
+    assert 'auth_use_build' not in DB.handle.list_collection_names()
+    assert DB.handle['auth_use'].find_one({'_id': 1}) == {'_id': 1, 'bib': 3, 'auth': 0}
+
 def test_auth_merge():
     from dlx import DB
     from dlx.marc import Bib, Auth
@@ -1083,6 +1287,33 @@ def test_logical_fields(db):
     bib2.delete()
     assert DB.handle['_index_test_field'].find_one({'_id': 'logical value 1'}) == None
 
+    # reference counts
+    bib = Bib().set('867', 'a', 'counted').set('867', 'z', 'counted').commit()
+    bib2 = Bib().set('867', 'a', 'counted').commit()
+    assert DB.handle['_index_test_field'].find_one({'_id': 'counted'})['count'] == {'bib': 2, 'auth': 0}
+    bib.set('867', 'a', 'changed').set('867', 'z', 'changed').commit()
+    assert DB.handle['_index_test_field'].find_one({'_id': 'counted'})['count'] == {'bib': 1, 'auth': 0}
+    assert DB.handle['_index_test_field'].find_one({'_id': 'changed'})['count'] == {'bib': 1, 'auth': 0}
+    bib2.set('867', 'a', 'changed').commit()
+    assert DB.handle['_index_test_field'].find_one({'_id': 'counted'}) is None
+    assert DB.handle['_index_test_field'].find_one({'_id': 'changed'})['count'] == {'bib': 2, 'auth': 0}
+
+    # entries without counts are checked against the records
+    DB.handle['_index_test_field'].update_one({'_id': 'changed'}, {'$unset': {'count': 1}})
+    bib.set('867', 'a', 'other').set('867', 'z', 'other').commit()
+    assert DB.handle['_index_test_field'].find_one({'_id': 'changed'})
+    bib2.delete()
+    assert DB.handle['_index_test_field'].find_one({'_id': 'changed'}) is None
+
+    # counts are not created on entries built before the counts existed
+    from dlx.marc import Auth
+    DB.handle['_index_subject'].insert_one({'_id': 'legacy', 'text': ' legacy ', '_record_type': ['default']})
+    DB.bibs.insert_one({'_id': 100, 'subject': ['legacy']})
+    auth = Auth().set('150', 'a', 'legacy').commit()
+    assert 'count' not in DB.handle['_index_subject'].find_one({'_id': 'legacy'})
+    auth.set('150', 'a', 'not legacy').commit()
+    assert DB.handle['_index_subject'].find_one({'_id': 'legacy'})
+
 def test_bib_files(db, bibs):
     from datetime import datetime
     from dlx import DB
@@ -1103,6 +1334,35 @@ def test_list_attached(db, bibs, auths):
     assert auth.list_attached()[0].id == 1
     assert auth.list_attached()[1].id == 2
 
+    # once per record, in batches
+    Bib().set('650', 'a', 1).set('651', 'a', 1).commit()
+    [Auth().set('150', 'a', f'related {i}').set('550', 'a', 1).commit() for i in range(3)]
+    attached = auth.iter_attached(projection={'650': 1}, batch_size=2)
+    assert not isinstance(attached, list)
+    attached = list(attached)
+    assert [x.record_type for x in attached] == ['bib'] * 3 + ['auth'] * 3
+    assert len(set([x.id for x in attached if x.record_type == 'bib'])) == 3
+    assert attached[0].get_field('245') is None
+    assert attached[0].get_value('650', 'a') == auth.heading_value('a')
+
+def test_cache_fork(db, valkey_client):
+    import os
+    from dlx import DB
+    from dlx.marc import Auth
+
+    DB.cache = valkey_client
+    Auth.caches('xref')
+    bus = Auth.caches.bus
+    pid = os.fork()
+
+    if pid == 0:
+        # the shared caches are connected again in the child, with a new bus
+        os._exit(0 if Auth.caches.client is None and Auth.caches('xref') and Auth.caches.bus not in (None, bus) else 1)
+
+    assert os.waitpid(pid, 0)[1] == 0
+    assert Auth.caches.bus is bus
+    DB.cache = None
+
 def test_resolve_ambiguous(db):
     from dlx.marc import Bib, Auth, AmbiguousAuthValue, Literal
 
@@ -1119,6 +1379,37 @@ def test_resolve_ambiguous(db):
 
     assert xref == auth.id
 
+    # resolutions are stored in the shared cache
+    import json, fakeredis
+    from dlx import DB
+
+    DB.cache = fakeredis.FakeValkey()
+    assert all(Auth.caches(name).index for name in ('multi', 'ambiguous'))
+    subfields = [Literal(code='a', value='ambiguous')]
+    assert Auth.resolve_ambiguous(tag='700', subfields=subfields, record_type='bib') == auth.id
+    assert DB.cache.get("authambiguouscache:('700', 'bib', (('a', 'ambiguous'),))") == str(auth.id).encode()
+    assert len(json.loads(DB.cache.get("xauthmulticache:('100', (('a', 'ambiguous'),))"))) == 2
+    assert Auth.resolve_ambiguous(tag='700', subfields=subfields, record_type='bib') == auth.id
+    assert set(DB.cache.smembers('authambiguouscacheindex:ambiguous')) == {b"authambiguouscache:('700', 'bib', (('a', 'ambiguous'),))"}
+
+    # evicted when a heading with the value changes, without scanning the namespace
+    scan_iter, DB.cache.scan_iter = DB.cache.scan_iter, None
+    Auth().set('100', 'a', 'ambiguous').commit()
+    DB.cache.scan_iter = scan_iter
+    assert DB.cache.get("authambiguouscache:('700', 'bib', (('a', 'ambiguous'),))") is None
+    assert DB.cache.get("xauthmulticache:('100', (('a', 'ambiguous'),))") is None
+    assert not DB.cache.exists('authambiguouscacheindex:ambiguous', 'xauthmulticacheindex:ambiguous')
+    assert Auth.resolve_ambiguous(tag='700', subfields=subfields, record_type='bib') is None
+
+    # entries cached for case and diacritic variants of the value are evicted too
+    variant = [Literal(code='a', value='AMBÍGUOUS')]
+    Auth.resolve_ambiguous(tag='700', subfields=variant, record_type='bib')
+    assert DB.cache.get("xauthmulticache:('100', (('a', 'AMBÍGUOUS'),))") is not None
+    assert DB.cache.exists('xauthmulticacheindex:ambiguous')
+    Auth.from_id(auth.id).set('100', 'a', 'Renamed').commit()
+    assert DB.cache.get("xauthmulticache:('100', (('a', 'AMBÍGUOUS'),))") is None
+    DB.cache = None
+
 def test_history(db):
     from datetime import datetime
     from dlx.marc import Bib, Auth, BibHistory, AuthHistory, Query
@@ -1145,6 +1436,61 @@ def test_history(db):
     assert isinstance(restored, Bib)
     assert Bib.from_id(bib.id)
 
+    # buckets
+    from dlx import DB, Config
+    Config.history_bucket_size = 2
+    bib = Bib().set('245', 'a', 'version 1').commit()
+    [bib.set('245', 'a', f'version {i}').commit() for i in range(2, 6)]
+    assert DB.handle['bib_history_buckets'].count_documents({'record_id': bib.id}) == 3
+    assert DB.handle['bib_history'].find_one({'_id': bib.id})['versions'] == 5
+    assert [x.get_value('245', 'a') for x in bib.history()] == [f'version {i}' for i in range(1, 6)]
+    assert bib.revert(4).get_value('245', 'a') == 'version 4'
+    assert BibHistory.latest(bib.id)['245'][0]['subfields'][0]['value'] == 'version 5'
+    Config.history_bucket_size = 100
+
+    # unmigrated
+    DB.handle['bib_history'].insert_one({'_id': 999, 'history': [Bib().set('245', 'a', 'legacy').to_bson() | {'_id': 999}]})
+    bib.id = 999
+    bib.set('245', 'a', 'not legacy').commit()
+    assert [x.get_value('245', 'a') for x in bib.history()] == ['legacy', 'not legacy']
+    query = Query.from_string("245__a:'legacy' OR 245__a:'version 1'")
+    assert BibHistory._matching_ids(query, sort=[('_id', 1)]) == [4, 999]
+    assert BibHistory._matching_ids(query, sort=[('_id', -1)], limit=1) == [999]
+    assert BibHistory._matching_ids(query, sort=[('_id', 1)], skip=1, limit=1) == [999]
+
+    # deltas
+    Config.history_deltas, Config.history_bucket_size, Config.history_keyframe_interval = True, 4, 2
+    bib = Bib().set('245', 'a', 'version 1').set('500', 'a', 'note').commit()
+    bib.set('245', 'a', 'version 2').commit()
+    bib.delete_field('500')
+    bib.set('245', 'a', 'version 3').commit()
+    [bib.set('245', 'a', f'version {i}').set('520', 'a', f'summary {i}').commit() for i in range(4, 8)]
+    bucket = DB.handle['bib_history_buckets'].find_one({'_id': f'{bib.id}.0'})
+    assert [bool(x.get('_delta')) for x in bucket['history']] == [False, True, False, True]
+    assert bucket['history'][1].get('500') is None and bucket['history'][1].get('text')
+    history = bib.history()
+    assert [x.get_value('245', 'a') for x in history] == [f'version {i}' for i in range(1, 8)]
+    assert history[1].get_value('500', 'a') == 'note' and history[2].get_field('500') is None
+    assert history[6].get_value('520', 'a') == 'summary 7'
+    assert BibHistory.version(bib.id, 6)['520'][0]['subfields'][0]['value'] == 'summary 6'
+    assert BibHistory.latest(bib.id)['245'][0]['subfields'][0]['value'] == 'version 7'
+    assert bib.revert(2).get_value('500', 'a') == 'note'
+    assert next(BibHistory.from_query(Query.from_string("520__a:'summary 5'")), None).id == bib.id
+    # the unchanged fields and derived keys of the deltas are matched
+    assert list(BibHistory._matching_ids(Query.from_string("245__a:'version 2' AND 500__a:'note'"))) == [bib.id]
+    assert list(BibHistory._matching_ids(Query.from_string("title:'version 6'"))) == [bib.id]
+    bib.delete()
+    assert next(BibHistory.find_deleted(Query.from_string("245__a:'version 6' AND 520__a:'summary 6'")), None) == bib.id
+    assert BibHistory.restore(bib.id).get_value('520', 'a') == 'summary 7'
+
+    # not stored as a delta if another version was reserved after the previous state was read
+    bib = Bib().set('245', 'a', 'version 1').commit()
+    DB.handle['bib_history'].update_one({'_id': bib.id}, {'$set': {'last': 'another version'}})
+    bib.set('245', 'a', 'version 2').commit()
+    bucket = DB.handle['bib_history_buckets'].find_one({'_id': f'{bib.id}.0'})
+    assert [bool(x.get('_delta')) for x in bucket['history']] == [False, False]
+    Config.history_deltas, Config.history_bucket_size, Config.history_keyframe_interval = False, 100, 10
+
 def test_auth_deleted_subfield(db):
     from dlx.marc import Bib, Auth, Query
 
@@ -1190,17 +1536,17 @@ def test_redis(db, redis_client, valkey_client):
         h1, h2 = f'Header {rand}', f'Another header {rand}'
         Auth().set('100', 'a', h1).commit()
         Auth().set('100', 'a', h2).commit()
-        assert not Auth._cache
-        assert client.get('authcache:1').decode('utf8') == json.dumps({'a': h1})
-        assert client.get('authcache:2').decode('utf8') == json.dumps({'a': h2})
+        assert len(Auth.caches.memory['value']) == 0
+        assert client.hgetall('authvalues:1') == {b'a': json.dumps(h1).encode()}
+        assert client.hgetall('authvalues:2') == {b'a': json.dumps(h2).encode()}
         assert Auth.lookup(2, 'a') == h2
 
         # xlookup
         assert Auth.xlookup('100', 'a', h1, record_type='bib') == [1]
-        assert client.get(f'xauthcache:{h1}').decode('utf8') == json.dumps({'100': {'a': [1]}})
+        assert client.get(f'xauthcache:{h1.lower()}').decode('utf8') == json.dumps({'100': {'a': [1]}})
         Auth.from_id(1).set('100', 'a', 'Header updated').commit()
-        assert client.get('xauthcache:Header updated')
-        assert json.loads(client.get(f'xauthcache:{h1}')).get('100').get('a') == []
+        assert client.get('xauthcache:header updated')
+        assert json.loads(client.get(f'xauthcache:{h1.lower()}')).get('100').get('a') == []
 
     DB.cache = None
 
@@ -1209,11 +1555,11 @@ def test_valkey_cache(db, auths, valkey_client):
     from dlx import DB
     from dlx.marc import Bib, Auth
     
-    Auth._cache = {}
+    Auth.caches.clear()
     DB.connect('mongomock://localhost', cache=valkey_client)
     auth = Auth().set('100', 'a', 'New header')
     auth.commit()
-    assert valkey_client.get('authcache:1').decode() == json.dumps({'a': 'New header'})
+    assert valkey_client.hgetall('authvalues:1') == {b'a': b'"New header"'}
     assert Auth.lookup(auth.id, 'a') == 'New header'
     assert Auth.xlookup('700', 'a', 'New header', record_type='bib') == [auth.id]
     bib = Bib().set('700', 'a', auth.id)
@@ -1224,7 +1570,232 @@ def test_valkey_cache(db, auths, valkey_client):
     auth = Auth({'_id': 2}).set('110', 'a', 'Organization')
     DB.auths.insert_one(auth.to_dict())
     Auth.build_cache()
-    assert valkey_client.get('authcache:2').decode() == json.dumps({'a': 'Organization'})
+    assert valkey_client.hgetall('authvalues:2') == {b'a': b'"Organization"'}
     assert Auth.lookup(2, 'a') == 'Organization'
     assert auth.in_use() == 0
 
+    # batches and threads
+    DB.auths.insert_many([{'_id': i, '150': [{'indicators': [' ', ' '], 'subfields': [{'code': 'a', 'value': f'Heading {i}'}]}]} for i in range(3, 20)])
+    valkey_client.flushall()
+    Auth.build_cache(batch_size=2, threads=3)
+    assert Auth.caches('value').get_many(range(1, 20)) == {1: {'a': 'New header'}, 2: {'a': 'Organization'}, **{i: {'a': f'Heading {i}'} for i in range(3, 20)}}
+
+def test_auth_cache(db, valkey_client):
+    import time
+    from dlx import DB
+    from dlx.marc import Bib, Auth
+    from dlx.marc.cache import MemoryCache, RedisCache
+
+    # lru
+    cache = MemoryCache(maxsize=2)
+    cache.set_many({1: 'a', 2: 'b'})
+    assert cache.get(1) == 'a'
+    cache.set(3, 'c')
+    assert cache.get(2) is None
+    assert cache.get_many([1, 3]) == {1: 'a', 3: 'c'}
+    assert cache.stats() == {'hits': 3, 'misses': 1, 'evictions': 1, 'size': 2, 'bytes': 0}
+
+    # ttl and memory cap
+    cache = MemoryCache(ttl=.01, max_bytes=1000)
+    cache.set(1, 'x' * 100)
+    cache.set(2, 'x' * 900)
+    assert 1 not in cache and 2 in cache
+    time.sleep(.02)
+    assert cache.get(2) is None
+    assert cache.stats()['evictions'] == 2
+
+    # same interface
+    cache = RedisCache(valkey_client, prefix='test:')
+    cache.set(1, {'a': 'x'})
+    cache.merge_many({1: {'b': 'y'}})
+    assert cache.get(1) == {'a': 'x', 'b': 'y'}
+    cache.delete(1)
+    assert cache.get(1) is None
+
+    # targeted invalidation
+    Auth.caches.clear()
+    assert Bib.from_id(1).get_value('650', 'a') == 'Header'
+    assert Bib.from_id(1).get_value('710', 'a') == 'Another header'
+    assert Auth.xlookup('650', 'a', 'Header', record_type='bib') == [1]
+    # case and diacritic variants share the entry, as the values are matched under the default collation
+    assert Auth.xlookup('650', 'a', 'HÉADER', record_type='bib') == [1]
+    assert Auth.partial_lookup('650', 'a', 'head', record_type='bib')
+    Auth.caches('partial').set(('710', 'a', 'another'), ['unrelated'])
+    Auth.from_id(1).set('150', 'a', 'Changed').commit()
+    assert Auth.caches('value').get(2) == {'a': 'Another header'}
+    assert Auth.caches('value').get(1) == {'a': 'Changed'}
+    assert Auth.caches('xref').get('header') is None
+    assert Auth.xlookup('650', 'a', 'HÉADER', record_type='bib') == []
+    assert Auth.caches('partial').get(('650', 'a', 'head')) is None
+    assert Auth.caches('partial').get(('710', 'a', 'another'))
+    assert Auth.xlookup('650', 'a', 'Header', record_type='bib') == []
+
+    stats = Auth.caches.stats()
+    assert stats['value']['hits'] and stats['value']['misses']
+
+def test_cache_invalidation_bus(db, valkey_client):
+    from dlx import DB
+    from dlx.marc import Auth
+    from dlx.marc.cache import CacheNamespaces
+
+    DB.cache = valkey_client
+    Auth.caches.clear()
+    # another process
+    other = CacheNamespaces()
+    other('partial').set(('650', 'a', 'head'), ['cached'])
+    other('partial').set(('650', 'a', 'unrelated'), ['cached'])
+    other('value').set(1, {'a': 'Header'})
+    other.memory['value'].set(1, {'a': 'Header'})
+
+    Auth.from_id(1).set('150', 'a', 'Changed').commit()
+    other.bus.poll()
+    assert other('partial').get(('650', 'a', 'head')) is None
+    assert other('partial').get(('650', 'a', 'unrelated')) == ['cached']
+    assert other.memory['value'].get(1) is None
+    # the shared cache was updated by the committing process
+    assert other('value').get(1) == {'a': 'Changed'}
+
+    # delete
+    auth = Auth().set('150', 'a', 'To be deleted').commit()
+    other.bus.poll()
+    other('partial').set(('650', 'a', 'deleted'), ['cached'])
+    auth.delete()
+    other.bus.poll()
+    assert other('partial').get(('650', 'a', 'deleted')) is None
+
+    # own messages are ignored
+    Auth.caches.bus.poll()
+    other.bus.stop()
+    DB.cache = None
+
+def test_from_mrc(db, tmp_path):
+    from dlx.marc import Bib, BibSet, InvalidRecordString
+
+    bib = Bib.from_query({'_id': 1})
+    bib.set('500', 'a', 'Multibyte é 中文')
+    mrc = bib.to_mrc()
+    parsed = Bib.from_mrc(mrc.encode('utf-8'), auth_control=False)
+    assert parsed.id == 1
+    assert parsed.get_value('500', 'a') == 'Multibyte é 中文'
+    assert parsed.get_value('245', 'b') == 'is the'
+    assert parsed.to_mrc() == mrc
+
+    # auth control
+    parsed = Bib.from_mrc(mrc, auth_control=True)
+    assert parsed.get_xref('650', 'a') == 1
+
+    with pytest.raises(InvalidRecordString):
+        Bib.from_mrc(mrc.encode('utf-8')[:-10])
+
+    # file
+    path = tmp_path / 'bibs.mrc'
+    path.write_text(BibSet.from_query({}).to_mrc(), encoding='utf-8')
+    bibset = BibSet.from_mrc_file(str(path), auth_control=False)
+    assert [x.id for x in bibset] == [1, 2]
+    assert BibSet.from_mrc(path.read_bytes()).records[1].get_value('245', 'a') == 'Another'
+
+    # a record length shorter than the leader
+    for data in (b'00000r|||a2200000|||4500', b'00012r|||a22'):
+        with pytest.raises(InvalidRecordString):
+            BibSet.from_mrc(data)
+
+def test_serialization_golden(db):
+    # the serializations must not change. the control data is in ./serializations.json
+    import os, json
+    from xml.etree import ElementTree
+    from dlx import DB
+    from dlx.marc import Bib, Auth
+
+    DB.auths.replace_one({'_id': 1}, {'_id': 1, '150': [{'indicators': [' ', ' '], 'subfields': [{'code': 'a', 'value': 'Header é'}]}], '994': [{'indicators': [' ', ' '], 'subfields': [{'code': 'a', 'value': 'Título'}]}]})
+    Auth.caches.clear()
+
+    records = [
+        Bib({'_id': 7, '000': ['leader'], '001': ['old id'], '008': ['controlfield'], '245': [{'indicators': ['1','0'], 'subfields': [{'code':'a','value':'中文 title'},{'code':'b','value':'sub'}]}], '650': [{'indicators': [' ',' '], 'subfields': [{'code':'a','xref':1}]}, {'indicators': [' ',' '], 'subfields': [{'code':'a','xref':1},{'code':'0','value':'99'}]}]}),
+        Bib().set('245', 'a', 'no id é').set('520', 'a', 'x'),
+        Bib({'_id': 8, '245': [{'indicators': [' ',' '], 'subfields': [{'code':'a','value':'t'}]}], '650': [{'indicators': [' ',' '], 'subfields': [{'code':'a','xref':1}]}]})
+    ]
+
+    output = []
+
+    for record in records:
+        original = record.to_dict()
+
+        for kwargs in ({}, {'write_id': False}, {'language': 'es'}):
+            output += [record.to_mrc(**kwargs), record.to_mrk(**kwargs), ElementTree.tostring(record.to_xml_raw(**kwargs), encoding='unicode')]
+
+        output += [record.to_mrc('245', '001'), record.to_mrc('245'), ElementTree.tostring(record.to_xml_raw('650', '001'), encoding='unicode')]
+        output.append(record.to_xml(xref_prefix='(DHL)'))
+
+        # serializing does not alter the record
+        assert record.to_dict() == original
+
+    with open(os.path.join(os.path.dirname(__file__), 'serializations.json'), encoding='utf-8') as fh:
+        assert output == json.load(fh)
+
+def test_compact(db, bibs):
+    from dlx.marc import Bib, BibSet, Literal, Linked, Datafield, Controlfield
+
+    bib = Bib(bibs[0], keep_data=False)
+    assert bib.data == {}
+    assert bib.get_value('245', 'a') == 'This'
+
+    for obj in (bib.get_field('000'), bib.get_field('245'), bib.get_subfield('245', 'a'), bib.get_subfield('650', 'a')):
+        assert isinstance(obj, (Literal, Linked, Datafield, Controlfield))
+        assert not hasattr(obj, '__dict__')
+
+    assert next(BibSet.from_query({}, keep_data=False)).data == {}
+    assert next(BibSet.from_query({})).data['_id'] == 1
+
+def test_field_index(db, bibs):
+    from dlx.marc import Bib, Datafield, Literal
+
+    bib = Bib(bibs[0])
+    assert bib.get_tags() == ['000', '008', '245', '520', '650', '710']
+    assert [x.tag for x in bib.get_fields('710', '245')] == ['245', '710']
+
+    # direct mutation of the fields list
+    bib.fields.append(Datafield(tag='100', subfields=[Literal('a', 'appended')]))
+    assert bib.get_value('100', 'a') == 'appended'
+    assert bib.get_tags()[2] == '100'
+    del bib.fields[-1]
+    assert bib.get_field('100') is None
+    bib.fields = [x for x in bib.fields if x.tag != '245']
+    assert bib.get_field('245') is None
+    bib.fields += [Datafield(tag='999', subfields=[Literal('a', 'added')])]
+    assert bib.get_value('999', 'a') == 'added'
+
+    # tag change
+    bib.get_field('999').tag = '998'
+    assert bib.get_field('999') is None
+    assert bib.get_value('998', 'a') == 'added'
+
+    # set / delete
+    bib.set('520', 'a', 'new', address=['+'])
+    assert bib.get_field('520', place=2).get_value('a') == 'new'
+    assert bib.get_field('520', place=-1).get_value('a') == 'new'
+    bib.delete_field('520', place=0)
+    assert bib.get_values('520', 'a') == ['Another description', 'Repeated subfield', 'new']
+    bib.delete_fields('520', '650')
+    assert bib.get_tags() == ['000', '008', '710', '998']
+    assert [x.tag for x in bib.datafields] == ['710', '998']
+    assert [x.tag for x in bib.controlfields] == ['000', '008']
+
+def test_lazy(db, bibs, auths):
+    from dlx.marc import Bib, Auth, BibSet
+
+    bib = Bib(bibs[0], lazy=True)
+    assert bib.get_value('245', 'a') == 'This'
+    assert set(bib._unparsed.keys()) == {'000', '008', '520', '650', '710'}
+    assert bib.get_values('520', 'a') == ['Description', 'Another description', 'Repeated subfield']
+    assert '520' not in bib._unparsed
+
+    # mutation parses the rest of the fields
+    bib.set('999', 'a', 'new')
+    assert not bib._unparsed
+    assert [x.tag for x in bib.fields] == [x.tag for x in Bib(bibs[0]).fields] + ['999']
+    assert bib.to_mrk() == Bib(bibs[0]).set('999', 'a', 'new').to_mrk()
+
+    # serialization
+    assert Bib(bibs[0], lazy=True).to_dict() == Bib(bibs[0]).to_dict()
+    assert Auth(auths[0], lazy=True).heading_field.get_value('a') == 'Header'
+    assert [x.get_value('245', 'a') for x in BibSet.from_query({}, lazy=True)] == ['This', 'Another']
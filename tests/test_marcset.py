@@ -322,3 +322,74 @@ def test_from_aggregation(db, bibs):
     )
     assert isinstance(bibs, BibSet)
     assert bibs.count == 2
+
+def test_write(db):
+    from io import StringIO
+    from dlx.marc import BibSet
+
+    controls = {
+        'mrc': '00238r|||a2200109|||4500001000200000008001300002245002400015520001600039520004300055650001100098710001900109\x1e1\x1econtrolfield\x1e  \x1faThis\x1fbis the\x1fctitle\x1e  \x1faDescription\x1e  \x1faAnother description\x1faRepeated subfield\x1e  \x1faHeader\x1e  \x1faAnother header\x1e\x1d00102r|||a2200061|||4500001000200000245002700002650001100029\x1e2\x1e  \x1faAnother\x1fbis the\x1fctitle\x1e  \x1faHeader\x1e\x1d',
+        'mrk': '=000  leader\n=001  1\n=008  controlfield\n=245  \\\\$aThis$bis the$ctitle\n=520  \\\\$aDescription\n=520  \\\\$aAnother description$aRepeated subfield\n=650  \\\\$aHeader$01\n=710  \\\\$aAnother header$02\n\n=000  leader\n=001  2\n=245  \\\\$aAnother$bis the$ctitle\n=650  \\\\$aHeader$01\n',
+        'xml': '<collection><record><controlfield tag="000">leader</controlfield><controlfield tag="001">1</controlfield><controlfield tag="008">controlfield</controlfield><datafield tag="245" ind1=" " ind2=" "><subfield code="a">This</subfield><subfield code="b">is the</subfield><subfield code="c">title</subfield></datafield><datafield tag="520" ind1=" " ind2=" "><subfield code="a">Description</subfield></datafield><datafield tag="520" ind1=" " ind2=" "><subfield code="a">Another description</subfield><subfield code="a">Repeated subfield</subfield></datafield><datafield tag="650" ind1=" " ind2=" "><subfield code="a">Header</subfield><subfield code="0">1</subfield></datafield><datafield tag="710" ind1=" " ind2=" "><subfield code="a">Another header</subfield><subfield code="0">2</subfield></datafield></record><record><controlfield tag="000">leader</controlfield><controlfield tag="001">2</controlfield><datafield tag="245" ind1=" " ind2=" "><subfield code="a">Another</subfield><subfield code="b">is the</subfield><subfield code="c">title</subfield></datafield><datafield tag="650" ind1=" " ind2=" "><subfield code="a">Header</subfield><subfield code="0">1</subfield></datafield></record></collection>',
+        'csv': '1.001,1.245__,1.245$a,1.245$b,1.245$c,1.520__,1.520$a,2.520__,2.520$a,1.650$0,1.650__,1.650$a,1.710$0,1.710__,1.710$a\n1,__,This,is the,title,__,Description,__,Another description||Repeated subfield,1,__,Header,2,__,Another header\n2,__,Another,is the,title,,,,,1,__,Header,,,',
+        'tsv': '1.001\t1.245__\t1.245$a\t1.245$b\t1.245$c\t1.520__\t1.520$a\t2.520__\t2.520$a\t1.650$0\t1.650__\t1.650$a\t1.710$0\t1.710__\t1.710$a\n1\t__\tThis\tis the\ttitle\t__\tDescription\t__\tAnother description||Repeated subfield\t1\t__\tHeader\t2\t__\tAnother header\n2\t__\tAnother\tis the\ttitle\t\t\t\t\t1\t__\tHeader\t\t\t'
+    }
+
+    for fmt, control in controls.items():
+        fh = StringIO()
+        getattr(BibSet.from_query({}), f'write_{fmt}')(fh)
+        assert fh.getvalue() == control
+
+    # empty set
+    fh = StringIO()
+    BibSet().write_xml(fh)
+    assert fh.getvalue() == '<collection />'
+    assert BibSet().to_xml() == '<collection />'
+
+def test_from_xml_stream(db, tmp_path):
+    from io import StringIO
+    from dlx.marc import BibSet, Bib
+
+    xml = BibSet.from_query({}).to_xml()
+    bibset = BibSet.from_xml_stream(StringIO(xml))
+    assert isinstance(next(bibset), Bib)
+    assert next(bibset).get_value('245', 'a') == 'Another'
+    assert next(bibset, None) is None
+
+    # namespaced, from file
+    path = tmp_path / 'bibs.xml'
+    path.write_text(xml.replace('<collection>', '<collection xmlns="http://www.loc.gov/MARC21/slim">'), encoding='utf-8')
+    assert [x.id for x in BibSet.from_xml_stream(str(path))] == [1, 2]
+
+def test_from_mrk_stream(db):
+    from io import StringIO
+    from dlx.marc import BibSet
+
+    control = BibSet.from_query({}).to_mrk()
+    assert BibSet.from_mrk_stream(StringIO(control)).to_mrk() == control
+
+    # missing blank line between records
+    bibs = list(BibSet.from_mrk_stream(StringIO(control.replace('\n\n', '\n'))))
+    assert [x.id for x in bibs] == [1, 2]
+    
+    # extra blank lines
+    bibs = list(BibSet.from_mrk_stream(StringIO('\n\n' + control.replace('\n\n', '\n\n\n') + '\n\n')))
+    assert [x.id for x in bibs] == [1, 2]
+
+def test_prefetched(db, valkey_client):
+    from dlx import DB
+    from dlx.marc import BibSet, Auth
+
+    Auth.caches.clear()
+    bibs = list(BibSet.from_query({}).prefetched(chunk_size=1))
+    assert len(bibs) == 2
+    assert Auth.caches('value').get_many([1, 2]) == {1: {'a': 'Header'}, 2: {'a': 'Another header'}}
+
+    Auth.prefetch([(1, 'a')], language='es')
+    assert Auth.caches('lang').get(1)['a']['es'] == '**Linked Auth Translation Not Found**'
+
+    # redis
+    DB.cache = valkey_client
+    Auth.prefetch([(1, 'a'), (2, 'a')])
+    assert valkey_client.hget('authvalues:2', 'a') == b'"Another header"'
+    DB.cache = None
@@ -8,6 +8,13 @@ def test_init_db(db):
     from dlx.scripts import clear_incrementers
     
     assert clear_incrementers.run() is None # runs the function, no return value
+    assert DB.handle['bib_id_counter'].find_one({'_id': 1}) == {'_id': 1, 'count': 0}
+
+    sys.argv[1:] = ['--connect=mongomock://localhost', '--reset']
+    assert clear_incrementers.run() is None
+    assert DB.handle['bib_id_counter'].find_one({'_id': 1}) is None
+    
+    sys.argv[1:] = ['--connect=mongomock://localhost']
     
     from dlx.scripts import init_indexes
     
@@ -45,12 +52,44 @@ def test_build_logical_fields(db):
     assert build_logical_fields.run() == True
     assert bib.handle().find_one({'_id': bib.id}).get('title') == ['Title: subtitle', 'Alt title']
 
+    # browse counts
+    from dlx import DB
+    DB.handle['_index_title'].update_many({}, {'$set': {'count.bib': 5}})
+    DB.handle['_index_title'].insert_one({'_id': 'unused', 'count': {'bib': 1, 'auth': 0}})
+    assert build_logical_fields.run() == True
+    assert DB.handle['_index_title'].find_one({'_id': 'Alt title'})['count'] == {'bib': 1, 'auth': 0}
+    assert DB.handle['_index_title'].find_one({'_id': 'unused'}) is None
+
+    # field text indexes
+    DB.handle['_index_245'].drop()
+    sys.argv[1:] = ['--connect=mongomock://localhost', '--type=bib', '--text-indexes']
+    assert build_logical_fields.run() == True
+    assert DB.handle['_index_245'].find_one({'_id': 'Title: subtitle'})['subfields'] == [{'code': 'a', 'value': 'Title:'}, {'code': 'b', 'value': 'subtitle'}]
+    assert DB.handle['_index_245'].find_one({'_id': 'Title: subtitle'})['text'] == ' title subtitle '
+
     # test fields arg
     bib.handle().update_one({'_id': bib.id}, {'$unset': {'title': 1}})
     sys.argv[1:] = ['--connect=mongomock://localhost', '--type=bib', '--fields=dummy1 dummy2']
     assert build_logical_fields.run() == True
     assert bib.handle().find_one({'_id': bib.id}).get('title') is None
 
+def test_migrate_history(db):
+    from dlx import DB
+    from dlx.marc import Bib
+    from dlx.scripts import migrate_history
+
+    sys.argv[1:] = ['--connect=mongomock://localhost']
+    bib = Bib().set('245', 'a', 'version 2')
+    DB.handle['bib_history'].insert_one({'_id': 999, 'history': [Bib().set('245', 'a', 'version 1').to_bson() | {'_id': 999}]})
+    bib.id = 999
+    bib.commit()
+
+    assert migrate_history.run() == True
+    assert DB.handle['bib_history'].find_one({'_id': 999}).get('history') is None
+    assert DB.handle['bib_history'].find_one({'_id': 999})['versions'] == 2
+    assert DB.handle['bib_history_buckets'].find_one({'record_id': 999})['count'] == 2
+    assert [x.get_value('245', 'a') for x in bib.history()] == ['version 1', 'version 2']
+
 def test_build_text_collections(db):
     from dlx.marc import Bib
     from dlx.scripts import build_text_collections
@@ -60,6 +99,14 @@ def test_build_text_collections(db):
     # interim
     assert build_text_collections.run() is None
 
+def test_build_auth_use(db):
+    from dlx import DB
+    from dlx.scripts import build_auth_use
+
+    sys.argv[1:] = ['--connect=mongomock://localhost']
+    assert build_auth_use.run() == True
+    assert DB.handle['auth_use'].find_one({'_id': 1}) == {'_id': 1, 'bib': 2, 'auth': 0}
+
 def test_auth_merge(db):
     from dlx.marc import Auth
     from dlx.scripts import auth_merge